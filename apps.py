@@ -1,6 +1,25 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.core import checks
 
 
 class UserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user'
+
+    def ready(self):
+        from . import signals
+        from django.contrib.auth.signals import user_logged_in
+        # signals._record_last_login batches what update_last_login saves on every sign in, which auth's ready() connects:
+        # disconnecting it only works once that ran, so check_app_order fails unless auth comes first
+        user_logged_in.disconnect(dispatch_uid = "update_last_login")
+        checks.register(check_app_order)
+
+
+def check_app_order(app_configs, **kwargs):
+    """ Returns an error if django.contrib.auth is listed after user in INSTALLED_APPS """
+    labels = [config.name for config in apps.get_app_configs()]
+    if "django.contrib.auth" in labels and labels.index("django.contrib.auth") > labels.index(UserConfig.name):
+        return [checks.Error("django.contrib.auth must be listed before user in INSTALLED_APPS",
+                             hint = "Otherwise every sign in also saves last_login with django.contrib.auth's update_last_login.",
+                             id = "user.E001")]
+    return []
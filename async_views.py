@@ -0,0 +1,206 @@
+"""
+user async views
+"""
+import functools
+from .models import CustomUser, VerificationCode, SignInEvent
+from rest_framework import status
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.contrib import auth
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from rest_framework.authentication import CSRFCheck
+from .user_utils.view_helpers import _is_subset, _read_data, signup_schema, signin_schema, verify_schema, confirm_schema
+from .user_utils.throttle_helpers import _throttle_sign_in, _record_sign_in
+from .user_utils.audit_helpers import _audit_sign_in
+
+##### Global Constants #####
+# django >= 5.0 ships async login, logout and user resolution; older versions run the sync ones in a thread
+_login        = getattr(auth, "alogin", sync_to_async(auth.login))
+_logout       = getattr(auth, "alogout", sync_to_async(auth.logout))
+_get_user     = getattr(auth, "aget_user", sync_to_async(auth.get_user))
+_hash         = sync_to_async(make_password, thread_sensitive = False)
+
+##### Functions #####
+def _session_csrf(view):
+    """
+    Applies the CSRF rules of the DRF views an async view replaces: exempt from CsrfViewMiddleware, so API clients 
+    without a CSRF cookie are served, but checked like SessionAuthentication when the request comes with a signed in session
+
+    Inputs
+        :param view: <coroutine function> async view
+
+    Outputs
+        :returns: <coroutine function> view checking CSRF for session authenticated requests only
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and (await _get_user(request)).is_authenticated:
+            check = CSRFCheck(lambda request: None)
+            check.process_request(request)
+            if check.process_view(request, None, (), {}) is not None:
+                return HttpResponse(status = status.HTTP_403_FORBIDDEN)
+        return await view(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+@_session_csrf
+async def sign_up(request, *args, **kwargs) -> HttpResponse:
+    """
+    Asynchronous views.sign_up
+
+    Inputs    
+        :param request: <HttpRequest> containing a user's firstName, lastName, dateOfBirth (YYYY-MM-DD), email and password
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_201_CREATED if the user is signed up successfully
+                         ... HTTP_403_FORBIDDEN if email is unreachable 
+                         ... HTTP_405_METHOD_NOT_ALLOWED if the request is not a POST
+                         ... HTTP_412_PRECONDITION_FAILED if one ore more of the request fields don't meet their precondition(s)  
+    """
+    if request.method != "POST": 
+        return HttpResponse(status = status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    cleaned, errors, user_status = signup_schema.validate(_read_data(request))
+
+    if user_status == status.HTTP_200_OK:
+        user, user_status = await CustomUser.objects.acreate(**cleaned)
+
+    if errors:
+        return JsonResponse(errors, status = user_status)
+    return HttpResponse(status = user_status)
+
+@_session_csrf
+async def send_verify(request, *args, **kwargs) -> HttpResponse:
+    """
+    Asynchronous views.send_verify
+
+    Inputs    
+        :param request: <HttpRequest> with email of user to send the verification to
+    
+    Outputs
+        :returns: Status ... HTTP_200_OK if the user exists 
+                         ... HTTP_404_NOT_FOUND if the user does not exists 
+                         ... HTTP_405_METHOD_NOT_ALLOWED if the request is not a POST
+    """
+    if request.method != "POST": 
+        return HttpResponse(status = status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    cleaned, _, user_status = verify_schema.validate(_read_data(request))
+
+    if user_status == status.HTTP_200_OK:
+        try: 
+            user = await CustomUser.objects.aget_by_natural_key(cleaned["email"])
+            await user.asend_verification_code()  
+        except CustomUser.DoesNotExist:
+            user_status = status.HTTP_404_NOT_FOUND
+    
+    return HttpResponse(status = user_status)
+
+@_session_csrf
+async def confirm_verify(request, *args, **kwargs) -> HttpResponse:
+    """
+    Asynchronous views.confirm_verify
+
+    Inputs    
+        :param request: <HttpRequest> containing a user's email and the verificationCode they provided
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_202_ACCEPTED if the user is verfied
+                         ... HTTP_403_FORBIDDEN if the user is not verified 
+                         ... HTTP_405_METHOD_NOT_ALLOWED if the request is not a POST
+    """
+    if request.method != "POST": 
+        return HttpResponse(status = status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    cleaned, _, user_status = confirm_schema.validate(_read_data(request))
+    if user_status == status.HTTP_412_PRECONDITION_FAILED:
+        # a malformed code is just a wrong code
+        user_status = status.HTTP_403_FORBIDDEN
+
+    if user_status == status.HTTP_200_OK:
+        user_status = await VerificationCode.objects.aconfirm(cleaned['email'], cleaned['verification_code'])
+    
+    return HttpResponse(status = user_status)
+
+@_session_csrf
+async def sign_in(request, *args, **kwargs) -> HttpResponse:
+    """
+    Asynchronous views.sign_in: the password is checked on an executor thread so the event loop never hashes
+
+    Inputs    
+        :param request: <HttpRequest> containing a user's email and password
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK if the user is authenticated
+                         ... HTTP_403_FORBIDDEN if the user is unauthenticated 
+                         ... HTTP_405_METHOD_NOT_ALLOWED if the request is not a POST
+                         ... HTTP_429_TOO_MANY_REQUESTS if the client or email made too many (failed) attempts
+    """
+    if request.method != "POST": 
+        return HttpResponse(status = status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    data, _, user_status = signin_schema.validate(_read_data(request))
+
+    if user_status == status.HTTP_200_OK:
+        user_status = await sync_to_async(_throttle_sign_in)(request, data['email'])
+        if user_status == status.HTTP_429_TOO_MANY_REQUESTS:
+            await sync_to_async(_audit_sign_in)(request, data['email'], SignInEvent.THROTTLED)
+
+    if user_status == status.HTTP_200_OK:
+        try:
+            user = await CustomUser.objects.aget_by_natural_key(data['email'])
+        except CustomUser.DoesNotExist:
+            # hash anyway so the response time doesn't reveal whether the email exists
+            await _hash(data['password'])
+            user = None
+
+        if user is not None and not await sync_to_async(user.check_password, thread_sensitive = False)(data['password']):
+            user = None
+        await sync_to_async(_record_sign_in)(request, data['email'], user is not None)
+
+        if user is None or not user.is_active:
+            await sync_to_async(_audit_sign_in)(request, data['email'], SignInEvent.FAILED)
+            user_status = status.HTTP_403_FORBIDDEN
+        elif not user.verified:
+            await sync_to_async(_audit_sign_in)(request, data['email'], SignInEvent.UNVERIFIED, user)
+            user_status = status.HTTP_403_FORBIDDEN
+        else:
+            user.backend = settings.AUTHENTICATION_BACKENDS[0]
+            await _login(request, user)
+            await sync_to_async(_audit_sign_in)(request, data['email'], SignInEvent.SUCCEEDED, user)
+            user_status = status.HTTP_200_OK
+    
+    return HttpResponse(status = user_status)
+
+@_session_csrf
+async def sign_out(request, *args, **kwargs) -> HttpResponse: 
+    """
+    Asynchronous views.sign_out
+     
+    Inputs    
+       :param request: <HttpRequest> to sign a user out containing the user's email
+
+    Outputs
+       :returns: Status … 
+                        … HTTP_200_OK if the user is signed out
+                        … HTTP_403_FORBIDDEN if the user is not signed in
+                        … HTTP_405_METHOD_NOT_ALLOWED if the request is not a POST
+    """
+    if request.method != "POST": 
+        return HttpResponse(status = status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    user = await _get_user(request)
+    if not user.is_authenticated: 
+        return HttpResponse(status = status.HTTP_403_FORBIDDEN)
+
+    verify_fields = ['email']
+    user_status   = _is_subset(verify_fields, _read_data(request).keys())
+
+    if user_status == status.HTTP_200_OK: await _logout(request)
+    
+    return HttpResponse(status = user_status)
@@ -0,0 +1,63 @@
+"""
+user authentication backends
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from .user_utils.cache_helpers import _user_cache
+
+##### Classes #####
+class CachedModelBackend(ModelBackend):
+    """
+    AF() = ModelBackend resolving users by email and by id, and their permissions, through the user cache 
+
+    Representation Invariant
+        - inherits from ModelBackend
+        - passwords are always checked, only the user lookup is cached
+        - a user's permissions are loaded once per cache timeout or invalidation, then checked in memory
+
+    Representation Exposure
+        - inherits from ModelBackend
+    """
+
+    def authenticate(self, request, username = None, password = None, **kwargs):
+        """ Override ModelBackend.authenticate() """
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        try:
+            user = UserModel.objects.get_cached_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # run the default password hasher once to reduce the timing difference between an existing and a nonexistent user
+            UserModel().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        """ Override ModelBackend.get_user() """
+        UserModel = get_user_model()
+        try:
+            user = UserModel.objects.get_cached(user_id)
+        except (UserModel.DoesNotExist, ValueError):
+            return None
+
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj = None):
+        """ Override ModelBackend.get_all_permissions() """
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        if not hasattr(user_obj, "_perm_cache"):
+            token       = _user_cache.token(user_obj.pk)
+            permissions = _user_cache.get_permissions(user_obj.pk, token)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                _user_cache.set_permissions(user_obj.pk, permissions, token)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
@@ -0,0 +1,195 @@
+"""
+auth endpoints benchmark
+
+Drives every route of the user urls against a seeded database, with verification emails drained to a local SMTP sink,
+and reports throughput, p50 / p99 latency and queries per request. Run it through the bench_auth command
+"""
+import time, statistics
+from django.urls import reverse
+from django.test import Client
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.hashers import make_password
+from ..models import CustomUser, EmailOutbox
+from ..user_utils.bloom_helpers import _email_filter
+
+##### Global Constants #####
+password            = "Pass$123"
+seed_domain         = "bench.ployem.com"
+# not counted against the budgets: TestCase turns them into savepoints, a plain run sends them as they are
+transaction_control = {"BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"}
+# most queries a request to each route may run, checked against the median of a run
+query_budgets       = {"user-signup"      : 1,
+                       "user-signup-bulk" : 4,
+                       "email-available"  : 0,
+                       "user-signin"      : 4,
+                       "send-verify"      : 3,
+                       "confirm-verify"   : 2,
+                       "user-signout"     : 4,
+                       "throttle-metrics" : 2,
+                       "user-metrics"     : 2}
+
+##### Classes #####
+class Scenario():
+    """
+    AF(name, method, prepare) = requests to the route name made with method, each built by prepare
+
+    Definitions
+        prepare
+            callable taking the request index and returning the (client, data) of the request, run outside the timing
+
+            prepare(3) for signup returns an anonymous client and a new user's signup payload
+
+    Representation Invariant
+        - name is the url name of a user route
+
+    Representation Exposure
+        - all fields are exposed and immutable
+    """
+
+    ##### Representation #####
+    def __init__(self, name, method, prepare):
+        self.name    = name
+        self.method  = method
+        self.prepare = prepare
+
+##### Functions #####
+def seed(users):
+    """
+    Seeds verified users seed0 ... seed{users - 1} and a staff user sharing one precomputed password hash
+
+    Inputs
+        :param users: <int> number of users to seed
+
+    Outputs
+        :returns: <list> of the seeded users and the staff <CustomUser>
+    """
+    hashed = make_password(password)
+    seeded = [CustomUser(first_name = "Seed", last_name = "User%d" % i, date_of_birth = "2001-11-22", verified = True,
+                         email = "seed%d@%s" % (i, seed_domain), email_normalized = "seed%d@%s" % (i, seed_domain),
+                         password = hashed) for i in range(users)]
+    CustomUser.objects.bulk_create(seeded, batch_size = 500)
+
+    staff = CustomUser(first_name = "Bench", last_name = "Staff", date_of_birth = "2001-11-22", email = "staff@%s" % seed_domain,
+                       verified = True, is_staff = True, is_admin = True, password = hashed)
+    staff.save()
+    return seeded, staff
+
+def scenarios(seeded, staff):
+    """
+    Returns a scenario for every route of the user urls
+
+    Inputs
+        :param seeded: <list> of seeded users
+        :param staff: <CustomUser> staff user
+
+    Outputs
+        :returns: <list> of <Scenario>
+    """
+    anonymous   = Client()
+    staff_login = Client()
+    staff_login.force_login(staff)
+    seeded_user = lambda i: seeded[i % len(seeded)]
+    signup_data = lambda email: {"firstName" : "Bench", "lastName" : "User", "dateOfBirth" : "2001-11-22", "email" : email, "password" : password}
+
+    def signed_in(i):
+        client = Client()
+        client.force_login(seeded_user(i))
+        return client, {"email" : seeded_user(i).email}
+
+    def confirm(i):
+        user = seeded_user(i)
+        return anonymous, {"email" : user.email, "verificationCode" : user.send_verification_code()}
+
+    return [Scenario("user-signup", "post", lambda i: (anonymous, signup_data("signup%d@%s" % (i, seed_domain)))),
+            Scenario("user-signup-bulk", "post", lambda i: (staff_login, {"users" : [signup_data("bulk%d-%d@%s" % (i, j, seed_domain)) for j in range(10)]})),
+            Scenario("email-available", "get", lambda i: (anonymous, {"email" : "free%d@%s" % (i, seed_domain)})),
+            Scenario("user-signin", "post", lambda i: (Client(), {"email" : seeded_user(i).email, "password" : password})),
+            Scenario("send-verify", "post", lambda i: (anonymous, {"email" : seeded_user(i).email})),
+            Scenario("confirm-verify", "post", confirm),
+            Scenario("user-signout", "post", signed_in),
+            Scenario("throttle-metrics", "get", lambda i: (staff_login, None)),
+            Scenario("user-metrics", "get", lambda i: (staff_login, None))]
+
+def _percentile(values, percent):
+    """ Returns the percent-th percentile of values by the nearest rank """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1)]
+
+def _is_transaction_control(sql):
+    """ Returns True for BEGIN, COMMIT, ROLLBACK, SAVEPOINT and RELEASE statements, which TestCase's transaction turns into savepoints """
+    return (sql.split(None, 1) or [""])[0].upper() in transaction_control
+
+def run_scenario(scenario, requests):
+    """
+    Makes requests requests of scenario, timing each one and counting its queries
+
+    Inputs
+        :param scenario: <Scenario> to run
+        :param requests: <int> number of requests
+
+    Outputs
+        :returns: <dict> of the scenario's requests, throughput, p50 / p99 latency, queries per request and statuses
+    """
+    path      = reverse(scenario.name)
+    latencies = []
+    queries   = []
+    statuses  = {}
+
+    for i in range(requests):
+        client, data = scenario.prepare(i)
+        request      = getattr(client, scenario.method)
+        with CaptureQueriesContext(connection) as captured:
+            start    = time.perf_counter()
+            response = request(path, data, content_type = "application/json") if data is not None else request(path)
+            latencies.append(time.perf_counter() - start)
+        queries.append(sum(1 for query in captured.captured_queries if not _is_transaction_control(query["sql"])))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    return {"requests"        : requests,
+            "throughput_rps"  : requests / sum(latencies),
+            "p50_ms"          : 1000 * _percentile(latencies, 50),
+            "p99_ms"          : 1000 * _percentile(latencies, 99),
+            "queries_p50"     : statistics.median(queries),
+            "queries_max"     : max(queries),
+            "statuses"        : {str(code) : count for code, count in sorted(statuses.items())}}
+
+def run(users = 1000, requests = 200, drain = True):
+    """
+    Seeds the database and runs every scenario
+
+    Inputs
+        :param users: <int> number of users to seed
+        :param requests: <int> number of requests per scenario
+        :param drain: <bool> drain the verification emails queued by the run to the configured SMTP server
+
+    Outputs
+        :returns: <dict> of results by route name, and the outbox drain results under "drain_outbox"
+    """
+    seeded, staff = seed(users)
+    # the seeded users were bulk inserted without post_save, load them like a process starting on this table would
+    _email_filter.rebuild()
+    results       = {scenario.name : run_scenario(scenario, requests) for scenario in scenarios(seeded, staff)}
+
+    if drain:
+        queued = EmailOutbox.objects.filter(status = EmailOutbox.PENDING).count()
+        start  = time.perf_counter()
+        while EmailOutbox.objects.drain(batch_size = 500)["sent"]: 
+            pass
+        elapsed = time.perf_counter() - start
+        results["drain_outbox"] = {"messages" : queued, "throughput_mps" : queued / elapsed if elapsed else 0.0}
+
+    return results
+
+def over_budget(results):
+    """
+    Returns the routes whose median queries per request exceed their budget
+
+    Inputs
+        :param results: <dict> returned by run()
+
+    Outputs
+        :returns: <dict> of (queries_p50, budget) by route name
+    """
+    return {name : (results[name]["queries_p50"], budget) for name, budget in query_budgets.items() 
+            if name in results and results[name]["queries_p50"] > budget}
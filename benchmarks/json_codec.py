@@ -0,0 +1,72 @@
+"""
+json codec benchmark
+
+Compares REST framework's default JSON parser and renderer with the USER_FAST_JSON ones on the sign up payload,
+both on their own and through a full function view dispatch
+
+    python manage.py shell -c "from user.benchmarks import json_codec; json_codec.main()"
+"""
+import io, json, time
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from rest_framework.decorators import api_view, parser_classes, renderer_classes
+from ..parsers import FastJSONParser
+from ..renderers import FastJSONRenderer
+
+##### Global Constants #####
+payload  = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jdoe@ployem.com", "password" : "Pass$123"}
+response = {"results" : [{"email" : "jdoe@ployem.com", "status" : status.HTTP_201_CREATED}]}
+codecs   = {"default" : ([JSONParser, FormParser, MultiPartParser], [JSONRenderer, BrowsableAPIRenderer]),
+            "fast"    : ([FastJSONParser, FormParser, MultiPartParser], [FastJSONRenderer])}
+
+##### Functions #####
+def _echo_view(parsers, renderers):
+    """ Returns a function view parsing the request and rendering response like the user views """
+    @api_view(["POST"])
+    @parser_classes(parsers)
+    @renderer_classes(renderers)
+    def echo(request):
+        request.data
+        return Response(response, status = status.HTTP_200_OK)
+    return echo
+
+def _time(function, iterations):
+    """ Returns the mean time of function in microseconds """
+    start = time.perf_counter()
+    for _ in range(iterations): 
+        function()
+    return 1e6 * (time.perf_counter() - start) / iterations
+
+def run(iterations = 20000):
+    """
+    Times a parse and render round trip and a full view dispatch with each codec
+
+    Inputs
+        :param iterations: <int> number of repetitions per measurement
+
+    Outputs
+        :returns: <dict> of mean microseconds per round trip and per request by codec
+    """
+    body    = json.dumps(payload).encode()
+    factory = APIRequestFactory()
+    results = {}
+
+    for name, (parsers, renderers) in codecs.items():
+        parser, renderer = parsers[0](), renderers[0]()
+        view             = _echo_view(parsers, renderers)
+        round_trip       = lambda: renderer.render(parser.parse(io.BytesIO(body)) and response, "application/json")
+        request          = lambda: view(factory.post("/", body, content_type = "application/json")).render()
+        results[name]    = {"round_trip_us" : _time(round_trip, iterations), "request_us" : _time(request, iterations // 10)}
+
+    return results
+
+def main():
+    """ Prints the benchmark results """
+    results = run()
+    for name, result in results.items():
+        print("%-8s round trip %7.2f us   request %7.2f us" % (name, result["round_trip_us"], result["request_us"]))
+    print("gain     round trip %7.2f us   request %7.2f us" % (results["default"]["round_trip_us"] - results["fast"]["round_trip_us"],
+                                                            results["default"]["request_us"] - results["fast"]["request_us"]))
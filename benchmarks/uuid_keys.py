@@ -0,0 +1,87 @@
+"""
+uuid keys benchmark
+
+Compares random (uuid4) with time-ordered (uuid7) primary keys on the configured database: inserting rows in batches,
+then timing the same ordered range scan over the highest keys of both: with uuid7 keys it reads the most recently
+created rows, which were written together, with uuid4 keys rows written at any time
+
+    python manage.py shell -c "from user.benchmarks import uuid_keys; uuid_keys.main()"
+
+Run it against a scratch database: it creates and drops its own tables
+"""
+import uuid, time
+from django.db import connection, models, DatabaseError
+from ..user_utils.model_helpers import _uuid7
+
+##### Global Constants #####
+generators = {"uuid4" : uuid.uuid4, "uuid7" : _uuid7}
+
+##### Functions #####
+def _table_size(table):
+    """ Returns the bytes used by table and its indexes where the database can tell, None otherwise """
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+            return cursor.fetchone()[0]
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name IN (%s, %s)", [table, "sqlite_autoindex_%s_1" % table])
+                return cursor.fetchone()[0]
+            except DatabaseError:
+                # dbstat is an optional SQLite extension
+                return None
+    return None
+
+def run(rows = 200000, batch_size = 1000, scan = 1000):
+    """
+    Inserts rows rows with each key generator, then range scans the scan rows with the highest keys in key order
+
+    Inputs
+        :param rows: <int> number of rows inserted per generator
+        :param batch_size: <int> rows per INSERT
+        :param scan: <int> number of most recent rows read back
+
+    Outputs
+        :returns: <dict> of inserts per second, mean range scan milliseconds and table size in bytes by generator
+    """
+    field   = models.UUIDField(primary_key = True)
+    column  = field.db_type(connection)
+    quote   = connection.ops.quote_name
+    results = {}
+
+    for name, generator in generators.items():
+        table = "user_bench_%s" % name
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % quote(table))
+            cursor.execute("CREATE TABLE %s (id %s NOT NULL PRIMARY KEY, payload varchar(64) NOT NULL)" % (quote(table), column))
+            try:
+                keys     = []
+                inserted = time.perf_counter()
+                for start in range(0, rows, batch_size):
+                    batch = [field.get_db_prep_value(generator(), connection) for _ in range(min(batch_size, rows - start))]
+                    cursor.execute("INSERT INTO %s (id, payload) VALUES %s" % (quote(table), ", ".join(["(%s, 'user@ployem.com')"] * len(batch))), batch)
+                    keys.extend(batch)
+                inserted = time.perf_counter() - inserted
+
+                # the same scan on both tables: it reads the recent rows with uuid7 keys, rows from all over the table with uuid4 keys
+                query   = "SELECT id, payload FROM %s WHERE id >= %%s ORDER BY id LIMIT %d" % (quote(table), scan)
+                first   = sorted(keys)[-scan]
+                scanned = time.perf_counter()
+                for _ in range(10):
+                    cursor.execute(query, [first])
+                    read = len(cursor.fetchall())
+                    if read != scan:
+                        raise RuntimeError("%s range scan read %d row(s) instead of %d" % (name, read, scan))
+                scanned = (time.perf_counter() - scanned) / 10
+
+                results[name] = {"inserts_per_second" : rows / inserted, "range_scan_ms" : 1000 * scanned, "table_bytes" : _table_size(table)}
+            finally:
+                cursor.execute("DROP TABLE %s" % quote(table))
+
+    return results
+
+def main():
+    """ Prints the benchmark results """
+    for name, result in run().items():
+        print("%-6s %10.0f inserts/s   range scan %7.2f ms   size %s" %
+              (name, result["inserts_per_second"], result["range_scan_ms"], result["table_bytes"] or "n/a"))
@@ -0,0 +1,75 @@
+"""
+user password hashers
+"""
+import base64, hashlib
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, Argon2PasswordHasher, ScryptPasswordHasher
+
+##### Classes #####
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    AF(iterations) = PBKDF2PasswordHasher running USER_PBKDF2_ITERATIONS iterations, as picked by calibrate_hashers
+
+    Representation Invariant
+        - inherits from PBKDF2PasswordHasher
+        - shares the pbkdf2_sha256 algorithm, so existing hashes verify and are upgraded when iterations change
+
+    Representation Exposure
+        - inherits from PBKDF2PasswordHasher
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, "USER_PBKDF2_ITERATIONS", PBKDF2PasswordHasher.iterations)
+
+class CalibratedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    AF(time_cost, memory_cost, parallelism) = Argon2PasswordHasher with the USER_ARGON2_TIME_COST, 
+        USER_ARGON2_MEMORY_COST (KiB) and USER_ARGON2_PARALLELISM picked by calibrate_hashers
+
+    Representation Invariant
+        - inherits from Argon2PasswordHasher
+        - shares the argon2 algorithm, so existing hashes verify and are upgraded when the parameters change
+
+    Representation Exposure
+        - inherits from Argon2PasswordHasher
+    """
+
+    @property
+    def time_cost(self):
+        return getattr(settings, "USER_ARGON2_TIME_COST", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, "USER_ARGON2_MEMORY_COST", Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, "USER_ARGON2_PARALLELISM", Argon2PasswordHasher.parallelism)
+
+class CalibratedScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    AF(work_factor) = ScryptPasswordHasher with the USER_SCRYPT_WORK_FACTOR picked by calibrate_hashers
+
+    Representation Invariant
+        - inherits from ScryptPasswordHasher
+        - shares the scrypt algorithm, so existing hashes verify and are upgraded when the work factor changes
+        - maxmem fits the work factor and block size of the hash being encoded or verified, not only the current ones
+
+    Representation Exposure
+        - inherits from ScryptPasswordHasher
+    """
+
+    @property
+    def work_factor(self):
+        return getattr(settings, "USER_SCRYPT_WORK_FACTOR", ScryptPasswordHasher.work_factor)
+
+    def encode(self, password, salt, n = None, r = None, p = None):
+        """ Override ScryptPasswordHasher.encode() to size maxmem from n and r, which verify() takes from the stored hash """
+        self._check_encode_args(password, salt)
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        # scrypt needs 128 * r * (n + p) bytes, hashlib's default limit is 32 MiB
+        hash_ = hashlib.scrypt(password.encode(), salt = salt.encode(), n = n, r = r, p = p, maxmem = 2 * 128 * r * (n + p), dklen = 64)
+        return "%s$%d$%s$%d$%d$%s" % (self.algorithm, n, salt, r, p, base64.b64encode(hash_).decode("ascii").strip())
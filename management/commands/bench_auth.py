@@ -0,0 +1,89 @@
+"""
+bench auth command
+"""
+import json, platform, subprocess, django
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.core.management.base import BaseCommand, CommandError
+from user.benchmarks import auth_endpoints
+from user.user_utils.test_helpers import MailCaptureServer
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(users, requests, output, baseline) = benchmark of every user route against a fresh test database seeded with users,
+        requests requests per route, saved as JSON to output and compared with the baseline results
+
+    Representation Invariant
+        - inherits from BaseCommand
+        - never touches the configured database, only a test database created from it
+        - fails if a route's median queries per request exceeds its budget
+        - fails if a route answers a request with an error status, its timings and queries are not the route's
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Benchmarks the user routes against a seeded test database and checks their query budgets"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("--users", type = int, default = 1000, help = "users seeded before the run")
+        parser.add_argument("--requests", type = int, default = 200, help = "requests per route")
+        parser.add_argument("--output", help = "file to save the results to as JSON")
+        parser.add_argument("--baseline", help = "results JSON of a previous run to compare with")
+        parser.add_argument("--keepdb", action = "store_true", help = "reuse the test database between runs")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        # like the test runner: the test client's host is allowed and emails stay in memory
+        setup_test_environment()
+        database = connection.creation.create_test_db(verbosity = 0, autoclobber = True, keepdb = options["keepdb"])
+        try:
+            # throttling would reject the repeated sign ins of the run
+            with MailCaptureServer() as sink, \
+                 override_settings(USER_SMTP_SERVER = sink.host, USER_SMTP_PORT = sink.port, USER_SMTP_PASSWORD = None,
+                                   USER_SIGNIN_RATES = {name : (10**9, 60) for name in ("ip", "email", "failures")}):
+                results = auth_endpoints.run(options["users"], options["requests"])
+        finally:
+            connection.creation.destroy_test_db(database, verbosity = 0, keepdb = options["keepdb"])
+            teardown_test_environment()
+
+        report = {"commit"  : _commit(), 
+                  "python"  : platform.python_version(), 
+                  "django"  : django.get_version(),
+                  "vendor"  : connection.vendor,
+                  "users"   : options["users"],
+                  "results" : results}
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file: 
+                baseline = json.load(file)["results"]
+
+        self.stdout.write("%-18s %10s %9s %9s %8s" % ("route", "req/s", "p50 ms", "p99 ms", "queries"))
+        for name, result in results.items():
+            if "p50_ms" not in result: continue
+            line = "%-18s %10.1f %9.2f %9.2f %8g" % (name, result["throughput_rps"], result["p50_ms"], result["p99_ms"], result["queries_p50"])
+            if baseline and name in baseline:
+                line += "   p50 %+.1f%%" % (100 * (result["p50_ms"] / baseline[name]["p50_ms"] - 1))
+            self.stdout.write(line)
+
+        if options["output"]:
+            with open(options["output"], "w") as file: 
+                json.dump(report, file, indent = 2)
+
+        failed = {name : result["statuses"] for name, result in results.items() 
+                  if any(int(code) >= 400 for code in result.get("statuses", {}))}
+        if failed:
+            raise CommandError("Requests failed: " + ", ".join("%s answered %s" % (name, statuses) for name, statuses in failed.items()))
+
+        over = auth_endpoints.over_budget(results)
+        if over:
+            raise CommandError("Query budget exceeded: " + ", ".join("%s ran %g > %d" % (name, *values) for name, values in over.items()))
+
+##### Functions #####
+def _commit():
+    """ Returns the current git commit, None outside a git checkout """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
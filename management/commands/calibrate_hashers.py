@@ -0,0 +1,124 @@
+"""
+calibrate hashers command
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, Argon2PasswordHasher, ScryptPasswordHasher
+from user.hashers import CalibratedPBKDF2PasswordHasher, CalibratedArgon2PasswordHasher, CalibratedScryptPasswordHasher
+
+##### Global Constants #####
+password = "Pass$123-calibration"
+salt     = "calibrationsalt0123456"
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(target_ms, hashers) = benchmark of hashers on this host, picking the parameters that hash a password in about target_ms
+
+    Representation Invariant
+        - inherits from BaseCommand
+        - parameters are never lowered below Django's defaults unless --allow-weaker is given
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Benchmarks the password hashers on this host and prints the settings that hit a target time per hash"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("--target-ms", type = float, default = 250, help = "time per hash to aim for")
+        parser.add_argument("--hashers", nargs = "+", choices = ["pbkdf2", "argon2", "scrypt"], default = ["pbkdf2", "argon2", "scrypt"])
+        parser.add_argument("--allow-weaker", action = "store_true", help = "allow parameters below Django's defaults")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        target     = options["target_ms"] / 1000
+        calibrate  = {"pbkdf2" : _calibrate_pbkdf2, "argon2" : _calibrate_argon2, "scrypt" : _calibrate_scrypt}
+        lines      = []
+
+        for name in options["hashers"]:
+            try:
+                hasher_settings, seconds = calibrate[name](target, options["allow_weaker"])
+            except ValueError as error:
+                self.stdout.write(self.style.WARNING("%s: skipped (%s)" % (name, error)))
+                continue
+
+            self.stdout.write("%s: %.0f ms per hash with %s" % (name, 1000*seconds, hasher_settings))
+            lines.append("# %s: %.0f ms per hash" % (name, 1000*seconds))
+            lines.extend("%s = %r" % setting for setting in hasher_settings.items())
+
+        self.stdout.write("\n# settings.py (list the preferred calibrated hasher first in PASSWORD_HASHERS)")
+        self.stdout.write("\n".join(lines))
+
+##### Functions #####
+def _time(hasher):
+    """
+    Returns the best of 3 times hasher takes to hash a password, in seconds
+    """
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        hasher.encode(password, salt)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def _calibrate_pbkdf2(target, allow_weaker):
+    """
+    Scales PBKDF2 iterations linearly to the target time
+
+    Outputs
+        :returns: <dict> of settings and <float> seconds per hash with them
+    """
+    hasher     = CalibratedPBKDF2PasswordHasher()
+    default    = PBKDF2PasswordHasher.iterations
+    probe      = 100000
+    iterations = int(probe * target / _time_with(hasher, "iterations", probe))
+    iterations = iterations if allow_weaker else max(iterations, default)
+    return {"USER_PBKDF2_ITERATIONS" : iterations}, _time_with(hasher, "iterations", iterations)
+
+def _calibrate_argon2(target, allow_weaker):
+    """
+    Scales the Argon2 time cost to the target time, keeping the memory cost and parallelism
+
+    Outputs
+        :returns: <dict> of settings and <float> seconds per hash with them
+        :raises: <ValueError> if argon2-cffi is not installed
+    """
+    hasher = CalibratedArgon2PasswordHasher()
+    try:
+        hasher._load_library()
+    except ValueError:
+        raise ValueError("argon2-cffi is not installed")
+
+    default   = Argon2PasswordHasher.time_cost
+    time_cost = max(1, round(target / _time_with(hasher, "time_cost", 1)))
+    time_cost = time_cost if allow_weaker else max(time_cost, default)
+    return {"USER_ARGON2_TIME_COST"   : time_cost, 
+            "USER_ARGON2_MEMORY_COST" : hasher.memory_cost, 
+            "USER_ARGON2_PARALLELISM" : hasher.parallelism}, _time_with(hasher, "time_cost", time_cost)
+
+def _calibrate_scrypt(target, allow_weaker):
+    """
+    Doubles the scrypt work factor (which must be a power of 2) while a hash stays within the target time
+
+    Outputs
+        :returns: <dict> of settings and <float> seconds per hash with them
+    """
+    hasher      = CalibratedScryptPasswordHasher()
+    default     = ScryptPasswordHasher.work_factor
+    work_factor = 2**10
+    seconds     = _time_with(hasher, "work_factor", work_factor)
+    while 2*seconds <= target:
+        work_factor *= 2
+        seconds      = _time_with(hasher, "work_factor", work_factor)
+
+    if not allow_weaker and work_factor < default:
+        work_factor, seconds = default, _time_with(hasher, "work_factor", default)
+    return {"USER_SCRYPT_WORK_FACTOR" : work_factor}, seconds
+
+def _time_with(hasher, parameter, value):
+    """
+    Times hasher with its parameter set to value
+    """
+    calibrated = type("Probe", (type(hasher),), {parameter : value})()
+    return _time(calibrated)
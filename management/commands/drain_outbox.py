@@ -0,0 +1,39 @@
+"""
+drain outbox command
+"""
+import time
+from user.models import EmailOutbox
+from django.core.management.base import BaseCommand
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(batch_size, max_attempts, backoff, poll_interval) = worker sending queued email messages in batches of batch_size,
+        retrying failed messages after backoff seconds (doubled on every retry) up to max_attempts times
+        and polling for new messages every poll_interval seconds
+
+    Representation Invariant
+        - inherits from BaseCommand
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Sends the email messages queued in the outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("--batch-size", type = int, default = 100, help = "messages claimed per batch")
+        parser.add_argument("--max-attempts", type = int, default = 5, help = "failed attempts before a message is dead")
+        parser.add_argument("--backoff", type = int, default = 30, help = "seconds before the first retry")
+        parser.add_argument("--poll-interval", type = float, default = 1.0, help = "seconds to wait when the outbox is empty")
+        parser.add_argument("--once", action = "store_true", help = "drain the due messages once and exit")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        while True:
+            counts = EmailOutbox.objects.drain(options["batch_size"], options["max_attempts"], options["backoff"])
+            if any(counts.values()):
+                self.stdout.write("Sent %(sent)d, retried %(retried)d, dead %(dead)d" % counts)
+
+            if options["once"]: break
+            if sum(counts.values()) < options["batch_size"]: time.sleep(options["poll_interval"])
@@ -0,0 +1,126 @@
+"""
+import users command
+"""
+import os, csv, json, time, django, itertools, functools, contextlib
+from user.models import CustomUser
+from rest_framework import status
+from django.db import transaction
+from concurrent.futures import ProcessPoolExecutor
+from user.user_utils.view_helpers import signup_schema
+from django.core.management.base import BaseCommand, CommandError
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(path, chunk_size, workers, checkpoint) = import of the users in the CSV / JSONL file at path, chunk_size users per 
+        transaction, hashing passwords on workers processes and recording the rows imported so far in checkpoint
+
+    Definitions
+        checkpoint
+            file holding the number of rows of path that were committed
+
+            Re-running an import that crashed after committing 3 chunks of 1000 rows starts at row 3001
+
+    Representation Invariant
+        - inherits from BaseCommand
+        - every row is validated with signup_schema like sign_up_bulk validates its users, only the cleaned rows are written
+        - the checkpoint never counts a row that was not committed
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Imports users from a CSV or JSONL file of firstName, lastName, dateOfBirth, email and password records"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("path", help = "CSV (with a header row) or JSONL file of users")
+        parser.add_argument("--format", choices = ["csv", "jsonl"], help = "file format, inferred from the extension by default")
+        parser.add_argument("--chunk-size", type = int, default = 1000, help = "users written per transaction")
+        parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "processes hashing passwords, 0 to hash on threads of this process")
+        parser.add_argument("--checkpoint", help = "checkpoint file, defaults to <path>.checkpoint")
+        parser.add_argument("--restart", action = "store_true", help = "ignore the checkpoint and import from the first row")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        path       = options["path"]
+        checkpoint = options["checkpoint"] or path + ".checkpoint"
+        file_type  = options["format"] or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+        chunk_size = options["chunk_size"]
+        skip       = 0 if options["restart"] else _read_checkpoint(checkpoint)
+        counts     = {"created" : 0, "rejected" : 0, "incomplete" : 0}
+        started    = time.monotonic()
+
+        if not os.path.exists(path): 
+            raise CommandError("%s does not exist" % path)
+        if skip: 
+            self.stdout.write("Resuming after row %d" % skip)
+
+        with open(path, newline = "", encoding = "utf-8") as file, \
+             (ProcessPoolExecutor(options["workers"], initializer = django.setup) if options["workers"] else contextlib.nullcontext()) as executor:
+            rows      = itertools.islice(_read_rows(file, file_type), skip, None)
+            hash_map  = functools.partial(executor.map, chunksize = max(1, chunk_size // (4*options["workers"]))) if executor else None
+            imported  = skip
+
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk: break
+
+                validated = signup_schema.validate_many(chunk)
+                valid     = [(cleaned["first_name"], cleaned["last_name"], cleaned["date_of_birth"], cleaned["email"], cleaned["password"])
+                             for cleaned, _, row_status in validated if row_status == status.HTTP_200_OK]
+                with transaction.atomic():
+                    results = CustomUser.objects.bulk_create_users(valid, chunk_size = chunk_size, hash_map = hash_map)
+                imported += len(chunk)
+                _write_checkpoint(checkpoint, imported)
+
+                created               = sum(user_status == status.HTTP_201_CREATED for _, user_status in results)
+                incomplete            = sum(row_status == status.HTTP_400_BAD_REQUEST for _, _, row_status in validated)
+                counts["created"]    += created
+                counts["rejected"]   += len(chunk) - incomplete - created
+                counts["incomplete"] += incomplete
+                elapsed               = time.monotonic() - started
+                self.stdout.write("Imported %d row(s) (%d created, %d rejected, %d incomplete) at %.0f rows/s" % 
+                                  (imported, counts["created"], counts["rejected"], counts["incomplete"], (imported - skip) / elapsed))
+
+        self.stdout.write(self.style.SUCCESS("Done: %d row(s) in %.1fs" % (imported - skip, time.monotonic() - started)))
+
+##### Functions #####
+def _read_rows(file, file_type):
+    """
+    Streams the records of a CSV or JSONL file one at a time
+
+    Inputs
+        :param file: <file> opened in text mode
+        :param file_type: <str> one of {'csv', 'jsonl'}
+
+    Outputs
+        :returns: <generator> of <dict> records, or None for a JSONL line that can't be parsed
+    """
+    if file_type == "csv":
+        yield from csv.DictReader(file)
+        return
+
+    for line in file:
+        if not line.strip(): continue
+        try: 
+            yield json.loads(line)
+        except ValueError: 
+            yield None
+
+def _read_checkpoint(checkpoint):
+    """
+    Returns the number of rows committed by a previous import, 0 if there is no checkpoint
+    """
+    try:
+        with open(checkpoint) as file: 
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def _write_checkpoint(checkpoint, imported):
+    """
+    Atomically records that the first imported rows were committed
+    """
+    with open(checkpoint + ".tmp", "w") as file: 
+        file.write(str(imported))
+    os.replace(checkpoint + ".tmp", checkpoint)
@@ -0,0 +1,29 @@
+"""
+prune verification codes command
+"""
+from user.models import VerificationCode
+from django.core.management.base import BaseCommand
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(batch_size) = job deleting the verification codes that expired or were guessed wrong too many times, 
+        batch_size at a time
+
+    Representation Invariant
+        - inherits from BaseCommand
+        - live codes are never deleted
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Deletes expired and exhausted verification codes in batches, run it periodically (e.g. from cron)"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("--batch-size", type = int, default = 1000, help = "codes deleted per statement")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        deleted = VerificationCode.objects.prune(options["batch_size"])
+        self.stdout.write("Deleted %d verification code(s)" % deleted)
@@ -0,0 +1,175 @@
+"""
+seed users command
+"""
+import io, time, random, datetime, itertools
+from user.models import CustomUser
+from user.user_utils.model_helpers import _uuid7
+from django.db import connection, transaction
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+##### Global Constants #####
+first_names = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William", "Barbara",
+               "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Karen", "Wei", "Aisha", "Mohamed", "Yuki",
+               "Olga", "Ravi", "Fatima", "Luca", "Ana", "Kwame", "Ingrid", "Diego"]
+last_names  = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez",
+               "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Nguyen", "Chen",
+               "Kim", "Patel", "Singh", "Okafor", "Ivanova", "Rossi", "Silva", "Sato", "Mensah"]
+first_day   = datetime.date(1900, 1, 1)
+birth_days  = (datetime.date(2011, 12, 31) - first_day).days
+# user n signed up n minutes after the first one, ids are time-ordered like the ones CustomUser gets
+signed_up   = 1577836800000
+
+##### Classes #####
+class Command(BaseCommand):
+    """
+    AF(count, seed, start) = count synthetic users numbered from start, generated from seed, all sharing one password
+
+    Definitions
+        seed
+            integer the users are generated from, the same count, seed and start always generate the same users
+
+            seed_users 3 --seed 7 and seed_users 3 --seed 7 both create the same 3 ids, names, emails and dates of birth
+
+    Representation Invariant
+        - inherits from BaseCommand
+        - the password is hashed once, every user gets the same hash
+        - the users are loaded in one transaction: all of them are created or none are
+        - on PostgreSQL the table's secondary indexes and unique constraints are dropped before the load and rebuilt after it
+
+    Representation Exposure
+        - inherits from BaseCommand
+    """
+    help = "Creates synthetic users with deterministic seeds for benchmarking, much faster than signing them up"
+
+    def add_arguments(self, parser):
+        """ Override BaseCommand.add_arguments() """
+        parser.add_argument("count", type = int, help = "users to create")
+        parser.add_argument("--seed", type = int, default = 0, help = "seed the users are generated from")
+        parser.add_argument("--start", type = int, default = 0, help = "number of the first user, to add users to a seeded table")
+        parser.add_argument("--domain", default = "seed.ployem.com", help = "domain of the users' emails")
+        parser.add_argument("--password", default = "Pass$123", help = "password of every user")
+        parser.add_argument("--verified", type = float, default = 0.9, help = "fraction of verified users")
+        parser.add_argument("--batch-size", type = int, default = 5000, help = "users per INSERT, or per COPY with psycopg2")
+        parser.add_argument("--keep-indexes", action = "store_true", help = "keep the indexes while loading on PostgreSQL")
+
+    def handle(self, *args, **options):
+        """ Override BaseCommand.handle() """
+        if options["count"] < 0 or options["start"] < 0:
+            raise CommandError("count and start must not be negative")
+
+        started = time.monotonic()
+        hashed  = make_password(options["password"])
+        rows    = _generate_users(options["count"], options["seed"], options["start"], options["domain"], hashed, options["verified"])
+
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                rebuild = [] if options["keep_indexes"] else _drop_indexes(CustomUser._meta.db_table)
+                loaded  = time.monotonic()
+                _copy_users(rows, options["batch_size"])
+                loaded  = time.monotonic() - loaded
+                indexed = time.monotonic()
+                with connection.cursor() as cursor:
+                    for statement in rebuild:
+                        cursor.execute(statement)
+                self.stdout.write("Loaded in %.1fs, rebuilt %d index(es) in %.1fs" % (loaded, len(rebuild), time.monotonic() - indexed))
+            else:
+                while True:
+                    batch = [CustomUser(**row) for row in itertools.islice(rows, options["batch_size"])]
+                    if not batch: break
+                    CustomUser.objects.bulk_create(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS("Seeded %d user(s) in %.1fs (%.0f users/s)" %
+                                             (options["count"], elapsed, options["count"] / elapsed if elapsed else 0)))
+
+##### Functions #####
+def _generate_users(count, seed, start, domain, hashed, verified):
+    """
+    Generates the field values of count users numbered from start
+
+    Inputs
+        :param count: <int> number of users
+        :param seed: <int> seed of the generator
+        :param start: <int> number of the first user
+        :param domain: <str> domain of the emails
+        :param hashed: <str> password hash shared by every user
+        :param verified: <float> fraction of verified users
+
+    Outputs
+        :returns: <generator> of <dict> of CustomUser field values
+    """
+    generator = random.Random("%d:%d" % (seed, start))
+    for number in range(start, start + count):
+        first_name = generator.choice(first_names)
+        last_name  = generator.choice(last_names)
+        email      = "%s.%s.%d@%s" % (first_name.lower(), last_name.lower(), number, domain)
+        yield {"id"                : _uuid7(signed_up + 60000*number, generator.getrandbits(74)),
+               "first_name"        : first_name,
+               "last_name"         : last_name,
+               "date_of_birth"     : first_day + datetime.timedelta(days = generator.randrange(birth_days + 1)),
+               "email"             : email,
+               "email_normalized"  : email,
+               "verified"          : generator.random() < verified,
+               "password"          : hashed}
+
+def _drop_indexes(table):
+    """
+    Drops the unique constraints and indexes of a PostgreSQL table, except its primary key
+
+    Inputs
+        :param table: <str> name of the table
+
+    Outputs
+        :returns: <list> of the SQL statements rebuilding what was dropped
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'u'", [table])
+        constraints = cursor.fetchall()
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+                       "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)", [table, table])
+        indexes     = cursor.fetchall()
+
+        quote = connection.ops.quote_name
+        for name, _ in constraints:
+            cursor.execute("ALTER TABLE %s DROP CONSTRAINT %s" % (quote(table), quote(name)))
+        for name, _ in indexes:
+            cursor.execute("DROP INDEX %s" % quote(name))
+
+    return (["ALTER TABLE %s ADD CONSTRAINT %s %s" % (quote(table), quote(name), definition) for name, definition in constraints] +
+            [definition for _, definition in indexes])
+
+def _copy_users(rows, batch_size):
+    """
+    Loads users into PostgreSQL with COPY, streaming them from rows
+
+    Inputs
+        :param rows: <iterable> of <dict> of CustomUser field values
+        :param batch_size: <int> users buffered per COPY when the driver can't stream rows (psycopg2)
+    """
+    fields  = CustomUser._meta.concrete_fields
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    sql     = "COPY %s (%s) FROM STDIN" % (connection.ops.quote_name(CustomUser._meta.db_table), columns)
+
+    def values(row):
+        for field in fields:
+            value = row.get(field.attname, field.get_default())
+            yield value if value is None or isinstance(value, str) else (("t" if value else "f") if isinstance(value, bool) else str(value))
+
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, "copy"):
+            # psycopg 3
+            with raw.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(list(values(row)))
+        else:
+            # psycopg2 reads the text format, whose values can't hold tabs, newlines or backslashes
+            escape = lambda value: "\\N" if value is None else value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+            while True:
+                buffer = io.StringIO()
+                for row in itertools.islice(rows, batch_size):
+                    buffer.write("\t".join(escape(value) for value in values(row)) + "\n")
+                if not buffer.tell(): break
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
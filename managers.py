@@ -1,12 +1,27 @@
 """
 user managers
 """
+import random, secrets, logging, datetime
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
 from rest_framework import status
+from django.conf import settings
+from django.utils import timezone
+from django.db import models, transaction, IntegrityError
 from django.core.validators import validate_email
 from django.contrib.auth.models import BaseUserManager
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from .user_utils.cache_helpers import _user_cache
+from .user_utils.bloom_helpers import _email_filter
+from .user_utils.model_helpers import _send_emails, _normalize_email
 from .user_utils.view_helpers import _validate_date, _validate_password
 
+##### Global Constants #####
+logger      = logging.getLogger(__name__)
+user_flags  = ("is_active", "is_staff", "is_admin", "is_superuser", "verified")
+code_prefix = "P-"
+
 ##### Classes #####
 class CustomUserManager(BaseUserManager):
     """
@@ -43,7 +58,7 @@ class CustomUserManager(BaseUserManager):
         - inherits from BaseUserManager
     """
 
-    def create(self, first_name, last_name, date_of_birth, email, password = None):
+    def create(self, first_name, last_name, date_of_birth, email, password = None, **flags):
         """
         Creates and saves first-time user first_name last_name born on date_of_birth with email and password
         
@@ -59,6 +74,7 @@ class CustomUserManager(BaseUserManager):
             :param date_of_birth: <datetime> date of birth of the user
             :param email: <str> email of the user
             :param password: <str> password protecting user's account
+            :param flags: optional <bool> is_staff, is_admin, is_superuser, verified or is_active values written by the same INSERT
 
         Outputs
             :returns: <CustomUser> representing the newly created and saved user  
@@ -70,24 +86,204 @@ class CustomUserManager(BaseUserManager):
         try: 
             validate_email(email)
             _validate_password(password)
-            _validate_date(date_of_birth)
-
-            if self.get(email = email): 
-                raise ValidationError("Email exists")
+            date_of_birth = _validate_date(date_of_birth)
     
         except ValidationError:
             return None, status.HTTP_412_PRECONDITION_FAILED
 
-        except ObjectDoesNotExist:
-            user = self.model(email         = email,
-                              last_name     = last_name,
-                              first_name    = first_name,
-                              date_of_birth = date_of_birth)
+        user = self.model(email         = email,
+                          last_name     = last_name,
+                          first_name    = first_name,
+                          date_of_birth = date_of_birth,
+                          **_flags(flags))
+        user.set_password(password)
+
+        return self._insert(user)
+
+    async def acreate(self, first_name, last_name, date_of_birth, email, password = None, **flags):
+        """
+        Asynchronous create(): hashes the password on an executor thread so the event loop never blocks on it
+
+        Inputs
+            :param first_name: <str> first name of the user
+            :param last_name: <str> last name of the user
+            :param date_of_birth: <datetime> date of birth of the user
+            :param email: <str> email of the user
+            :param password: <str> password protecting user's account
+            :param flags: optional <bool> flags as taken by create()
+
+        Outputs
+            :returns: <CustomUser> and Status as returned by create()
+        """
+        try: 
+            validate_email(email)
+            _validate_password(password)
+            date_of_birth = _validate_date(date_of_birth)
     
-            user.set_password(password)
-            user.save(using = self._db)
+        except ValidationError:
+            return None, status.HTTP_412_PRECONDITION_FAILED
+
+        user = self.model(email         = email,
+                          last_name     = last_name,
+                          first_name    = first_name,
+                          date_of_birth = date_of_birth,
+                          password      = await sync_to_async(make_password, thread_sensitive = False)(password),
+                          **_flags(flags))
+        return await sync_to_async(self._insert)(user)
+
+    def _insert(self, user):
+        """
+        Saves a new user with a single INSERT: the unique normalized email rejects existing (and concurrently signed up) emails
+
+        Inputs
+            :param user: <CustomUser> unsaved user with a hashed password
+
+        Outputs
+            :returns: <CustomUser> and Status as returned by create()
+        """
+        try:
+            with transaction.atomic(using = self._db):
+                user.save(using = self._db, force_insert = True)
+        except IntegrityError:
+            return None, status.HTTP_412_PRECONDITION_FAILED
+
+        return user, status.HTTP_201_CREATED
+
+    def bulk_create_users(self, users, chunk_size = 500, hash_map = None):
+        """
+        Creates and saves a batch of first-time users, hashing their passwords in parallel and 
+        inserting them chunk_size at a time
+
+        Inputs
+            :param users: <list> of (first_name, last_name, date_of_birth, email, password) tuples as taken by create()
+            :param chunk_size: <int> number of users inserted per INSERT
+            :param hash_map: optional <callable> with the signature of map() used to hash the passwords,
+                             defaults to a thread pool of USER_HASH_WORKERS threads
+
+        Outputs
+            :returns: <list> of (CustomUser, Status) in the order of users, with the Status create() would return
+        """
+        results = [(None, status.HTTP_412_PRECONDITION_FAILED)] * len(users)
+        valid   = {}
+        dates   = {}
+        for index, (first_name, last_name, date_of_birth, email, password) in enumerate(users):
+            try: 
+                validate_email(email)
+                _validate_password(password)
+                dates[index] = _validate_date(date_of_birth)
+            except ValidationError:
+                continue
+            # the first signup of an email in the batch wins, like consecutive calls to create()
+            valid.setdefault(_normalize_email(email), index)
+
+        indices   = sorted(valid.values())
+        passwords = [users[index][4] for index in indices]
+        if hash_map is None:
+            with ThreadPoolExecutor(getattr(settings, "USER_HASH_WORKERS", 4)) as executor:
+                hashes = list(executor.map(make_password, passwords))
+        else:
+            hashes = list(hash_map(make_password, passwords))
+
+        for start in range(0, len(indices), chunk_size):
+            chunk = {}
+            for index, password in zip(indices[start:start + chunk_size], hashes[start:start + chunk_size]):
+                first_name, last_name, _, email, _ = users[index]
+                chunk[index] = self.model(email            = email,
+                                          email_normalized = _normalize_email(email),
+                                          last_name        = last_name,
+                                          first_name       = first_name,
+                                          date_of_birth    = dates[index],
+                                          password         = password)
+            
+            existing = set(self.filter(email_normalized__in = [user.email_normalized for user in chunk.values()])
+                               .values_list("email_normalized", flat = True))
+            chunk    = {index : user for index, user in chunk.items() if user.email_normalized not in existing}
 
-            return user, status.HTTP_201_CREATED
+            try:
+                with transaction.atomic(using = self._db):
+                    self.bulk_create(chunk.values())
+                # bulk_create sends no post_save
+                for index, user in chunk.items(): 
+                    _email_filter.add(user.email_normalized)
+                    results[index] = (user, status.HTTP_201_CREATED)
+
+            except IntegrityError:
+                # a concurrent signup took one of the emails: fall back to one INSERT per user for this chunk
+                for index, user in chunk.items():
+                    try:
+                        with transaction.atomic(using = self._db):
+                            user.save(using = self._db, force_insert = True)
+                        results[index] = (user, status.HTTP_201_CREATED)
+                    except IntegrityError:
+                        pass
+
+        return results
+
+    def get_by_natural_key(self, email):
+        """ 
+        Override BaseUserManager.get_by_natural_key() to look users up by their normalized email 
+
+        Inputs
+            :param email: <str> email of the user, in any case
+
+        Outputs
+            :returns: <CustomUser> with the email
+            :raises: <CustomUser.DoesNotExist> if no user has the email
+        """
+        return self.get(email_normalized = _normalize_email(email))
+
+    def get_cached(self, user_id):
+        """
+        Returns the user with user_id from the user cache, loading and caching it on a miss
+
+        Inputs
+            :param user_id: <UUID> of the user
+
+        Outputs
+            :returns: <CustomUser> with user_id
+            :raises: <CustomUser.DoesNotExist> if no user has the id
+        """
+        token = _user_cache.token(user_id)
+        user  = _user_cache.get(user_id, token)
+        if user is None:
+            user = self.get(pk = user_id)
+            _user_cache.set(user, token)
+        return user
+
+    def get_cached_by_natural_key(self, email):
+        """
+        Returns the user with email from the user cache, loading and caching it on a miss
+
+        Inputs
+            :param email: <str> email of the user, in any case
+
+        Outputs
+            :returns: <CustomUser> with the email
+            :raises: <CustomUser.DoesNotExist> if no user has the email
+        """
+        normalized = _normalize_email(email)
+        user_id    = _user_cache.get_id(normalized)
+        if user_id is not None:
+            token = _user_cache.token(user_id)
+            user  = _user_cache.get(user_id, token)
+            if user is None:
+                user = self.filter(pk = user_id).first()
+                if user is not None:
+                    _user_cache.set(user, token)
+            # the email may have moved to another user since it was cached
+            if user is not None and user.email_normalized == normalized:
+                return user
+
+        # the token is read before the user is loaded, so an invalidation in between is not cached under a newer one
+        user_id = self.filter(email_normalized = normalized).values_list("pk", flat = True).get()
+        token   = _user_cache.token(user_id)
+        user    = self.get(pk = user_id)
+        _user_cache.set(user, token)
+        return user
+
+    async def aget_by_natural_key(self, email):
+        """ Asynchronous get_by_natural_key() """
+        return await self.aget(email_normalized = _normalize_email(email))
 
     def create_superuser(self, first_name, last_name, date_of_birth, email, password = None):
         """
@@ -113,21 +309,303 @@ class CustomUserManager(BaseUserManager):
                              ... HTTP_403_FORBIDDEN if email is unreachable 
                              ... HTTP_412_PRECONDITION_FAILED if one ore more of the request fields don't meet their precondition(s)          
         """
-        user, user_status = self.create(first_name, last_name, date_of_birth, email, password=password)
+        # the permissions go into the INSERT, no second write flips them afterwards
+        user, user_status = self.create(first_name, last_name, date_of_birth, email, password = password, 
+                                        is_staff = True, is_admin = True, is_superuser = True)
 
         if user_status == status.HTTP_201_CREATED:
-            print("User created\nSetting permissions ...")
-            user.is_staff = True
-            user.is_admin = True
-            user.is_superuser = True
-            user.save(using = self._db)
-        else: print(f"Failed to create user: {user_status}")
+            logger.info("Superuser created")
+        else: logger.warning("Failed to create user: %s", user_status)
 
         return user, user_status
 
 
-    def upgrade(self):
-        """             
+    def upgrade(self, queryset = None, chunk_size = 10000, **flags):
+        """
+        Sets the role flags of every user in queryset with set-based UPDATEs of at most chunk_size users each, 
+        then invalidates every cached user and permission set at once
+        
+        Inputs
+            :param queryset: optional <QuerySet> of the users to upgrade, every user by default
+            :param chunk_size: <int> users per UPDATE, so no statement locks a very large set of rows for long
+            :param flags: <bool> is_staff, is_admin, is_superuser, verified or is_active values to set
+
+        Outputs
+            :returns: <int> number of users whose flags changed
+            :raises: <TypeError> if a flag is not one of user_flags
         """
-        raise NotImplementedError
+        flags    = _flags(flags)
+        if not flags:
+            return 0
 
+        # users that already have every flag are skipped, and updated users leave the set, so chunks never revisit them
+        pending  = (self.all() if queryset is None else queryset).exclude(**flags).order_by("pk")
+        updated  = 0
+        last     = None
+        while True:
+            chunk = pending if last is None else pending.filter(pk__gt = last)
+            ids   = list(chunk.values_list("pk", flat = True)[:chunk_size])
+            if not ids: break
+            updated += self.filter(pk__in = ids).update(**flags)
+            last     = ids[-1]
+
+        if updated:
+            # QuerySet.update sends no signals: drop every cached user at once instead of one at a time
+            _user_cache.invalidate_all()
+            logger.info("Upgraded %d user(s): %s", updated, flags)
+        return updated
+
+class EmailOutboxManager(models.Manager):
+    """
+    AF(messages) = queue of email messages waiting to be sent by the outbox worker
+
+    Definitions
+        due
+            pending message whose next attempt time has passed
+
+            A message that failed 2 minutes ago with a 1 minute backoff is due
+        dead
+            message that failed max_attempts times
+
+            A dead message is kept for inspection but never retried
+
+    Representation Invariant
+        - inherits from models.Manager
+        - a message is claimed by at most one worker at a time
+
+    Representation Exposure
+        - inherits from models.Manager
+    """
+
+    def enqueue(self, from_email, reciepient_emails, subject, text_content, html_content):
+        """
+        Queues a message from from_email to each of the reciepient_emails
+
+        Inputs
+            :param from_email: <str> of sender's email
+            :param reciepient_emails: <list> of reciever emails
+            :param subject: <str> describing the message to be sent
+            :param text_content: <str> detailing the message's text content to send 
+            :param html_content: <str> detailing the message's html content to send 
+
+        Outputs
+            :returns: <list> of queued EmailOutbox messages, one per reciever
+        """
+        messages = [self.model(from_email   = from_email,
+                               recipient    = receiver_email,
+                               subject      = subject,
+                               text_content = text_content,
+                               html_content = html_content) for receiver_email in reciepient_emails]
+
+        if len(messages) == 1: 
+            messages[0].save(using = self._db)
+            return messages
+        return self.bulk_create(messages)
+
+    async def aenqueue(self, from_email, reciepient_emails, subject, text_content, html_content):
+        """ Asynchronous enqueue() """
+        messages = [self.model(from_email   = from_email,
+                               recipient    = receiver_email,
+                               subject      = subject,
+                               text_content = text_content,
+                               html_content = html_content) for receiver_email in reciepient_emails]
+
+        if len(messages) == 1: 
+            await messages[0].asave(using = self._db)
+            return messages
+        return await self.abulk_create(messages)
+
+    def claim(self, batch_size, lease):
+        """
+        Claims up to batch_size due messages for lease so no other worker sends them meanwhile
+
+        Inputs
+            :param batch_size: <int> maximum number of messages to claim
+            :param lease: <timedelta> how long the messages are held before they are due again
+        
+        Outputs
+            :returns: <list> of claimed EmailOutbox messages
+        """
+        now = timezone.now()
+        with transaction.atomic(using = self._db):
+            messages = list(self.select_for_update(skip_locked = True)
+                                .filter(status = self.model.PENDING, next_attempt_at__lte = now)
+                                .order_by("next_attempt_at")[:batch_size])
+            self.filter(id__in = [message.id for message in messages]).update(next_attempt_at = now + lease)
+
+        return messages
+
+    def drain(self, batch_size = 100, max_attempts = 5, backoff = 30):
+        """
+        Sends a batch of due messages over pooled connections, rescheduling failed messages with exponential backoff 
+        and dead-lettering those that failed max_attempts times
+
+        Inputs
+            :param batch_size: <int> maximum number of messages to send
+            :param max_attempts: <int> number of failed attempts before a message is dead
+            :param backoff: <int> seconds to wait before the first retry, doubled on every retry
+        
+        Outputs
+            :returns: <dict> counting the messages that were sent, retried and dead
+        """
+        from_password = getattr(settings, "USER_SMTP_PASSWORD", None)
+        smtp_server   = getattr(settings, "USER_SMTP_SERVER", None)
+        smtp_port     = getattr(settings, "USER_SMTP_PORT", None)
+        lease         = datetime.timedelta(seconds = 10*backoff)
+        counts        = {"sent" : 0, "retried" : 0, "dead" : 0}
+
+        messages      = self.claim(batch_size, lease)
+        senders       = {}
+        for message in messages: 
+            senders.setdefault(message.from_email, []).append(message)
+
+        for from_email, batch in senders.items():
+            errors = _send_emails(from_email, from_password, smtp_server, smtp_port, 
+                                  [(message.recipient, message.subject, message.text_content, message.html_content) for message in batch])
+
+            for message, error in zip(batch, errors):
+                if error is not None:
+                    message.attempts   += 1
+                    message.last_error  = str(error)
+                    if message.attempts >= max_attempts:
+                        message.status  = self.model.DEAD
+                        counts["dead"] += 1
+                    else:
+                        delay = backoff * 2**(message.attempts - 1) * random.uniform(1, 1.5)
+                        message.next_attempt_at = timezone.now() + datetime.timedelta(seconds = delay)
+                        counts["retried"]      += 1
+                    message.save(update_fields = ["attempts", "last_error", "status", "next_attempt_at"])
+                else:
+                    message.status  = self.model.SENT
+                    message.sent_at = timezone.now()
+                    message.save(update_fields = ["status", "sent_at"])
+                    counts["sent"] += 1
+
+        return counts
+
+
+class VerificationCodeManager(models.Manager):
+    """
+    AF(codes) = short-lived codes sent to users to verify their email, at most one per user
+
+    Definitions
+        live
+            code that has not expired and was guessed wrong fewer than USER_VERIFICATION_MAX_ATTEMPTS times
+
+            A code sent 20 minutes ago with a USER_VERIFICATION_TTL of 15 minutes is not live
+
+    Representation Invariant
+        - inherits from models.Manager
+        - only live codes verify a user, confirming a used code again is a no-op until it expires
+
+    Representation Exposure
+        - inherits from models.Manager
+    """
+
+    def _new(self, user):
+        """ Returns a new unsaved live code for user """
+        ttl = getattr(settings, "USER_VERIFICATION_TTL", 900)
+        return self.model(user = user, code = secrets.token_hex(4), attempts = 0, expires_at = timezone.now() + datetime.timedelta(seconds = ttl))
+
+    def _matching(self, email, code):
+        """ Returns the users with email whose live code is code, a join evaluated inside the UPDATE that verifies them """
+        users = self.model._meta.get_field("user").related_model.objects
+        if not isinstance(code, str) or not code.startswith(code_prefix):
+            # only the code as it was sent matches: the prefix is part of it, not any two characters
+            return users.none()
+        return users.filter(email_normalized = _normalize_email(email), verification__code = code.removeprefix(code_prefix), 
+                            verification__expires_at__gt = timezone.now(), 
+                            verification__attempts__lt = getattr(settings, "USER_VERIFICATION_MAX_ATTEMPTS", 5))
+
+    def _invalidate(self, email):
+        """ Invalidates the cached entries of the user with email, whose row was updated without signals """
+        user_id = _user_cache.get_id(email)
+        if user_id is None:
+            user_id = self.model._meta.get_field("user").related_model.objects.filter(email_normalized = _normalize_email(email)).values_list("pk", flat = True).first()
+        _user_cache.invalidate(user_id)
+
+    def issue(self, user):
+        """
+        Replaces user's code with a new live one in a single upsert, without touching the user's row
+
+        Inputs
+            :param user: <CustomUser> to verify
+
+        Outputs
+            :returns: <str> the code as the user types it, e.g. P-1a2b3c4d
+        """
+        code = self._new(user)
+        self.bulk_create([code], update_conflicts = True, unique_fields = ["user"], update_fields = ["code", "attempts", "expires_at"])
+        return code_prefix + code.code
+
+    async def aissue(self, user):
+        """ Asynchronous issue() """
+        code = self._new(user)
+        await self.abulk_create([code], update_conflicts = True, unique_fields = ["user"], update_fields = ["code", "attempts", "expires_at"])
+        return code_prefix + code.code
+
+    def confirm(self, email, code):
+        """
+        Verifies the user with email if code is their live code in one conditional UPDATE, so a concurrent send 
+        can't interleave between reading and checking the code, counting a wrong guess otherwise
+
+        Inputs
+            :param email: <str> user's email
+            :param code: <str> code the user typed, e.g. P-1a2b3c4d
+
+        Outputs
+            :returns: Status ...
+                             ... HTTP_202_ACCEPTED if the user is verified
+                             ... HTTP_403_FORBIDDEN if the user has no live code or code is not it
+        """
+        if self._matching(email, code).update(verified = True):
+            self._invalidate(email)
+            return status.HTTP_202_ACCEPTED
+
+        self.filter(user__email_normalized = _normalize_email(email)).update(attempts = models.F("attempts") + 1)
+        return status.HTTP_403_FORBIDDEN
+
+    async def aconfirm(self, email, code):
+        """ Asynchronous confirm() """
+        if await self._matching(email, code).aupdate(verified = True):
+            await sync_to_async(self._invalidate)(email)
+            return status.HTTP_202_ACCEPTED
+
+        await self.filter(user__email_normalized = _normalize_email(email)).aupdate(attempts = models.F("attempts") + 1)
+        return status.HTTP_403_FORBIDDEN
+
+    def prune(self, batch_size = 1000):
+        """
+        Deletes the codes that are no longer live, batch_size at a time so no statement locks the whole table
+
+        Inputs
+            :param batch_size: <int> maximum number of codes deleted per statement
+
+        Outputs
+            :returns: <int> number of codes deleted
+        """
+        dead    = (models.Q(expires_at__lte = timezone.now()) | 
+                   models.Q(attempts__gte = getattr(settings, "USER_VERIFICATION_MAX_ATTEMPTS", 5)))
+        deleted = 0
+        while True:
+            batch = list(self.filter(dead).values_list("pk", flat = True)[:batch_size])
+            if not batch: 
+                return deleted
+            deleted += self.filter(pk__in = batch).delete()[0]
+
+##### Functions #####
+def _flags(flags):
+    """
+    Returns flags after checking they are all boolean flags of a user
+
+    Inputs
+        :param flags: <dict> of flag name to value
+
+    Outputs
+        :returns: <dict> flags
+        :raises: <TypeError> if a name is not one of user_flags
+    """
+    unknown = set(flags) - set(user_flags)
+    if unknown:
+        raise TypeError("Unexpected user flag(s): %s" % ", ".join(sorted(unknown)))
+    return flags
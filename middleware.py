@@ -0,0 +1,113 @@
+"""
+user middleware
+"""
+import time, threading, contextvars
+from django.db import connections
+from django.dispatch import receiver
+from django.db.backends.signals import connection_created
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .user_utils.metric_helpers import _observe
+
+##### Global Constants #####
+# queries of the request being served, carried into the sync_to_async threads the async ORM runs them on
+_current = contextvars.ContextVar("user_request_queries", default = None)
+
+##### Classes #####
+class MetricsMiddleware():
+    """
+    AF(get_response) = middleware recording the latency, database query count and database time of every request
+        by the name of the view that served it
+
+    Representation Invariant
+        - works in front of sync and async views without switching threads
+        - a query is counted for the request whose context ran it, on whichever thread and connection it ran
+
+    Representation Exposure
+        - none
+    """
+    sync_capable  = True
+    async_capable = True
+
+    ##### Representation #####
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only = True):
+            _install(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = _Queries()
+        start   = time.perf_counter()
+        token   = _current.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries  = _Queries()
+        start    = time.perf_counter()
+        token    = _current.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, time.perf_counter() - start, queries)
+        return response
+
+class _Queries():
+    """
+    AF(count, seconds) = count database queries run for a request, taking seconds
+
+    Representation Invariant
+        - count and seconds only grow, under lock: queries of one request can run on several threads at once
+    """
+    __slots__ = ("count", "seconds", "lock")
+
+    ##### Representation #####
+    def __init__(self):
+        self.count   = 0
+        self.seconds = 0.0
+        self.lock    = threading.Lock()
+
+    def add(self, seconds):
+        """ Counts a query that took seconds """
+        with self.lock:
+            self.count   += 1
+            self.seconds += seconds
+
+##### Functions #####
+def _count_query(execute, sql, params, many, context):
+    """ Execute wrapper timing a query for the request being served in this context, if any """
+    queries = _current.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.add(time.perf_counter() - start)
+
+@receiver(connection_created, dispatch_uid = "user_count_queries")
+def _install(connection, **kwargs):
+    """ Installs _count_query on a connection, once: connections are per thread, so every thread's are covered """
+    if _count_query not in connection.execute_wrappers:
+        # first, as this may run inside another execute_wrapper() block, which pops the last wrapper on exit
+        connection.execute_wrappers.insert(0, _count_query)
+
+def _record(request, seconds, queries):
+    """
+    Records a request's latency, query count and database time under the name of the view that served it
+    """
+    match = getattr(request, "resolver_match", None)
+    view  = match.view_name if match is not None else "unresolved"
+    _observe("user_request_seconds", seconds, view = view)
+    _observe("user_request_queries", queries.count, view = view)
+    _observe("user_db_query_seconds", queries.seconds, view = view)
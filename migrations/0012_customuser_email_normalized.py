@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower, Trim
+
+
+def normalize_emails(apps, schema_editor):
+    CustomUser = apps.get_model('user', 'CustomUser')
+    users = CustomUser.objects.using(schema_editor.connection.alias)
+    users.update(email_normalized=Lower(Trim('email')))
+
+    # fail with the accounts to merge rather than an IntegrityError from the unique index below
+    collisions = list(users.values('email_normalized').annotate(accounts=Count('pk')).filter(accounts__gt=1)
+                      .values_list('email_normalized', flat=True).order_by('email_normalized')[:50])
+    if collisions:
+        emails = {}
+        for email, normalized in users.filter(email_normalized__in=collisions).values_list('email', 'email_normalized'):
+            emails.setdefault(normalized, []).append(email)
+        raise RuntimeError(
+            "Several users have the same email once normalized, merge or rename them before migrating "
+            "(at most 50 shown):\n" + "\n".join("%s: %s" % (normalized, ", ".join(sorted(group))) for normalized, group in sorted(emails.items()))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='email_normalized',
+            field=models.CharField(editable=False, max_length=234, null=True),
+        ),
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customuser',
+            name='email_normalized',
+            field=models.CharField(editable=False, max_length=234, unique=True),
+        ),
+    ]
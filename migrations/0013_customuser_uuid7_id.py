@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:01
+
+from django.db import migrations, models
+import user.user_utils.model_helpers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0012_customuser_email_normalized'),
+    ]
+
+    # Only new rows get time-ordered keys: the default lives in Python, so existing keys are left alone and
+    # the table is not rebuilt (which AlterField would do on SQLite).
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='customuser',
+                    name='id',
+                    field=models.UUIDField(default=user.user_utils.model_helpers._uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import datetime
+from django.utils import timezone
+
+
+def carry_over_codes(apps, schema_editor):
+    # unverified users can still confirm the code they were sent, for one more code lifetime
+    CustomUser       = apps.get_model('user', 'CustomUser')
+    VerificationCode = apps.get_model('user', 'VerificationCode')
+    alias            = schema_editor.connection.alias
+    expires_at       = timezone.now() + datetime.timedelta(seconds=getattr(settings, 'USER_VERIFICATION_TTL', 900))
+    codes            = [VerificationCode(user_id=user_id, code=str(code)[:8], expires_at=expires_at)
+                        for user_id, code in CustomUser.objects.using(alias).filter(verified=False).values_list('id', 'verification_code').iterator()]
+    VerificationCode.objects.using(alias).bulk_create(codes, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0013_customuser_uuid7_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificationCode',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='verification', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('code', models.CharField(max_length=8)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(carry_over_codes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='verification_code',
+        ),
+    ]
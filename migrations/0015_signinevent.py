@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0014_verificationcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignInEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=234)),
+                ('result', models.CharField(choices=[('succeeded', 'Succeeded'), ('failed', 'Failed'), ('unverified', 'Unverified'), ('throttled', 'Throttled')], max_length=10)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sign_ins', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['email', 'created_at'], name='user_signin_email_idx')],
+            },
+        ),
+    ]
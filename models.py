@@ -1,23 +1,36 @@
 """
 user models
 """
-import uuid
+import contextlib, contextvars
 from django.db import models
-from .managers import CustomUserManager
-from .user_utils.model_helpers import _send_email
+from django.utils import timezone
+from .managers import CustomUserManager, EmailOutboxManager, VerificationCodeManager
+from .user_utils.model_helpers import _enqueue_email, _aenqueue_email, _normalize_email, _run_in_background, _uuid7
 from django.contrib.auth.models import AbstractBaseUser
+from django.contrib.auth.hashers import check_password, make_password
+from .user_utils.metric_helpers import _timed
+from .user_utils.cache_helpers import _user_cache
 from django.contrib.auth.models import PermissionsMixin
 
 ##### Global Constants #####
-alphabet_size = 26
+alphabet_size  = 26
+_track_changes = contextvars.ContextVar("user_track_changes", default = True)
 
 ##### Classes #####
 class CustomUser(AbstractBaseUser, PermissionsMixin):
     """
     AF(first_name, last_name, date_of_birth, email) = user first_name last_name born on date_of_birth reachable at email
     
+    Definitions
+        changed field
+            column whose value differs from the one loaded from, or last saved to, the database
+
+            Setting verified on a user read from the database changes one field, and saving it writes one column
+
     Represnetation Invariant
         - inherits from AbstractBaseUser
+        - email_normalized is the normalized email and is unique 
+        - while changes are tracked, saving a user loaded from the database only writes its changed fields
 
     Representation Exposure
         - inherits from AbstractBaseUser
@@ -29,14 +42,14 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     first_name        = models.CharField(max_length  = alphabet_size)
     last_name         = models.CharField(max_length  = 2*alphabet_size)
     email             = models.EmailField(max_length = 9*alphabet_size, unique = True)
+    email_normalized  = models.CharField(max_length  = 9*alphabet_size, unique = True, editable = False)
 
     is_active         = models.BooleanField(default  = True)
     is_superuser      = models.BooleanField(default  = False)
     is_admin          = models.BooleanField(default  = False)
     is_staff          = models.BooleanField(default  = False)
     verified          = models.BooleanField(default  = False)
-    id                = models.UUIDField(primary_key = True,  editable = False, unique = True, default = uuid.uuid4)
-    verification_code = models.UUIDField(primary_key = False, editable = False, unique = True, default = uuid.uuid4)
+    id                = models.UUIDField(primary_key = True,  editable = False, unique = True, default = _uuid7)
 
     USERNAME_FIELD    = 'email'
     REQUIRED_FIELDS   = ['first_name', 'last_name', 'date_of_birth']
@@ -45,41 +58,255 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def has_permission(self, permission, obj = None) -> bool:
         """
-        Checks if the user has the given permission on an obj
+        Checks if the user has the given permission on an obj, in memory once the user's permissions are cached 
+        by CachedModelBackend
         
         Inputs
-            :param permission: <str> referencing the functionailty in question
+            :param permission: <str> referencing the functionailty in question, as "<app_label>.<codename>"
             :param obj: <object> with the permission
         
         Outputs
             :returns: <bool> True if has the given permission on the obj, False otherwise
         """
-        raise NotImplementedError
+        return self.has_perm(permission, obj)
     
-    def send_verification_code(self) -> uuid:
+    def check_password(self, raw_password) -> bool:
         """
-        Generates a random verification code for the user and sends it to their email
+        Override AbstractBaseUser.check_password() to upgrade a hash made with outdated hasher parameters 
+        in the background instead of while the user signs in
+
+        Inputs
+            :param raw_password: <str> password to check
 
         Outputs
-            :returns: <UUID> encrypted verification code
+            :returns: <bool> True if raw_password matches the user's password, False otherwise
+        """
+        def setter(raw_password):
+            _run_in_background(_rehash_password, self.pk, self.password, raw_password)
+
+        with _timed("user_password_hash_seconds"):
+            return check_password(raw_password, self.password, setter)
+
+    def set_password(self, raw_password):
+        """ Override AbstractBaseUser.set_password() to time the hashing """
+        with _timed("user_password_hash_seconds"):
+            super().set_password(raw_password)
+
+    def send_verification_code(self) -> str:
+        """
+        Replaces the user's verification code with a new one and queues it to be sent to their email
+
+        Outputs
+            :returns: <str> verification code, e.g. P-1a2b3c4d
+        """
+        code = VerificationCode.objects.issue(self)
+        _enqueue_email(*self._verification_email(code))
+        return code
+
+    async def asend_verification_code(self) -> str:
+        """ Asynchronous send_verification_code() """
+        code = await VerificationCode.objects.aissue(self)
+        await _aenqueue_email(*self._verification_email(code))
+        return code
+
+    def _verification_email(self, code) -> tuple:
+        """
+        Inputs
+            :param code: <str> verification code to send
+
+        Outputs
+            :returns: <tuple> of the from_email, reciepient_emails, subject, text_content and html_content 
+                      of the message carrying the verification code
         """
-        self.verification_code = uuid.uuid4() 
-        self.save()  
         # sender and reciepient information
         from_email        = "noreply@ployem.com"
-        from_password     = None
         reciepient_emails = [self.email]
-        # server and port sending the message
-        smtp_server       = None 
-        smtp_port         = None
         # message content
         subject           = "Account verification code"
-        text_content      = "Your verification code is: P-%s" % str(self.verification_code)[:8]
+        text_content      = "Your verification code is: %s" % code
         html_content      = ""
 
-        _send_email(from_email, from_password, reciepient_emails, smtp_server, smtp_port, subject, text_content, html_content)
-        return self.verification_code
+        return from_email, reciepient_emails, subject, text_content, html_content
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """ Override AbstractBaseUser.from_db() to remember the loaded values while changes are tracked """
+        user = super().from_db(db, field_names, values)
+        if _track_changes.get():
+            user._loaded = user._values()
+        return user
+
+    def refresh_from_db(self, *args, **kwargs):
+        """ Override AbstractBaseUser.refresh_from_db() to remember the reloaded values """
+        super().refresh_from_db(*args, **kwargs)
+        if "_loaded" in self.__dict__:
+            self._loaded.update(self._values())
+
+    def _values(self) -> dict:
+        """ Returns the values of the loaded (non deferred) columns by attribute name """
+        return {field.attname : self.__dict__[field.attname] for field in self._meta.concrete_fields if field.attname in self.__dict__}
+
+    def changed_fields(self) -> set:
+        """
+        Outputs
+            :returns: <set> of the names of the fields changed since the user was loaded or saved, 
+                      None if the user was not loaded from the database
+        """
+        loaded = self.__dict__.get("_loaded")
+        if loaded is None: 
+            return None
+        return {name for name, value in self._values().items() if name not in loaded or loaded[name] != value}
+
+    @staticmethod
+    @contextlib.contextmanager
+    def untracked():
+        """ 
+        Context in which users are loaded without remembering their values and saved with every column, 
+        e.g. around bulk reads that never save 
+        """
+        token = _track_changes.set(False)
+        try:
+            yield
+        finally:
+            _track_changes.reset(token)
+
+    def save(self, *args, **kwargs):
+        """ 
+        Override AbstractBaseUser.save() to keep email_normalized in sync with email and, unless update_fields is given, 
+        to only write the changed fields of a user loaded from the database
+        """
+        self.email_normalized = _normalize_email(self.email)
+        update_fields         = kwargs.get("update_fields")
+        if update_fields is None and not args and not self._state.adding and not kwargs.get("force_insert") and _track_changes.get():
+            # an empty set saves nothing, like save(update_fields = [])
+            update_fields = kwargs["update_fields"] = self.changed_fields()
+        if update_fields is not None and "email" in update_fields:
+            kwargs["update_fields"] = set(update_fields) | {"email_normalized"}
+
+        super().save(*args, **kwargs)
+        if _track_changes.get():
+            saved = self._values()
+            if kwargs.get("update_fields") is not None:
+                saved = {name : value for name, value in saved.items() if name in kwargs["update_fields"]}
+            self.__dict__.setdefault("_loaded", {}).update(saved)
 
     def __str__(self) -> str:
         """ Override AbstractBaseUser.__str__() """
-        return "%s %s\n\tBirthday: %s\n\tEmail: %s" % (self.first_name, self.last_name, self.date_of_birth, self.email)
\ No newline at end of file
+        return "%s %s\n\tBirthday: %s\n\tEmail: %s" % (self.first_name, self.last_name, self.date_of_birth, self.email)
+
+class EmailOutbox(models.Model):
+    """
+    AF(from_email, recipient, subject, text_content, html_content, status, attempts) = email message 
+        from from_email to recipient with subject and content that was sent or failed attempts times
+
+    Represnetation Invariant
+        - status is one of {PENDING, SENT, DEAD}
+        - attempts >= 0
+        - sent_at is set iff status is SENT
+
+    Representation Exposure
+        - inherits from models.Model
+        - messages are only mutated by EmailOutboxManager.drain
+    """
+
+    ##### Representation #####
+    PENDING           = "pending"
+    SENT              = "sent"
+    DEAD              = "dead"
+    STATUSES          = [(PENDING, "Pending"), (SENT, "Sent"), (DEAD, "Dead")]
+
+    from_email        = models.EmailField(max_length = 9*alphabet_size)
+    recipient         = models.EmailField(max_length = 9*alphabet_size)
+    subject           = models.CharField(max_length  = 10*alphabet_size)
+    text_content      = models.TextField()
+    html_content      = models.TextField(blank = True)
+
+    status            = models.CharField(max_length  = 7, choices = STATUSES, default = PENDING)
+    attempts          = models.PositiveSmallIntegerField(default = 0)
+    last_error        = models.TextField(blank = True)
+    next_attempt_at   = models.DateTimeField(default = timezone.now)
+    created_at        = models.DateTimeField(auto_now_add = True)
+    sent_at           = models.DateTimeField(null = True, blank = True)
+
+    objects           = EmailOutboxManager()
+
+    class Meta:
+        indexes = [models.Index(fields = ["status", "next_attempt_at"], name = "user_outbox_due_idx")]
+
+    def __str__(self) -> str:
+        """ Override models.Model.__str__() """
+        return "%s -> %s: %s (%s, %d attempt(s))" % (self.from_email, self.recipient, self.subject, self.status, self.attempts)
+
+class VerificationCode(models.Model):
+    """
+    AF(user, code, expires_at, attempts) = code P-<code> sent to user to verify their email, valid until expires_at 
+        and guessed wrong attempts times
+
+    Represnetation Invariant
+        - a user has at most one code
+        - code is 8 lowercase hex digits
+        - attempts >= 0
+
+    Representation Exposure
+        - inherits from models.Model
+        - codes are only mutated by VerificationCodeManager
+    """
+
+    ##### Representation #####
+    user              = models.OneToOneField(CustomUser, primary_key = True, on_delete = models.CASCADE, related_name = "verification")
+    code              = models.CharField(max_length = 8)
+    expires_at        = models.DateTimeField(db_index = True)
+    attempts          = models.PositiveSmallIntegerField(default = 0)
+
+    objects           = VerificationCodeManager()
+
+    def __str__(self) -> str:
+        """ Override models.Model.__str__() """
+        return "P-%s for %s until %s (%d attempt(s))" % (self.code, self.user_id, self.expires_at, self.attempts)
+
+class SignInEvent(models.Model):
+    """
+    AF(email, user, result, ip, created_at) = sign in attempt as email from ip at created_at, with result, 
+        by user if email belonged to one
+
+    Represnetation Invariant
+        - result is one of {SUCCEEDED, FAILED, UNVERIFIED, THROTTLED}
+        - email is normalized
+
+    Representation Exposure
+        - inherits from models.Model
+        - events are only written, in batches, by user_utils.audit_helpers
+    """
+
+    ##### Representation #####
+    SUCCEEDED         = "succeeded"
+    FAILED            = "failed"
+    UNVERIFIED        = "unverified"
+    THROTTLED         = "throttled"
+    RESULTS           = [(SUCCEEDED, "Succeeded"), (FAILED, "Failed"), (UNVERIFIED, "Unverified"), (THROTTLED, "Throttled")]
+
+    email             = models.CharField(max_length  = 9*alphabet_size)
+    user              = models.ForeignKey(CustomUser, null = True, blank = True, on_delete = models.SET_NULL, related_name = "sign_ins")
+    result            = models.CharField(max_length  = 10, choices = RESULTS)
+    ip                = models.GenericIPAddressField(null = True, blank = True)
+    created_at        = models.DateTimeField(default = timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields = ["email", "created_at"], name = "user_signin_email_idx")]
+
+    def __str__(self) -> str:
+        """ Override models.Model.__str__() """
+        return "%s from %s at %s: %s" % (self.email, self.ip, self.created_at, self.result)
+
+##### Functions #####
+def _rehash_password(user_id, old_password, raw_password):
+    """
+    Replaces a user's password hash with one made by the preferred hasher, unless the password changed meanwhile
+
+    Inputs
+        :param user_id: <UUID> of the user
+        :param old_password: <str> hash the raw_password was checked against
+        :param raw_password: <str> the user's password
+    """
+    if CustomUser.objects.filter(pk = user_id, password = old_password).update(password = make_password(raw_password)):
+        _user_cache.invalidate(user_id)
@@ -0,0 +1,44 @@
+"""
+user parsers
+"""
+import json
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, FormParser, MultiPartParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+##### Classes #####
+class FastJSONParser(BaseParser):
+    """
+    AF() = JSON parser decoding request bodies with orjson, or the standard json module if orjson is not installed
+
+    Representation Invariant
+        - inherits from BaseParser
+        - parses application/json bodies encoded as utf-8
+
+    Representation Exposure
+        - inherits from BaseParser
+    """
+    media_type = "application/json"
+
+    def parse(self, stream, media_type = None, parser_context = None):
+        """ Override BaseParser.parse() """
+        body = stream.read() if stream is not None else b""
+        try:
+            return orjson.loads(body) if orjson is not None else json.loads(body)
+        except ValueError as error:
+            raise ParseError("JSON parse error - %s" % error)
+
+##### Functions #####
+def _parser_classes():
+    """
+    Returns the parsers of the user views: FastJSONParser with form parsers if USER_FAST_JSON is set, the REST framework defaults otherwise
+    """
+    if getattr(settings, "USER_FAST_JSON", False):
+        return [FastJSONParser, FormParser, MultiPartParser]
+    return api_settings.DEFAULT_PARSER_CLASSES
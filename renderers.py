@@ -0,0 +1,46 @@
+"""
+user renderers
+"""
+import json
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+##### Classes #####
+class FastJSONRenderer(BaseRenderer):
+    """
+    AF() = compact JSON renderer encoding response data with orjson, or the standard json module if orjson is not installed
+
+    Representation Invariant
+        - inherits from BaseRenderer
+        - renders utf-8 application/json without indentation, an empty body for no data
+
+    Representation Exposure
+        - inherits from BaseRenderer
+    """
+    media_type = "application/json"
+    format     = "json"
+    charset    = None
+
+    def render(self, data, accepted_media_type = None, renderer_context = None):
+        """ Override BaseRenderer.render() """
+        if data is None:
+            return b""
+        if orjson is not None:
+            return orjson.dumps(data, default = JSONEncoder().default)
+        return json.dumps(data, cls = JSONEncoder, separators = (",", ":"), ensure_ascii = False).encode()
+
+##### Functions #####
+def _renderer_classes():
+    """
+    Returns the renderers of the user views: FastJSONRenderer alone if USER_FAST_JSON is set, the REST framework defaults otherwise
+    """
+    if getattr(settings, "USER_FAST_JSON", False):
+        return [FastJSONRenderer]
+    return api_settings.DEFAULT_RENDERER_CLASSES
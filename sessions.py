@@ -0,0 +1,119 @@
+"""
+user sessions
+"""
+from django.conf import settings
+from django.db import router
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from .user_utils.buffer_helpers import WriteBehindBuffer
+
+##### Classes #####
+class SessionStore(CachedDBStore):
+    """
+    AF(session_key, cache) = session stored in cache, and persisted to the session table behind the request
+
+    Definitions
+        write-behind
+            the session table is written by a WriteBehindBuffer after the response, coalescing the writes of a session
+
+            Signing in and changing a session twice within USER_SESSION_FLUSH_INTERVAL writes one row, once
+        revoked
+            marker cached in place of a deleted session until its row is deleted, so it can't be loaded again from the table
+
+    Representation Invariant
+        - inherits from cached_db.SessionStore
+        - a session in the cache is read without touching the session table
+        - a deleted session is never loaded again, from the cache or the table
+
+    Representation Exposure
+        - inherits from cached_db.SessionStore
+    """
+    cache_key_prefix = "user.sessions"
+
+    def load(self):
+        """ Override CachedDBStore.load() to treat revoked sessions as missing and read writes still pending """
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # like CachedDBStore.load(): some backends raise on invalid keys
+            data = None
+
+        if data == revoked:
+            self._session_key = None
+            return {}
+        if data is None:
+            pending = _session_buffer.pending(self.session_key)
+            if pending is not None:
+                data = self.decode(pending[0]) if pending[0] is not None else {}
+            else:
+                data = super().load()
+        return data
+
+    def exists(self, session_key):
+        """ 
+        Override CachedDBStore.exists() to only check the cache: keys are random and reserved with cache.add(), 
+        a collision with a session only left in the table is negligible
+        """
+        return bool(session_key) and (self.cache_key_prefix + session_key) in self._cache
+
+    def create(self):
+        """ Override CachedDBStore.create() to reserve the key in the cache instead of inserting the row """
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create = True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create = False):
+        """ 
+        Override CachedDBStore.save() to write the cache now and the session table behind the request, 
+        raising UpdateError like CachedDBStore.save() when the session was deleted since it was loaded
+        """
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load = must_create)
+        if must_create:
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            if self._cache.get(self.cache_key) == revoked or _session_buffer.pending(self.session_key) == (None, None):
+                raise UpdateError
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        _session_buffer.put(self.session_key, (self.encode(data), self.get_expiry_date()))
+
+    def delete(self, session_key = None):
+        """ Override CachedDBStore.delete() to revoke the session in the cache now and delete its row behind the request """
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.set(self.cache_key_prefix + session_key, revoked, getattr(settings, "USER_SESSION_REVOKED_TTL", 3600))
+        _session_buffer.put(session_key, (None, None))
+
+##### Functions #####
+def _write_sessions(sessions):
+    """
+    Writes sessions to the session table: one upsert of the saved sessions and one DELETE of the deleted ones
+
+    Inputs
+        :param sessions: <dict> of session key to (encoded data, expire date), (None, None) for a deleted session
+    """
+    model   = SessionStore.get_model_class()
+    using   = router.db_for_write(model)
+    saved   = [model(session_key = key, session_data = data, expire_date = expire_date)
+               for key, (data, expire_date) in sessions.items() if data is not None]
+    deleted = [key for key, (data, _) in sessions.items() if data is None]
+
+    if saved:
+        model.objects.using(using).bulk_create(saved, update_conflicts = True, unique_fields = ["session_key"], 
+                                               update_fields = ["session_data", "expire_date"])
+    if deleted:
+        model.objects.using(using).filter(session_key__in = deleted).delete()
+
+##### Global Constants #####
+revoked         = "revoked"
+_session_buffer = WriteBehindBuffer(_write_sessions, "USER_SESSION")
@@ -0,0 +1,120 @@
+"""
+user signal receivers
+"""
+from .models import CustomUser
+from django.utils import timezone
+from django.dispatch import receiver
+from django.db.models import Q
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.contrib.auth.signals import user_logged_in
+from .user_utils.cache_helpers import _user_cache
+from .user_utils.audit_helpers import _last_logins
+from .user_utils.bloom_helpers import _email_filter
+
+##### Functions #####
+@receiver([post_save, post_delete], sender = CustomUser, dispatch_uid = "user_invalidate_cache")
+def _invalidate_user(sender, instance, **kwargs):
+    """
+    Invalidates the cached entries of a user that was saved or deleted
+
+    Inputs
+        :param sender: <class> CustomUser
+        :param instance: <CustomUser> that was saved or deleted
+    """
+    _user_cache.invalidate(instance.pk)
+
+@receiver(post_save, sender = CustomUser, dispatch_uid = "user_filter_email")
+def _filter_email(sender, instance, created, update_fields = None, **kwargs):
+    """
+    Adds the email of a user that was signed up, or whose email may have changed, to the email filter
+
+    Inputs
+        :param sender: <class> CustomUser
+        :param instance: <CustomUser> that was saved
+        :param created: <bool> True if the user was inserted
+        :param update_fields: optional <frozenset> of the fields that were saved, None if all were
+    """
+    if created or update_fields is None or "email_normalized" in update_fields:
+        _email_filter.add(instance.email_normalized)
+
+@receiver(m2m_changed, sender = CustomUser.groups.through, dispatch_uid = "user_invalidate_groups")
+@receiver(m2m_changed, sender = CustomUser.user_permissions.through, dispatch_uid = "user_invalidate_user_permissions")
+def _invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached permissions of the users whose groups or permissions were changed
+
+    Inputs
+        :param sender: <class> through model of CustomUser.groups or CustomUser.user_permissions
+        :param instance: <CustomUser> whose groups or permissions changed, or <Group> / <Permission> whose users changed
+        :param action: <str> m2m_changed action
+        :param reverse: <bool> True if instance is a Group or Permission
+        :param pk_set: <set> of the added or removed ids, None on clear
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            _user_cache.invalidate(instance.pk)
+    elif action in ("post_add", "post_remove"):
+        _invalidate_users(pk_set)
+    elif action == "pre_clear":
+        _invalidate_users(instance.user_set.values_list("pk", flat = True))
+
+@receiver(m2m_changed, sender = Group.permissions.through, dispatch_uid = "user_invalidate_group_permissions")
+def _invalidate_group_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached permissions of the members of the groups whose permissions were changed
+
+    Inputs
+        :param sender: <class> through model of Group.permissions
+        :param instance: <Group> whose permissions changed, or <Permission> whose groups changed
+        :param action: <str> m2m_changed action
+        :param reverse: <bool> True if instance is a Permission
+        :param pk_set: <set> of the added or removed ids, None on clear
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        groups = [instance.pk]
+    else:
+        groups = pk_set if action != "pre_clear" else instance.group_set.values_list("pk", flat = True)
+    _invalidate_users(CustomUser.objects.filter(groups__in = groups).values_list("pk", flat = True))
+
+@receiver(pre_delete, sender = Group, dispatch_uid = "user_invalidate_deleted_group")
+@receiver(pre_delete, sender = Permission, dispatch_uid = "user_invalidate_deleted_permission")
+def _invalidate_deleted(sender, instance, **kwargs):
+    """
+    Invalidates the cached permissions of the users that lose a group or permission being deleted
+
+    Inputs
+        :param sender: <class> Group or Permission
+        :param instance: <Group> or <Permission> being deleted
+    """
+    if sender is Group:
+        users = Q(groups = instance)
+    else:
+        users = Q(user_permissions = instance) | Q(groups__permissions = instance)
+    _invalidate_users(CustomUser.objects.filter(users).values_list("pk", flat = True))
+
+def _invalidate_users(user_ids):
+    """
+    Invalidates the cached entries of several users
+
+    Inputs
+        :param user_ids: <iterable> of <UUID> of the users
+    """
+    for user_id in set(user_ids):
+        _user_cache.invalidate(user_id)
+
+@receiver(user_logged_in, dispatch_uid = "user_record_last_login")
+def _record_last_login(sender, request, user, **kwargs):
+    """
+    Replaces django.contrib.auth.models.update_last_login: sets the last login of the user that signed in and queues
+    its UPDATE, so the sign ins of a user between two flushes write it once
+
+    Inputs
+        :param sender: <class> of the user
+        :param request: <HttpRequest> that signed the user in
+        :param user: <CustomUser> that signed in
+    """
+    user.last_login = timezone.now()
+    _last_logins.put(user.pk, user.last_login)
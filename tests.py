@@ -1,18 +1,56 @@
 """
 user tests
 """
-import time
-from django.urls import reverse
+import io, os, json, datetime, tempfile
+from unittest import mock
+from django.core.management import call_command
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password, get_hasher
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase, RequestFactory, AsyncClient, AsyncRequestFactory, override_settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.backends.base import UpdateError
+from django.urls import reverse, path
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from rest_framework import status
+from . import async_views
+from .apps import check_app_order
+from django.apps import apps
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .backends import CachedModelBackend
+from .middleware import MetricsMiddleware, _install, _count_query
+from rest_framework.exceptions import ParseError
+from .user_utils.cache_helpers import _user_cache
+from .user_utils.view_helpers import signup_schema, _validate_date
+from .user_utils.throttle_helpers import _get_limiter, _throttle_metrics, _client_ip
+from .models import CustomUser, EmailOutbox, VerificationCode, SignInEvent
+from .sessions import _session_buffer, SessionStore as BufferedSessionStore
+from .user_utils.audit_helpers import _events, _last_logins
+from .user_utils.bloom_helpers import BloomFilter, _email_filter
+from django.contrib.sessions.models import Session
 from rest_framework.test import APITestCase
-from user_utils.test_helpers import _read_email
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .user_utils.model_helpers import _send_email, _uuid7
+from .user_utils.test_helpers import _read_email, _iter_email, MailCaptureServer, IMAPCaptureServer
+from .benchmarks import auth_endpoints
 from django.core.exceptions import ValidationError
 
 ##### Global Constants #####
 url = {"signup" : reverse("user-signup"),
        "signin" : reverse("user-signin"),
-       "verify" : reverse("confirm-verify")}
+       "bulk"   : reverse("user-signup-bulk"),
+       "available" : reverse("email-available"),
+       "send"   : reverse("send-verify"),
+       "verify" : reverse("confirm-verify"),
+       "metrics": reverse("user-metrics")}
+# the async views served at the routes USER_ASYNC_VIEWS would serve them at, for the tests overriding ROOT_URLCONF with this module
+urlpatterns = [path("signup", async_views.sign_up), path("signout", async_views.sign_out)]
 
+# sign-in events and last logins are written by the request so no background flush races a test's transaction
+@override_settings(USER_SIGNIN_FLUSH_INTERVAL = 0)
 class UserTests(APITestCase):
     """
     Testing Strategy:
@@ -39,6 +77,38 @@ class UserTests(APITestCase):
             ... on verify (in)valid verification code
             ... on signin (in)valid request, (non)existing / (un)verified user 
     """
+    @classmethod
+    def setUpClass(cls):
+        """ Override APITestCase.setUpClass() to send and read the verification emails through local SMTP / IMAP stand-ins """
+        super().setUpClass()
+        cls.mail = MailCaptureServer().start()
+        cls.imap = IMAPCaptureServer(cls.mail).start()
+        smtp     = override_settings(USER_SMTP_SERVER = cls.mail.host, USER_SMTP_PORT = cls.mail.port, USER_SMTP_PASSWORD = None)
+        smtp.enable()
+        cls.addClassCleanup(cls.mail.stop)
+        cls.addClassCleanup(cls.imap.stop)
+        cls.addClassCleanup(smtp.disable)
+
+    def _receive_code(self, email, password):
+        """
+        Requests a verification code for email, sends it and reads it back from the email's mailbox
+
+        Inputs
+            :param email: <str> signed up email
+            :param password: <str> password of the email's mailbox
+
+        Outputs
+            :returns: <str> verification code that was sent
+        """
+        self.imap.accounts[email] = password
+        self.assertEqual(self.client.post(url['send'], {"email" : email}).status_code, status.HTTP_200_OK)
+        EmailOutbox.objects.drain()
+        self.assertTrue(self.mail.wait(email))
+
+        verification_message = _read_email(email, password, self.imap.host, self.imap.port, "[Gmail]/Spam", 
+                                           '(SUBJECT "Account verification code")', ssl = False)
+        return _read_code(verification_message[-1])
+
     ##### Signup Tests #####
     def test_signup_invalid(self):
         """ 
@@ -91,15 +161,15 @@ class UserTests(APITestCase):
         """
         email        = "jdoedne@gmail.com"
         password     = "wrongpassword"
-        smtp_server  = "imap.gmail.com"
-        smtp_port    = 933
-        criteria     = "(SUBJECT 'Ployem Verification Code')"
+        criteria     = '(SUBJECT "Account verification code")'
+        self.imap.accounts[email] = "kvhurribvflkdohx"
 
         request_data = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2011-11-22", "email" : email, "password" : "Pass$123"}
         response     = self.client.post(url['signup'], request_data)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertRaises(ValidationError, _read_email, email, password, smtp_server, smtp_port, criteria)
+        with self.assertLogs("user.user_utils.test_helpers", "ERROR"):
+            self.assertRaises(ValidationError, _read_email, email, password, self.imap.host, self.imap.port, "inbox", criteria, ssl = False)
 
     def test_verify_valid(self):
         """ 
@@ -109,19 +179,11 @@ class UserTests(APITestCase):
         """
         email                = "jdummy7898@gmail.com"
         password             = "kvhurribvflkdohx"
-        smtp_server          = "imap.gmail.com"
-        smtp_port            = 933
-        mail_box             = "[Gmail]/Spam"
-        criteria             = '(SUBJECT "Account verification code")'
           
         request_1_data       = {"firstName" : "Ahmed", "lastName" : "Katary", "dateOfBirth" : "2011-11-22", "email" : email, "password" : "Pass$123"}
         response_1           = self.client.post(url['signup'], request_1_data)
-        
-        print("Sleeping for 15 seconds while verification email sends...")
-        time.sleep(15)
 
-        verification_message = _read_email(email, password, smtp_server, smtp_port, mail_box, criteria)
-        verification_code    = _read_code(verification_message[-1])
+        verification_code    = self._receive_code(email, password)
 
         request_2_data       = {"email" : email, "verificationCode" : verification_code}
         response_2           = self.client.post(url['verify'], request_2_data)
@@ -164,19 +226,11 @@ class UserTests(APITestCase):
         """
         email                = "testkatary1@gmail.com"
         password             = "rtztcabzylopkxbr"
-        smtp_server          = "imap.gmail.com"
-        smtp_port            = 933
-        mail_box             = "[Gmail]/Spam"
-        criteria             = '(SUBJECT "Account verification code")'
           
         request_1_data       = {"firstName" : "Ployem", "lastName" : "Verify", "dateOfBirth" : "2001-10-27", "email" : email, "password" : "Pass$123"}
         response_1           = self.client.post(url['signup'], request_1_data)
-        
-        print("Sleeping for 15 seconds while verification email sends...")
-        time.sleep(15)
 
-        verification_message = _read_email(email, password, smtp_server, smtp_port, mail_box, criteria)
-        verification_code    = _read_code(verification_message[-1])
+        verification_code    = self._receive_code(email, password)
 
         request_2_data       = {"email" : email, "verificationCode" : verification_code}
         response_2           = self.client.post(url['verify'], request_2_data)
@@ -188,6 +242,1111 @@ class UserTests(APITestCase):
         self.assertEqual(response_2.status_code, status.HTTP_202_ACCEPTED)
         self.assertEqual(response_3.status_code, status.HTTP_200_OK)
 
+class ManagerTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on create: first-time email, existing email differing only by case, consecutive users' ids
+            ... on create superuser: flags written by the INSERT
+            ... on get_by_natural_key: email differing only by case
+            ... on upgrade: several chunks, users already upgraded skipped, cached users and permissions invalidated, unknown flag
+    """
+    def test_create_single_insert(self):
+        """ 
+        Tests ... 
+              ... on create: first-time email is signed up with one INSERT and no SELECT
+        """
+        with CaptureQueriesContext(connection) as queries:
+            user, user_status = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "JDoe@Ployem.com", "Pass$123")
+
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual(user_status, status.HTTP_201_CREATED)
+        self.assertEqual(statements.count("INSERT"), 1)
+        self.assertNotIn("SELECT", statements)
+        self.assertEqual(user.email_normalized, "jdoe@ployem.com")
+
+    def test_create_time_ordered_id(self):
+        """ 
+        Tests ... 
+              ... on create: consecutive users get increasing version 7 ids
+        """
+        users = [CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe%d@ployem.com" % number, "Pass$123")[0] for number in range(3)]
+        ids   = [user.id for user in users] + [_uuid7() for _ in range(1000)]
+
+        self.assertEqual({user_id.version for user_id in ids}, {7})
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(_uuid7(1577836800000, 0).int >> 80, 1577836800000)
+
+    def test_create_superuser_single_insert(self):
+        """ 
+        Tests ... 
+              ... on create superuser: flags written by the INSERT
+        """
+        with CaptureQueriesContext(connection) as queries:
+            admin, admin_status = CustomUser.objects.create_superuser("Ad", "Min", datetime.date(2001, 11, 22), "admin@ployem.com", "Pass$123")
+
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        admin      = CustomUser.objects.get(pk = admin.pk)
+        self.assertEqual(admin_status, status.HTTP_201_CREATED)
+        self.assertEqual(statements.count("INSERT"), 1)
+        self.assertNotIn("UPDATE", statements)
+        self.assertTrue(admin.is_staff and admin.is_admin and admin.is_superuser)
+        self.assertRaises(TypeError, CustomUser.objects.create, "Ad", "Min", datetime.date(2001, 11, 22), "x@ployem.com", "Pass$123", password_hash = "")
+
+    @override_settings(AUTHENTICATION_BACKENDS = ["user.backends.CachedModelBackend"])
+    def test_upgrade(self):
+        """ 
+        Tests ... 
+              ... on upgrade: several chunks, users already upgraded skipped, cached users and permissions invalidated, unknown flag
+        """
+        users = [CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe%d@ployem.com" % i, "Pass$123")[0] for i in range(6)]
+        CustomUser.objects.filter(pk = users[0].pk).update(is_staff = True, verified = True)
+        cached = CustomUser.objects.get_cached(users[1].pk)
+        self.assertFalse(cached.has_permission("user.view_customuser"))
+
+        with CaptureQueriesContext(connection) as queries:
+            updated = CustomUser.objects.upgrade(CustomUser.objects.filter(email__startswith = "jdoe"), chunk_size = 2, 
+                                                 is_staff = True, verified = True)
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        
+        self.assertEqual(updated, 5)
+        self.assertEqual(statements, ["SELECT", "UPDATE"] * 3 + ["SELECT"])
+        self.assertEqual(CustomUser.objects.filter(is_staff = True, verified = True).count(), 6)
+        self.assertTrue(CustomUser.objects.get_cached(users[1].pk).is_staff)
+        self.assertEqual(CustomUser.objects.upgrade(is_staff = True, verified = True), 0)
+
+        CustomUser.objects.filter(pk = users[1].pk).update(is_superuser = True)
+        self.assertFalse(CustomUser.objects.get_cached(users[1].pk).has_permission("user.view_customuser"))
+        CustomUser.objects.upgrade(CustomUser.objects.filter(pk = users[2].pk), is_superuser = True)
+        self.assertTrue(CustomUser.objects.get_cached(users[1].pk).has_permission("user.view_customuser"))
+        self.assertRaises(TypeError, CustomUser.objects.upgrade, is_owner = True)
+
+    def test_create_existing_case(self):
+        """ 
+        Tests ... 
+              ... on create: existing email differing only by case is rejected
+              ... on get_by_natural_key: email differing only by case finds the user
+        """
+        user, _               = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+        duplicate, dup_status = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "JDOE@ployem.com", "Pass$123")
+
+        self.assertIsNone(duplicate)
+        self.assertEqual(dup_status, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(CustomUser.objects.get_by_natural_key("JDoe@Ployem.COM"), user)
+
+    def test_bulk_create_users(self):
+        """ 
+        Tests ... 
+              ... on bulk create: first-time, unmet, duplicated in batch and existing emails
+        """
+        CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+        users   = [("Jane", "Doe", "2001-11-22", "jane@ployem.com", "Pass$123"),
+                   ("Jake", "Doe", "2001-11-22", "jake@ployem.com", "123"),
+                   ("Jane", "Doe", "2001-11-22", "JANE@ployem.com", "Pass$123"),
+                   ("John", "Doe", "2001-11-22", "JDoe@ployem.com", "Pass$123"),
+                   ("Jill", "Doe", "2001-11-22", "jill@ployem.com", "Pass$123")]
+        results = CustomUser.objects.bulk_create_users(users, chunk_size = 2)
+
+        self.assertEqual([user_status for _, user_status in results], [status.HTTP_201_CREATED, status.HTTP_412_PRECONDITION_FAILED,
+                                                                       status.HTTP_412_PRECONDITION_FAILED, status.HTTP_412_PRECONDITION_FAILED,
+                                                                       status.HTTP_201_CREATED])
+        self.assertTrue(CustomUser.objects.get_by_natural_key("jill@ployem.com").check_password("Pass$123"))
+
+    def test_signup_bulk(self):
+        """ 
+        Tests ... 
+              ... on signup bulk: non-staff request, staff request with complete and incomplete fields, body not an object
+        """
+        admin, _     = CustomUser.objects.create_superuser("Ad", "Min", datetime.date(2001, 11, 22), "admin@ployem.com", "Pass$123")
+        request_data = {"users" : [{"firstName" : "Jane", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jane@ployem.com", "password" : "Pass$123"},
+                                   {"firstName" : "Jake", "lastName" : "Doe", "email" : "jake@ployem.com"}]}
+        response_1   = self.client.post(url['bulk'], request_data, format = "json")
+        self.client.force_authenticate(admin)
+        response_2   = self.client.post(url['bulk'], request_data, format = "json")
+        not_objects  = [self.client.post(url['bulk'], data, format = "json") for data in (request_data["users"], "users", 3)]
+
+        self.assertEqual(response_1.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual([response.status_code for response in not_objects], [status.HTTP_400_BAD_REQUEST] * 3)
+        self.assertEqual(response_2.status_code, status.HTTP_200_OK)
+        self.assertEqual([result["status"] for result in response_2.data["results"]], [status.HTTP_201_CREATED, status.HTTP_400_BAD_REQUEST])
+        self.assertEqual(set(response_2.data["results"][1]["errors"]), {"dateOfBirth", "password"})
+
+    def test_import_users(self):
+        """ 
+        Tests ... 
+              ... on import users: first-time, unmet (password, email type, name length) and incomplete rows, resumed from the checkpoint
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.jsonl")
+            with open(path, "w") as file:
+                file.write('{"firstName" : "Jane", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jane@ployem.com", "password" : "Pass$123"}\n'
+                           '{"firstName" : "Jake", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jake@ployem.com", "password" : "123"}\n'
+                           '{"firstName" : "Jill", "lastName" : "Doe", "email" : "jill@ployem.com"}\n'
+                           '{"firstName" : "Joan", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : 123, "password" : "Pass$123"}\n'
+                           '{"firstName" : "%s", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "long@ployem.com", "password" : "Pass$123"}\n' % ("J" * 27))
+            first = io.StringIO()
+            call_command("import_users", path, chunk_size = 2, workers = 0, stdout = first)
+
+            with open(path, "a") as file:
+                file.write('{"firstName" : "Jim", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jim@ployem.com", "password" : "Pass$123"}\n')
+            output = io.StringIO()
+            call_command("import_users", path, chunk_size = 2, workers = 0, stdout = output)
+
+        self.assertIn("Imported 5 row(s) (1 created, 3 rejected, 1 incomplete)", first.getvalue())
+        self.assertIn("Resuming after row 5", output.getvalue())
+        self.assertEqual(sorted(CustomUser.objects.values_list("email", flat = True)), ["jane@ployem.com", "jim@ployem.com"])
+
+@override_settings(USER_SIGNIN_FLUSH_INTERVAL = 0)
+class AsyncViewTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on async signup (in)valid request, first-time / existing email
+            ... on async verify (in)valid verification code
+            ... on async signin (un)verified user
+            ... on CSRF checks: request without / with a CSRF token, anonymous / signed in session
+    """
+    async def _post(self, view, request_data):
+        """ Posts request_data as JSON to the async view """
+        request         = AsyncRequestFactory().post("/", request_data, content_type = "application/json")
+        request.session = SessionStore()
+        return await view(request)
+
+    async def test_async_flow(self):
+        """
+        Tests ... 
+              ... on async signup: invalid request, first-time and existing email
+              ... on async verify: invalid and valid verification code
+              ... on async signin: unverified and verified user
+        """
+        email        = "jdoe@ployem.com"
+        signup_data  = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : email, "password" : "Pass$123"}
+        signin_data  = {"email" : email, "password" : "Pass$123"}
+
+        invalid      = await async_views.sign_up(AsyncRequestFactory().get("/"))
+        created      = await self._post(async_views.sign_up, signup_data)
+        existing     = await self._post(async_views.sign_up, signup_data)
+        unverified   = await self._post(async_views.sign_in, signin_data)
+        sent         = await self._post(async_views.send_verify, {"email" : email})
+
+        code         = "P-" + (await VerificationCode.objects.aget(user__email_normalized = email)).code
+        wrong_code   = await self._post(async_views.confirm_verify, {"email" : email, "verificationCode" : "P-00000000"})
+        right_code   = await self._post(async_views.confirm_verify, {"email" : email, "verificationCode" : code})
+        verified     = await self._post(async_views.sign_in, signin_data)
+
+        self.assertEqual(invalid.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(existing.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(unverified.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(sent.status_code, status.HTTP_200_OK)
+        self.assertEqual(await EmailOutbox.objects.filter(recipient = email).acount(), 1)
+        self.assertEqual(wrong_code.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(right_code.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(verified.status_code, status.HTTP_200_OK)
+
+    @override_settings(ROOT_URLCONF = __name__)
+    async def test_async_csrf(self):
+        """
+        Tests ... 
+              ... on CSRF checks: request without a CSRF token from an anonymous and a signed in session, with a token
+        """
+        client      = AsyncClient(enforce_csrf_checks = True)
+        signup_data = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jdoe@ployem.com", "password" : "Pass$123"}
+        created     = await client.post("/signup", signup_data, content_type = "application/json")
+        await sync_to_async(client.force_login)(await CustomUser.objects.aget(email_normalized = "jdoe@ployem.com"))
+        signed_in   = await client.post("/signout", {"email" : "jdoe@ployem.com"}, content_type = "application/json")
+        client.cookies[settings.CSRF_COOKIE_NAME] = "a" * 32
+        with_token  = await client.post("/signout", {"email" : "jdoe@ployem.com"}, content_type = "application/json", headers = {"X-CSRFToken" : "a" * 32})
+
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(signed_in.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(with_token.status_code, status.HTTP_200_OK)
+
+@override_settings(AUTHENTICATION_BACKENDS = ["user.backends.CachedModelBackend"])
+class CachedBackendTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on authenticate: cold / warm cache, (in)valid password, nonexisting user
+            ... on get_user: warm cache, user saved / deleted since it was cached
+    """
+    def setUp(self):
+        """ Override TestCase.setUp() """
+        _user_cache.cache.clear()
+        self.user, _ = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+
+    def test_authenticate_cached(self):
+        """ 
+        Tests ... 
+              ... on authenticate: cold and warm cache, invalid password, nonexisting user
+        """
+        self.assertEqual(authenticate(username = "JDoe@ployem.com", password = "Pass$123"), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate(username = "jdoe@ployem.com", password = "Pass$123"), self.user)
+            self.assertIsNone(authenticate(username = "jdoe@ployem.com", password = "Wrong$123"))
+        self.assertIsNone(authenticate(username = "nobody@ployem.com", password = "Pass$123"))
+
+    def test_authenticate_invalidated_while_loading(self):
+        """ 
+        Tests ... 
+              ... on authenticate: cold cache, password changed after the user was loaded and before it was cached
+        """
+        cache_user = _user_cache.set
+        def change_password(user, token = None):
+            CustomUser.objects.filter(pk = self.user.pk).update(password = make_password("Next$123"))
+            _user_cache.invalidate(self.user.pk)
+            cache_user(user, token)
+
+        with mock.patch.object(_user_cache, "set", side_effect = change_password):
+            self.assertEqual(authenticate(username = "jdoe@ployem.com", password = "Pass$123"), self.user)
+
+        self.assertIsNone(authenticate(username = "jdoe@ployem.com", password = "Pass$123"))
+        self.assertEqual(authenticate(username = "jdoe@ployem.com", password = "Next$123"), self.user)
+
+    def test_get_user_invalidated(self):
+        """ 
+        Tests ... 
+              ... on get_user: warm cache, user saved and deleted since it was cached
+        """
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk).first_name, "John")
+
+        self.user.first_name = "Jon"
+        self.user.save()
+        self.assertEqual(backend.get_user(self.user.pk).first_name, "Jon")
+
+        self.user.delete()
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+@override_settings(PASSWORD_HASHERS = ["user.hashers.CalibratedPBKDF2PasswordHasher"], USER_PBKDF2_ITERATIONS = 1000)
+class HasherTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on check password: (in)valid password, hash made with current / outdated parameters, 
+                                   scrypt hash made with a work factor over twice the current one
+            ... on calibrate hashers: target time
+    """
+    def test_rehash_in_background(self):
+        """ 
+        Tests ... 
+              ... on check password: valid password with a hash made with outdated parameters is upgraded in the background,
+                                     invalid password and hash made with current parameters are not
+        """
+        user, _ = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+        with mock.patch("user.models._run_in_background", side_effect = lambda function, *args: function(*args)) as background:
+            self.assertTrue(user.check_password("Pass$123"))
+            self.assertFalse(user.check_password("Wrong$123"))
+            with self.settings(USER_PBKDF2_ITERATIONS = 2000):
+                self.assertTrue(user.check_password("Pass$123"))
+
+        self.assertEqual(background.call_count, 1)
+        self.assertTrue(CustomUser.objects.get(pk = user.pk).password.startswith("pbkdf2_sha256$2000$"))
+
+    @override_settings(PASSWORD_HASHERS = ["user.hashers.CalibratedScryptPasswordHasher"])
+    def test_scrypt_lowered_work_factor(self):
+        """ 
+        Tests ... 
+              ... on check password: scrypt hash made with a work factor over twice the current one verifies and must be upgraded
+        """
+        with self.settings(USER_SCRYPT_WORK_FACTOR = 2**15):
+            encoded = make_password("Pass$123")
+        with self.settings(USER_SCRYPT_WORK_FACTOR = 2**13):
+            hasher = get_hasher()
+            self.assertTrue(hasher.verify("Pass$123", encoded))
+            self.assertTrue(hasher.must_update(encoded))
+
+    def test_calibrate_hashers(self):
+        """ 
+        Tests ... 
+              ... on calibrate hashers: settings for the target time are printed
+        """
+        output = io.StringIO()
+        call_command("calibrate_hashers", hashers = ["pbkdf2"], target_ms = 10, allow_weaker = True, stdout = output)
+
+        self.assertIn("USER_PBKDF2_ITERATIONS = ", output.getvalue())
+
+@override_settings(USER_SIGNIN_RATES = {"ip" : (4, 60), "email" : (3, 60), "failures" : (2, 60)}, USER_SIGNIN_FLUSH_INTERVAL = 0)
+class ThrottleTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on signin: under / over the failed sign in, email and client ip limits
+            ... on client ip: X-Forwarded-For untrusted / trusted behind NUM_PROXIES, invalid address
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        _get_limiter("ip").cache.clear()
+
+    def test_signin_failures(self):
+        """ 
+        Tests ... 
+              ... on signin: under and over the failed sign in limit, rejected before authenticating
+        """
+        request_data = {"email" : "jdoe@ployem.com", "password" : "Wrong$123"}
+        responses    = [self.client.post(url['signin'], request_data) for _ in range(2)]
+        with mock.patch("user.views.authenticate") as authenticate:
+            rejected = self.client.post(url['signin'], request_data)
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_403_FORBIDDEN] * 2)
+        self.assertEqual(rejected.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(authenticate.called)
+        self.assertGreaterEqual(_throttle_metrics()["rejected_failures"], 1)
+
+    def test_signin_ip(self):
+        """ 
+        Tests ... 
+              ... on signin: under the email limits and over the client ip limit
+        """
+        with mock.patch("user.views.authenticate", return_value = None):
+            # a client rotating X-Forwarded-For still has one bucket: it is only trusted behind NUM_PROXIES proxies
+            responses = [self.client.post(url['signin'], {"email" : "user%d@ployem.com" % i, "password" : "Pass$123"}, 
+                                          HTTP_X_FORWARDED_FOR = "10.0.0.%d" % i) for i in range(5)]
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_403_FORBIDDEN] * 4 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    def test_client_ip(self):
+        """ 
+        Tests ... 
+              ... on client ip: X-Forwarded-For untrusted and trusted behind NUM_PROXIES, invalid address
+        """
+        forwarded = RequestFactory().get("/", HTTP_X_FORWARDED_FOR = "1.2.3.4, 10.0.0.1", REMOTE_ADDR = "10.0.0.2")
+        spoofed   = RequestFactory().get("/", HTTP_X_FORWARDED_FOR = "not an ip", REMOTE_ADDR = "10.0.0.2")
+
+        self.assertEqual(_client_ip(forwarded), "10.0.0.2")
+        with override_settings(REST_FRAMEWORK = {"NUM_PROXIES" : 1}):
+            self.assertEqual(_client_ip(forwarded), "10.0.0.1")
+            self.assertIsNone(_client_ip(spoofed))
+        with override_settings(REST_FRAMEWORK = {"NUM_PROXIES" : 2}):
+            self.assertEqual(_client_ip(forwarded), "1.2.3.4")
+
+class ValidatorTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on validate: missing fields, invalid fields, valid fields
+            ... on validate date: nonexisting day, out of range, valid string / date
+    """
+    def test_validate_all_errors(self):
+        """ 
+        Tests ... 
+              ... on validate: missing fields, invalid fields and valid fields, every error is reported at once
+        """
+        valid            = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2005-12-31", "email" : "jdoe@ployem.com", "password" : "Pass$123"}
+        invalid          = dict(valid, dateOfBirth = "1900-02-29", email = "jdoe", password = "123")
+        missing          = {"firstName" : "John", "email" : "jdoe"}
+        results          = signup_schema.validate_many([valid, invalid, missing])
+
+        self.assertEqual(results[0][2], status.HTTP_200_OK)
+        self.assertEqual(results[0][0]["date_of_birth"], datetime.date(2005, 12, 31))
+        self.assertEqual(results[1][2], status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(set(results[1][1]), {"dateOfBirth", "email", "password"})
+        self.assertEqual(results[2][2], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(results[2][1]), {"lastName", "dateOfBirth", "password", "email"})
+
+    def test_validate_date(self):
+        """ 
+        Tests ... 
+              ... on validate date: nonexisting day, out of range, valid string and date
+        """
+        self.assertRaises(ValidationError, _validate_date, "2001-04-31")
+        self.assertRaises(ValidationError, _validate_date, "2012-01-01")
+        self.assertRaises(ValidationError, _validate_date, datetime.date(1899, 12, 31))
+        self.assertEqual(_validate_date("2000-02-29"), datetime.date(2000, 2, 29))
+        self.assertEqual(_validate_date(datetime.date(2011, 12, 31)), datetime.date(2011, 12, 31))
+
+class FastJSONTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on parse: valid / malformed JSON
+            ... on render: no data, data with dates
+    """
+    def test_parse(self):
+        """ 
+        Tests ... 
+              ... on parse: valid and malformed JSON
+        """
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"email" : "jdoe@ployem.com"}')), {"email" : "jdoe@ployem.com"})
+        self.assertRaises(ParseError, FastJSONParser().parse, io.BytesIO(b'{"email" :'))
+
+    def test_render(self):
+        """ 
+        Tests ... 
+              ... on render: no data and data with dates
+        """
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+        self.assertEqual(json.loads(FastJSONRenderer().render({"dateOfBirth" : datetime.date(2001, 11, 22)})), {"dateOfBirth" : "2001-11-22"})
+
+@override_settings(MIDDLEWARE = settings.MIDDLEWARE + ["user.middleware.MetricsMiddleware"], USER_SIGNIN_FLUSH_INTERVAL = 0)
+class MetricsTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on metrics: request latency, query count, password hashing and throttle metrics are exposed
+            ... on metrics access: anonymous, wrong / right token, staff user
+            ... on async view: queries run on executor threads are counted
+            ... on installing the query counter: inside another execute wrapper block
+    """
+    def test_install_in_wrapper(self):
+        """ 
+        Tests ... 
+              ... on installing the query counter: inside another execute wrapper block, which only removes its own wrapper
+        """
+        scoped   = lambda execute, *args: execute(*args)
+        wrappers = connection.execute_wrappers[:]
+        connection.execute_wrappers[:] = [wrapper for wrapper in wrappers if wrapper is not _count_query]
+        try:
+            with connection.execute_wrapper(scoped):
+                _install(connection)
+            installed = connection.execute_wrappers[:]
+        finally:
+            connection.execute_wrappers[:] = wrappers
+
+        self.assertEqual(installed.count(_count_query), 1)
+        self.assertNotIn(scoped, installed)
+
+    @override_settings(USER_METRICS_TOKEN = "scrape")
+    def test_metrics(self):
+        """ 
+        Tests ... 
+              ... on metrics: request latency, query count, password hashing and throttle metrics are exposed
+              ... on metrics access: anonymous, wrong and right token
+        """
+        request_data = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jdoe@ployem.com", "password" : "Pass$123"}
+        self.client.post(url['signup'], request_data)
+        anonymous    = self.client.get(url['metrics'])
+        wrong_token  = self.client.get(url['metrics'], HTTP_AUTHORIZATION = "Bearer guess")
+        response     = self.client.get(url['metrics'], HTTP_AUTHORIZATION = "Bearer scrape")
+        content      = response.content.decode()
+
+        self.assertEqual(anonymous.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(wrong_token.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(content, r'user_request_seconds_count\{view="user-signup"\} [1-9]')
+        self.assertRegex(content, r'user_request_queries_bucket\{view="user-signup",le="\+Inf"\} [1-9]')
+        self.assertRegex(content, r'user_password_hash_seconds_count\{\} [1-9]')
+        self.assertIn("# TYPE user_signin_throttle_total counter", content)
+
+    def test_metrics_staff(self):
+        """ 
+        Tests ... 
+              ... on metrics access: staff user
+        """
+        staff, _ = CustomUser.objects.create("Ad", "Min", datetime.date(2001, 11, 22), "admin@ployem.com", "Pass$123", is_staff = True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url['metrics']).status_code, status.HTTP_200_OK)
+
+    async def test_metrics_async(self):
+        """ 
+        Tests ... 
+              ... on async view: queries run on executor threads are counted
+        """
+        counted      = []
+        request_data = {"firstName" : "John", "lastName" : "Doe", "dateOfBirth" : "2001-11-22", "email" : "jdoe@ployem.com", "password" : "Pass$123"}
+        middleware   = MetricsMiddleware(async_views.sign_up)
+        with mock.patch("user.middleware._record", side_effect = lambda request, seconds, queries: counted.append(queries.count)):
+            response = await middleware(AsyncRequestFactory().post("/", request_data, content_type = "application/json"))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreaterEqual(counted[0], 1)
+
+class OutboxTests(APITestCase):
+    """
+    Testing Strategy:
+        Definitions
+            outbox
+                queue of verification messages waiting for the worker
+
+        Partition ... 
+            ... on send verify: message is queued, not sent
+            ... on drain: message is sent, retried with backoff or dead after max attempts
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        self.user = CustomUser(first_name = "John", last_name = "Doe", date_of_birth = datetime.date(2001, 11, 22), email = "jdoe@ployem.com")
+        self.user.set_password("Pass$123")
+        self.user.save()
+
+    def test_send_verify_queues(self):
+        """ 
+        Tests ... 
+              ... on send verify: message is queued, not sent
+        """
+        with mock.patch("user.managers._send_emails") as send_emails:
+            response = self.client.post(url['send'], {"email" : self.user.email})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(send_emails.called)
+        self.assertEqual(EmailOutbox.objects.filter(recipient = self.user.email, status = EmailOutbox.PENDING).count(), 1)
+
+    def test_drain_sent(self):
+        """ 
+        Tests ... 
+              ... on drain: message is sent
+        """
+        code    = self.user.send_verification_code()
+        with mock.patch("user.managers._send_emails", return_value = [None]) as send_emails:
+            counts = EmailOutbox.objects.drain()
+
+        message = EmailOutbox.objects.get(recipient = self.user.email)
+        self.assertEqual(counts["sent"], 1)
+        self.assertEqual(message.status, EmailOutbox.SENT)
+        self.assertIn(code, send_emails.call_args[0][4][0][2])
+
+    def test_drain_retried_dead(self):
+        """ 
+        Tests ... 
+              ... on drain: message is retried with backoff, then dead after max attempts
+        """
+        self.user.send_verification_code()
+        with mock.patch("user.managers._send_emails", return_value = [ConnectionRefusedError("relay down")]):
+            retried = EmailOutbox.objects.drain(max_attempts = 2)
+            message = EmailOutbox.objects.get(recipient = self.user.email)
+            waiting = EmailOutbox.objects.drain(max_attempts = 2)
+
+            EmailOutbox.objects.update(next_attempt_at = message.created_at)
+            dead    = EmailOutbox.objects.drain(max_attempts = 2)
+
+        self.assertEqual(retried["retried"], 1)
+        self.assertGreater(message.next_attempt_at, message.created_at)
+        self.assertFalse(any(waiting.values()))
+        self.assertEqual(dead["dead"], 1)
+        self.assertEqual(EmailOutbox.objects.get(recipient = self.user.email).status, EmailOutbox.DEAD)
+
+    def test_drain_bad_recipient(self):
+        """ 
+        Tests ... 
+              ... on drain: message to a recipient smtplib can't encode is retried, the rest of the batch is sent
+        """
+        EmailOutbox.objects.enqueue("noreply@ployem.com", ["a@ployem.com", "jane@ex\u00e4mple.com", "b@ployem.com"], "Subject", "Text", "")
+        with MailCaptureServer() as mail, override_settings(USER_SMTP_SERVER = mail.host, USER_SMTP_PORT = mail.port, USER_SMTP_PASSWORD = None):
+            counts = EmailOutbox.objects.drain()
+            mail.wait(count = 2)
+
+        self.assertEqual(counts, {"sent" : 2, "retried" : 1, "dead" : 0})
+        self.assertEqual(sorted(receiver for _, receivers, _ in mail.messages for receiver in receivers), ["a@ployem.com", "b@ployem.com"])
+        self.assertEqual(EmailOutbox.objects.get(recipient = "jane@ex\u00e4mple.com").attempts, 1)
+
+    def test_pool_reuses_connection(self):
+        """ 
+        Tests ... 
+              ... on send: consecutive messages share one pooled connection
+        """
+        with mock.patch("smtplib.SMTP") as smtp:
+            smtp.return_value.noop.return_value = (250, b"OK")
+            _send_email("noreply@ployem.com", None, ["a@ployem.com", "b@ployem.com"], "pool.test", 2525, "Subject", "Text", "")
+            _send_email("noreply@ployem.com", None, ["c@ployem.com"], "pool.test", 2525, "Subject", "Text", "")
+
+        self.assertEqual(smtp.call_count, 1)
+        self.assertEqual(smtp.return_value.sendmail.call_count, 3)
+        self.assertFalse(smtp.return_value.quit.called)
+
+# the default, buffered sign-in audit: its writes are not part of a request
+@override_settings(USER_SIGNIN_FLUSH_INTERVAL = 3600)
+class QueryBudgetTests(TestCase):
+    """
+    Testing Strategy:
+        Definitions
+            budget
+                most queries a request to a route may run, from benchmarks.auth_endpoints.query_budgets
+
+        Partition ... 
+            ... on every route: requests succeed within the route's budget
+            ... on counting: transaction control statements / queries
+    """
+    def tearDown(self):
+        """ Override TestCase.tearDown() """
+        _events.flush()
+        _last_logins.flush()
+
+    def test_query_budgets(self):
+        """ 
+        Tests ... 
+              ... on every route: requests succeed within the route's budget
+        """
+        results = auth_endpoints.run(users = 3, requests = 2, drain = False)
+
+        self.assertEqual(set(results), set(auth_endpoints.query_budgets))
+        self.assertEqual(auth_endpoints.over_budget(results), {})
+        for name, result in results.items():
+            self.assertTrue(all(code.startswith("2") for code in result["statuses"]), name)
+            self.assertLessEqual(result["queries_max"], auth_endpoints.query_budgets[name], name)
+
+    def test_transaction_control(self):
+        """ 
+        Tests ... 
+              ... on counting: transaction control statements and queries
+        """
+        statements = ["BEGIN", "COMMIT", 'SAVEPOINT "s1"', 'RELEASE SAVEPOINT "s1"', "ROLLBACK", 'SELECT 1', 'UPDATE "user_customuser" SET "verified" = 1']
+        self.assertEqual([auth_endpoints._is_transaction_control(sql) for sql in statements], [True] * 5 + [False] * 2)
+
+class SeedUsersTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on seed: same seed creates the same users, which share one working password hash
+            ... on start: users numbered from start don't collide with the users already seeded
+    """
+    def test_seed_deterministic(self):
+        """ 
+        Tests ... 
+              ... on seed: same seed creates the same users, which share one working password hash
+        """
+        fields = ("id", "email", "first_name", "last_name", "date_of_birth", "verified")
+        call_command("seed_users", "30", "--seed", "7", stdout = io.StringIO())
+        first  = list(CustomUser.objects.order_by("email").values_list(*fields))
+        hashes = set(CustomUser.objects.values_list("password", flat = True))
+        CustomUser.objects.all().delete()
+        call_command("seed_users", "30", "--seed", "7", "--batch-size", "7", stdout = io.StringIO())
+
+        self.assertEqual(len(first), 30)
+        self.assertEqual(list(CustomUser.objects.order_by("email").values_list(*fields)), first)
+        self.assertEqual(len(hashes), 1)
+        self.assertTrue(CustomUser.objects.first().check_password("Pass$123"))
+
+    def test_seed_start(self):
+        """ 
+        Tests ... 
+              ... on start: users numbered from start don't collide with the users already seeded
+        """
+        call_command("seed_users", "10", stdout = io.StringIO())
+        call_command("seed_users", "10", "--start", "10", stdout = io.StringIO())
+
+        self.assertEqual(CustomUser.objects.count(), 20)
+        self.assertEqual(CustomUser.objects.get_by_natural_key(CustomUser.objects.first().email).email_normalized, 
+                         CustomUser.objects.first().email)
+
+class MailboxTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on iter email: messages fetched in one / several batches, whole / headers only, matching / not matching criteria
+    """
+    def test_iter_email(self):
+        """ 
+        Tests ... 
+              ... on iter email: messages fetched in one / several batches, whole / headers only, matching / not matching criteria
+        """
+        with MailCaptureServer() as mail, IMAPCaptureServer(mail, {"jdoe@ployem.com" : "Pass$123"}) as imap:
+            for number in range(5):
+                _send_email("noreply@ployem.com", None, ["jdoe@ployem.com"], mail.host, mail.port, "Code %d" % number, "Code P-%d" % number, "")
+            _send_email("noreply@ployem.com", None, ["jdoe@ployem.com"], mail.host, mail.port, "Welcome", "Hello", "")
+            mail.wait("jdoe@ployem.com", count = 6)
+
+            read    = lambda **options: list(_iter_email("jdoe@ployem.com", "Pass$123", imap.host, imap.port, "inbox", ssl = False, **options))
+            batched = read(criteria = '(SUBJECT "Code")', batch_size = 2)
+            single  = read(criteria = '(SUBJECT "Code")')
+            headers = read(headers_only = True)
+
+        self.assertEqual([message.subject for message in batched], ["Code %d" % number for number in range(5)])
+        self.assertEqual([message.content for message in batched], [message.content for message in single])
+        self.assertIn("Code P-4", batched[-1].content)
+        self.assertEqual([message.subject for message in headers][-1], "Welcome")
+        self.assertEqual({message.content for message in headers}, {""})
+        self.assertFalse(hasattr(batched[0], "__dict__"))
+
+class VerificationCodeTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on send: first / repeated send, user row not written
+            ... on confirm: live / wrong / wrongly prefixed / expired / exhausted code
+            ... on prune: live, expired and exhausted codes
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        self.user, _ = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+
+    def test_send_upserts(self):
+        """ 
+        Tests ... 
+              ... on send: first / repeated send, user row not written
+        """
+        first = self.user.send_verification_code()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.user.send_verification_code()
+
+        self.assertRegex(second, r"^P-[0-9a-f]{8}$")
+        self.assertEqual(VerificationCode.objects.filter(user = self.user).count(), 1)
+        self.assertEqual(VerificationCode.objects.get(user = self.user).code, second[2:])
+        self.assertFalse(any(CustomUser._meta.db_table in query["sql"] for query in queries.captured_queries))
+        self.assertEqual(self.client.post(url['verify'], {"email" : self.user.email, "verificationCode" : first}).status_code, 
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_confirm(self):
+        """ 
+        Tests ... 
+              ... on confirm: live / used / wrong / wrongly prefixed / expired / exhausted code, cached user
+        """
+        confirm = lambda code: self.client.post(url['verify'], {"email" : "JDoe@ployem.com", "verificationCode" : code}).status_code
+        code    = self.user.send_verification_code()
+        wrong   = "P-%08x" % ((int(code[2:], 16) + 1) % 16**8)
+
+        self.assertEqual(VerificationCode.objects.confirm(self.user.email, "XX" + code[2:]), status.HTTP_403_FORBIDDEN)
+        self.assertEqual(VerificationCode.objects.confirm(self.user.email, code[2:]), status.HTTP_403_FORBIDDEN)
+        VerificationCode.objects.filter(user = self.user).update(attempts = 0)
+        with override_settings(USER_VERIFICATION_MAX_ATTEMPTS = 2):
+            self.assertEqual(confirm(wrong), status.HTTP_403_FORBIDDEN)
+            self.assertEqual(confirm(wrong), status.HTTP_403_FORBIDDEN)
+            self.assertEqual(confirm(code), status.HTTP_403_FORBIDDEN)
+
+        with override_settings(USER_VERIFICATION_TTL = -1):
+            self.assertEqual(confirm(self.user.send_verification_code()), status.HTTP_403_FORBIDDEN)
+
+        code = self.user.send_verification_code()
+        _user_cache.set(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(VerificationCode.objects.confirm("JDoe@ployem.com", code), status.HTTP_202_ACCEPTED)
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+
+        self.assertEqual(confirm(code), status.HTTP_202_ACCEPTED)
+        self.assertEqual(statements, ["UPDATE"])
+        self.assertIsNone(_user_cache.get(self.user.pk))
+        self.assertTrue(CustomUser.objects.get(pk = self.user.pk).verified)
+
+    def test_prune(self):
+        """ 
+        Tests ... 
+              ... on prune: live, expired and exhausted codes
+        """
+        users = [CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe%d@ployem.com" % number, "Pass$123")[0] for number in range(3)]
+        for user in users + [self.user]: 
+            user.send_verification_code()
+        VerificationCode.objects.filter(user__in = users[:2]).update(expires_at = datetime.datetime(2000, 1, 1, tzinfo = datetime.timezone.utc))
+        VerificationCode.objects.filter(user = users[2]).update(attempts = 5)
+
+        output = io.StringIO()
+        call_command("prune_verification_codes", batch_size = 1, stdout = output)
+
+        self.assertIn("Deleted 3", output.getvalue())
+        self.assertEqual(list(VerificationCode.objects.values_list("user", flat = True)), [self.user.pk])
+
+@override_settings(AUTHENTICATION_BACKENDS = ["user.backends.CachedModelBackend"])
+class PermissionTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on has_permission: permission given directly / through a group / not given, superuser, cold / warm cache
+            ... on invalidation: group or permission added / removed, group permissions changed, group deleted, 
+                user saved superuser
+    """
+    def setUp(self):
+        """ Override TestCase.setUp() """
+        _user_cache.cache.clear()
+        self.user, _ = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+        self.group   = Group.objects.create(name = "editors")
+        self.view    = Permission.objects.get(codename = "view_customuser")
+        self.change  = Permission.objects.get(codename = "change_customuser")
+        self.delete  = Permission.objects.get(codename = "delete_customuser")
+        self.user.user_permissions.add(self.view)
+        self.group.permissions.add(self.change)
+        self.user.groups.add(self.group)
+
+    def _has(self, permission):
+        """ Returns whether a fresh copy of the user, as request.user would be, has permission """
+        return CustomUser.objects.get_cached(self.user.pk).has_permission(permission)
+
+    def test_has_permission_cached(self):
+        """ 
+        Tests ... 
+              ... on has_permission: permission given directly, through a group, not given, cold and warm cache
+        """
+        self.assertTrue(self._has("user.view_customuser"))
+        with self.assertNumQueries(0):
+            self.assertTrue(self._has("user.view_customuser"))
+            self.assertTrue(self._has("user.change_customuser"))
+            self.assertFalse(self._has("user.delete_customuser"))
+
+    def test_has_permission_invalidated(self):
+        """ 
+        Tests ... 
+              ... on invalidation: group or permission added and removed, group permissions changed, group deleted, 
+                  user saved superuser
+        """
+        self.assertFalse(self._has("user.delete_customuser"))
+        self.group.permissions.add(self.delete)
+        self.assertTrue(self._has("user.delete_customuser"))
+        self.user.groups.remove(self.group)
+        self.assertFalse(self._has("user.change_customuser"))
+        self.user.user_permissions.remove(self.view)
+        self.assertFalse(self._has("user.view_customuser"))
+        self.group.user_set.add(self.user)
+        self.assertTrue(self._has("user.change_customuser"))
+        self.group.delete()
+        self.assertFalse(self._has("user.change_customuser"))
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(self._has("user.delete_customuser"))
+
+class DirtyFieldTests(TestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on save: no / one / email changed field(s), explicit update_fields, new user, untracked
+    """
+    def setUp(self):
+        """ Override TestCase.setUp() """
+        CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+
+    def _saved_columns(self, user):
+        """ Saves user and returns the SQL of the statements it ran """
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        return [query["sql"] for query in queries.captured_queries]
+
+    def test_save_changed(self):
+        """ 
+        Tests ... 
+              ... on save: no / one / email changed field(s), explicit update_fields, new user
+        """
+        user          = CustomUser.objects.get(email_normalized = "jdoe@ployem.com")
+        unchanged     = self._saved_columns(user)
+        user.verified = True
+        verified      = self._saved_columns(user)
+        saved_again   = self._saved_columns(user)
+        user.email    = "John.Doe@ployem.com"
+        email         = self._saved_columns(user)
+
+        self.assertEqual(unchanged, [])
+        self.assertEqual(len(verified), 1)
+        self.assertIn('"verified"', verified[0])
+        self.assertNotIn('"password"', verified[0])
+        self.assertEqual(saved_again, [])
+        self.assertIn('"email_normalized"', email[0])
+        self.assertNotIn('"verified"', email[0])
+        self.assertEqual(CustomUser.objects.get(pk = user.pk).email_normalized, "john.doe@ployem.com")
+
+        user.first_name = "Jon"
+        user.last_name  = "Do"
+        user.save(update_fields = ["first_name"])
+        self.assertEqual(user.changed_fields(), {"last_name"})
+        self.assertIsNone(CustomUser(email = "new@ployem.com").changed_fields())
+
+    def test_save_untracked(self):
+        """ 
+        Tests ... 
+              ... on save: untracked
+        """
+        with CustomUser.untracked():
+            user          = CustomUser.objects.get(email_normalized = "jdoe@ployem.com")
+            user.verified = True
+            saved         = self._saved_columns(user)
+
+        self.assertIsNone(user.changed_fields())
+        self.assertIn('"password"', saved[0])
+
+@override_settings(SESSION_ENGINE = "user.sessions", USER_SESSION_FLUSH_INTERVAL = 3600, USER_SIGNIN_FLUSH_INTERVAL = 0)
+class SessionTests(APITestCase):
+    """
+    Testing Strategy:
+        Definitions
+            session table
+                django_session, written behind the request by the user.sessions engine
+
+        Partition ... 
+            ... on signin: session cached, session table written on flush only
+            ... on authenticated request: session read without the session table
+            ... on signout: session revoked before and after its row is deleted, saved afterwards by a request that loaded it before
+            ... on write-through (flush interval 0): session table written by the request
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123", verified = True)
+        self.signin_data = {"email" : "jdoe@ployem.com", "password" : "Pass$123"}
+
+    def tearDown(self):
+        """ Override APITestCase.tearDown() """
+        _session_buffer.flush()
+
+    def test_session_write_behind(self):
+        """ 
+        Tests ... 
+              ... on signin: session cached, session table written on flush only
+              ... on authenticated request: session read without the session table
+              ... on signout: session revoked before and after its row is deleted
+        """
+        signed_in = self.client.post(url['signin'], self.signin_data)
+        rows      = Session.objects.count()
+        _session_buffer.flush()
+        cookie    = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        with CaptureQueriesContext(connection) as queries:
+            signed_out = self.client.post(reverse("user-signout"), {"email" : "jdoe@ployem.com"})
+        session_queries = [query["sql"] for query in queries.captured_queries if Session._meta.db_table in query["sql"]]
+
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        revoked     = self.client.post(reverse("user-signout"), {"email" : "jdoe@ployem.com"})
+        _session_buffer.flush()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        revoked_row = self.client.post(reverse("user-signout"), {"email" : "jdoe@ployem.com"})
+
+        self.assertEqual(signed_in.status_code, status.HTTP_200_OK)
+        self.assertEqual(rows, 0)
+        self.assertEqual(signed_out.status_code, status.HTTP_200_OK)
+        self.assertEqual(session_queries, [])
+        self.assertEqual(revoked.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(revoked_row.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(Session.objects.filter(session_key = cookie).exists())
+
+    def test_session_saved_after_signout(self):
+        """ 
+        Tests ... 
+              ... on signout: session saved afterwards by a request that loaded it before
+        """
+        self.client.post(url['signin'], self.signin_data)
+        cookie  = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        loaded  = BufferedSessionStore(cookie)
+        loaded["visited"] = True
+        self.client.post(reverse("user-signout"), {"email" : "jdoe@ployem.com"})
+
+        with self.assertRaises(UpdateError):
+            loaded.save()
+        _session_buffer.flush()
+
+        self.assertEqual(BufferedSessionStore(cookie).load(), {})
+        self.assertFalse(Session.objects.filter(session_key = cookie).exists())
+
+    @override_settings(USER_SESSION_FLUSH_INTERVAL = 0)
+    def test_session_write_through(self):
+        """ 
+        Tests ... 
+              ... on write-through (flush interval 0): session table written by the request
+        """
+        self.client.post(url['signin'], self.signin_data)
+        self.assertTrue(Session.objects.filter(session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value).exists())
+
+@override_settings(USER_SIGNIN_RATES = {"ip" : (100, 60), "email" : (100, 60), "failures" : (2, 60)})
+class SignInAuditTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on signin: succeeded, failed, unverified, throttled
+            ... on buffered writes (flush interval > 0): nothing written before the flush, one INSERT for every event and
+                one UPDATE for every last login on flush, last login of a user signing in several times written once
+            ... on write-through (flush interval 0): event and last login written by the request, spoofed or invalid client ip
+            ... on app order: django.contrib.auth listed before / after user
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        _get_limiter("ip").cache.clear()
+        self.user, _ = CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123", verified = True)
+        CustomUser.objects.create("Jane", "Doe", datetime.date(2001, 11, 22), "jane@ployem.com", "Pass$123")
+
+    def tearDown(self):
+        """ Override APITestCase.tearDown() """
+        _events.flush()
+        _last_logins.flush()
+
+    @override_settings(USER_SIGNIN_FLUSH_INTERVAL = 3600)
+    def test_signin_buffered(self):
+        """ 
+        Tests ... 
+              ... on signin: succeeded, failed, unverified, throttled
+              ... on buffered writes (flush interval > 0): nothing written before the flush, one INSERT for every event and
+                  one UPDATE for every last login on flush, last login of a user signing in several times written once
+        """
+        for _ in range(3):
+            self.client.post(url['signin'], {"email" : "JDoe@ployem.com", "password" : "Pass$123"})
+        for _ in range(3):
+            self.client.post(url['signin'], {"email" : "nobody@ployem.com", "password" : "Pass$123"})
+        self.client.post(url['signin'], {"email" : "jane@ployem.com", "password" : "Pass$123"})
+
+        self.assertEqual(SignInEvent.objects.count(), 0)
+        self.assertIsNone(CustomUser.objects.get(pk = self.user.pk).last_login)
+        with CaptureQueriesContext(connection) as queries:
+            _events.flush()
+            _last_logins.flush()
+
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertEqual(sorted(SignInEvent.objects.values_list("result", flat = True)), 
+                         ["failed"] * 2 + ["succeeded"] * 3 + ["throttled", "unverified"])
+        self.assertEqual(SignInEvent.objects.filter(user = self.user, email = "jdoe@ployem.com").count(), 3)
+        self.assertEqual(SignInEvent.objects.exclude(ip = None).count(), 7)
+        self.assertIsNotNone(CustomUser.objects.get(pk = self.user.pk).last_login)
+
+    @override_settings(USER_SIGNIN_FLUSH_INTERVAL = 0)
+    def test_signin_write_through(self):
+        """ 
+        Tests ... 
+              ... on write-through (flush interval 0): event and last login written by the request, spoofed or invalid client ip
+        """
+        self.client.post(url['signin'], {"email" : "jdoe@ployem.com", "password" : "Pass$123"}, HTTP_X_FORWARDED_FOR = "1.2.3.4, 5.6.7.8")
+        self.client.post(url['signin'], {"email" : "jdoe@ployem.com", "password" : "Wrong$123"}, REMOTE_ADDR = "not an ip")
+
+        self.assertEqual(list(SignInEvent.objects.order_by("id").values_list("user", "result", "ip")), 
+                         [(self.user.pk, "succeeded", "127.0.0.1"), (None, "failed", None)])
+        self.assertIsNotNone(CustomUser.objects.get(pk = self.user.pk).last_login)
+
+    def test_app_order(self):
+        """ 
+        Tests ... 
+              ... on app order: django.contrib.auth listed before and after user
+        """
+        configs = list(apps.get_app_configs())
+        user    = apps.get_app_config("user")
+        with mock.patch("user.apps.apps.get_app_configs", return_value = [user] + [config for config in configs if config is not user]):
+            errors = check_app_order(None)
+
+        self.assertEqual(check_app_order(None), [])
+        self.assertEqual([error.id for error in errors], ["user.E001"])
+
+class EmailAvailableTests(APITestCase):
+    """
+    Testing Strategy:
+        Partition ... 
+            ... on bloom filter: added strings, strings never added
+            ... on email-available: email taken (in any case) / available, filter fresh / stale, user signed up or 
+                signed up in bulk since the filter was built, missing / malformed email
+    """
+    def setUp(self):
+        """ Override APITestCase.setUp() """
+        CustomUser.objects.create("John", "Doe", datetime.date(2001, 11, 22), "jdoe@ployem.com", "Pass$123")
+        # built in the test's transaction: the background build reads the table on its own connection
+        _email_filter.rebuild()
+
+    def _available(self, email):
+        """ Returns the available flag of email-available for email """
+        return self.client.get(url['available'], {"email" : email}).json()["available"]
+
+    def test_bloom_filter(self):
+        """ 
+        Tests ... 
+              ... on bloom filter: added strings, strings never added
+        """
+        bloom  = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add("member%d@ployem.com" % i)
+
+        self.assertTrue(all("member%d@ployem.com" % i in bloom for i in range(1000)))
+        self.assertLess(sum("other%d@ployem.com" % i in bloom for i in range(10000)), 300)
+
+    def test_email_available(self):
+        """ 
+        Tests ... 
+              ... on email-available: email taken in any case and available, filter fresh and stale, user signed up and 
+                  signed up in bulk since the filter was built, missing and malformed email
+        """
+        self.assertFalse(self._available("JDoe@ployem.com"))
+        with self.assertNumQueries(0):
+            self.assertTrue(self._available("jane@ployem.com"))
+        with mock.patch.object(_email_filter, "_rebuild_in_background") as rebuild, override_settings(USER_EMAIL_FILTER_MAX_AGE = 0):
+            # stale: still answered from the previous filter while it is rebuilt
+            with self.assertNumQueries(0):
+                self.assertTrue(self._available("jane@ployem.com"))
+        self.assertTrue(rebuild.called)
+
+        CustomUser.objects.create("Jane", "Doe", datetime.date(2001, 11, 22), "jane@ployem.com", "Pass$123")
+        CustomUser.objects.bulk_create_users([("Jim", "Doe", "2001-11-22", "jim@ployem.com", "Pass$123")])
+        self.assertFalse(self._available("jane@ployem.com"))
+        self.assertFalse(self._available("jim@ployem.com"))
+        self.assertEqual(self.client.get(url['available']).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url['available'], {"email" : "jdoe"}).status_code, status.HTTP_412_PRECONDITION_FAILED)
+
 ##### Helper Functions #####
 def _read_code(message):
     """
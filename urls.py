@@ -2,12 +2,20 @@
 user url patterns
 """
 from django.urls import path
-from . import views
+from django.conf import settings
+from . import views, async_views
+
+# USER_ASYNC_VIEWS serves the same routes with the native async views under ASGI
+auth_views = async_views if getattr(settings, "USER_ASYNC_VIEWS", False) else views
 
 urlpatterns = [
-    path("signup", views.sign_up, name = "user-signup"),
-    path("signin", views.sign_in, name = "user-signin"),
-    path("send-verify", views.send_verify, name = "send-verify"),
-    path("signout", views.sign_out, name = "user-signout"),
-    path("confirm-verify", views.confirm_verify, name = "confirm-verify"),
-]
\ No newline at end of file
+    path("signup", auth_views.sign_up, name = "user-signup"),
+    path("signup-bulk", views.sign_up_bulk, name = "user-signup-bulk"),
+    path("email-available", views.email_available, name = "email-available"),
+    path("signin", auth_views.sign_in, name = "user-signin"),
+    path("send-verify", auth_views.send_verify, name = "send-verify"),
+    path("signout", auth_views.sign_out, name = "user-signout"),
+    path("confirm-verify", auth_views.confirm_verify, name = "confirm-verify"),
+    path("throttle-metrics", views.throttle_metrics, name = "throttle-metrics"),
+    path("metrics", views.metrics, name = "user-metrics"),
+]
@@ -0,0 +1,55 @@
+"""
+audit helpers
+"""
+import itertools
+from django.apps import apps
+from django.utils import timezone
+from django.db.models import Case, When, Value
+from .buffer_helpers import WriteBehindBuffer
+from .cache_helpers import _user_cache
+from .model_helpers import _normalize_email
+from .throttle_helpers import _client_ip
+
+##### Functions #####
+def _write_events(events):
+    """
+    Inserts sign in events with multi-row INSERTs
+
+    Inputs
+        :param events: <dict> of sequence number to unsaved SignInEvent
+    """
+    model = apps.get_model("user", "SignInEvent")
+    model.objects.bulk_create(events.values(), batch_size = 1000)
+
+def _write_last_logins(last_logins):
+    """
+    Sets the last login of several users with one UPDATE ... CASE statement, then invalidates their cached entries
+
+    Inputs
+        :param last_logins: <dict> of user id to last login time
+    """
+    model = apps.get_model("user", "CustomUser")
+    model.objects.filter(pk__in = last_logins.keys()).update(
+        last_login = Case(*[When(pk = user_id, then = Value(last_login)) for user_id, last_login in last_logins.items()]))
+    for user_id in last_logins:
+        _user_cache.invalidate(user_id)
+
+def _audit_sign_in(request, email, result, user = None):
+    """
+    Queues a sign in event to be written with the next batch
+
+    Inputs
+        :param request: <HttpRequest> signing in
+        :param email: <str> email signing in
+        :param result: <str> one of SignInEvent.RESULTS
+        :param user: optional <CustomUser> the email belongs to
+    """
+    model = apps.get_model("user", "SignInEvent")
+    _events.put(next(_sequence), model(email = _normalize_email(email), user_id = getattr(user, "pk", None), result = result, 
+                                       ip = _client_ip(request), created_at = timezone.now()))
+
+##### Global Constants #####
+_sequence    = itertools.count()
+# written behind the request every USER_SIGNIN_FLUSH_INTERVAL seconds (1), at most that many seconds of events are lost on a crash
+_events      = WriteBehindBuffer(_write_events, "USER_SIGNIN")
+_last_logins = WriteBehindBuffer(_write_last_logins, "USER_SIGNIN")
@@ -0,0 +1,169 @@
+"""
+bloom helpers
+"""
+import math, time, logging, hashlib, threading
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from .model_helpers import _normalize_email
+
+##### Classes #####
+class BloomFilter():
+    """
+    AF(bits, hashes) = set of the strings added, answering membership with false positives but never false negatives
+
+    Definitions
+        false positive
+            string reported as added although it was not
+
+            With the default error rate, about 1 in 100 emails nobody signed up with is reported as taken
+
+    Representation Invariant
+        - an added string is always reported as added
+        - while at most capacity strings were added, a string that was not is reported as added with probability <= error_rate
+
+    Representation Exposure
+        - not thread safe: concurrent adds can lose bits, callers serialize them
+    """
+
+    ##### Representation #####
+    def __init__(self, capacity, error_rate = 0.01):
+        self.capacity = max(1, capacity)
+        self.size     = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2)**2))
+        self.hashes   = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count    = 0
+        self._bits    = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        """ Returns the bit positions of item, derived from one 128 bit hash by double hashing """
+        digest = hashlib.blake2b(item.encode(), digest_size = 16).digest()
+        first  = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i*second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        """ Adds the string item """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        """ Returns False if item was never added, True if it probably was """
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class EmailFilter():
+    """
+    AF(filter, built_at) = normalized emails of the users in the table at built_at, plus the ones signed up since in this process
+
+    Definitions
+        stale
+            filter built more than USER_EMAIL_FILTER_MAX_AGE seconds ago, or holding more emails than it was sized for
+
+            Users other processes signed up since the filter was built are only in it once it is rebuilt
+
+    Representation Invariant
+        - the filter is built from the table on a background thread on first use, and rebuilt there when it is stale:
+          a check never waits for the table to be read, it uses the previous filter until the new one is swapped in
+        - until the first filter is built every email might be taken
+        - emails added while the filter is rebuilt are added to the new filter too
+        - might_contain is False only for emails no user had when the filter was built and none added since
+
+    Representation Exposure
+        - only normalized emails are added and checked
+    """
+
+    ##### Representation #####
+    def __init__(self, error_rate = 0.01):
+        self.error_rate = error_rate
+        self._filter    = None
+        self._built_at  = 0
+        self._added     = None
+        self._lock      = threading.Lock()
+        self._building  = threading.Lock()
+
+    @property
+    def max_age(self):
+        """ USER_EMAIL_FILTER_MAX_AGE seconds, 300 by default """
+        return getattr(settings, "USER_EMAIL_FILTER_MAX_AGE", 300)
+
+    def _stale(self):
+        """ Returns True if the filter must be (re)built before it is read """
+        return (self._filter is None or time.monotonic() - self._built_at > self.max_age or
+                self._filter.count > self._filter.capacity)
+
+    def rebuild(self):
+        """ Builds the filter from the normalized emails in the table, sized for twice as many, e.g. at startup or after users were bulk loaded """
+        with self._building:
+            self._rebuild()
+
+    def _rebuild_in_background(self):
+        """ Starts rebuilding the filter on a daemon thread unless it is already being rebuilt """
+        if self._building.acquire(blocking = False):
+            threading.Thread(target = self._run, name = "user-email-filter", daemon = True).start()
+
+    def _run(self):
+        """ Rebuilds the filter, then releases the building lock acquired by _rebuild_in_background """
+        try:
+            self._rebuild()
+        except Exception:
+            logger.exception("Failed to build the email filter, emails are looked up until it is built")
+        finally:
+            self._building.release()
+            connections.close_all()
+
+    def _rebuild(self):
+        """ rebuild() while holding the building lock """
+        with self._lock:
+            self._added = []
+        try:
+            emails = apps.get_model("user", "CustomUser").objects.values_list("email_normalized", flat = True)
+            built  = BloomFilter(2 * emails.count() + 1000, self.error_rate)
+            for email in emails.iterator(chunk_size = 10000):
+                built.add(email)
+        finally:
+            with self._lock:
+                added, self._added = self._added, None
+
+        with self._lock:
+            for email in added:
+                built.add(email)
+            self._filter   = built
+            self._built_at = time.monotonic()
+
+    def add(self, email):
+        """
+        Adds the email of a user that was signed up
+
+        Inputs
+            :param email: <str> email of the user, in any case
+        """
+        email = _normalize_email(email)
+        with self._lock:
+            if self._added is not None:
+                self._added.append(email)
+            if self._filter is not None:
+                self._filter.add(email)
+
+    def might_contain(self, email):
+        """
+        Checks if a user may have email, without a query
+
+        Inputs
+            :param email: <str> email to check, in any case
+
+        Outputs
+            :returns: <bool> False if no user has email, True if one probably does or the filter is not built yet
+        """
+        built = self._filter
+        if self._stale():
+            self._rebuild_in_background()
+        return built is None or _normalize_email(email) in built
+
+    def reset(self):
+        """ Drops the filter, it is rebuilt from the table after next use """
+        with self._lock:
+            self._filter = None
+
+##### Global Constants #####
+logger        = logging.getLogger(__name__)
+_email_filter = EmailFilter()
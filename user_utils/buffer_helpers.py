@@ -0,0 +1,132 @@
+"""
+buffer helpers
+"""
+import atexit, logging, weakref, threading
+from django.conf import settings
+from django.db import close_old_connections
+
+##### Global Constants #####
+logger   = logging.getLogger(__name__)
+_buffers = weakref.WeakSet()
+
+##### Classes #####
+class WriteBehindBuffer():
+    """
+    AF(write, name, pending) = writes waiting in pending by key, handed together to write on a background thread
+        at most <name>_FLUSH_INTERVAL seconds after they were put, or as soon as <name>_FLUSH_SIZE keys are pending
+
+    Definitions
+        coalesce
+            a key put several times between two flushes is written once, with its last value
+
+            Three sign ins of one user before a flush write their last login once
+        write
+            callable taking a <dict> of key to value and persisting them, e.g. with one bulk statement
+
+    Representation Invariant
+        - pending holds at most one value per key
+        - a flush interval of 0 writes every put before put returns (write-through), raising what write raises
+        - writes that failed are put back unless a newer value was put meanwhile, and dropped after 
+          <name>_FLUSH_RETRIES consecutive failed flushes, so one bad value can't block the buffer forever
+
+    Representation Exposure
+        - write is called with a dict the buffer no longer uses
+    """
+
+    ##### Representation #####
+    def __init__(self, write, name, max_size = 500, interval = 1.0):
+        self._write    = write
+        self.name      = name
+        self._max_size = max_size
+        self._interval = interval
+        self._pending  = {}
+        self._lock     = threading.Condition()
+        self._thread   = None
+        self._failures = 0
+        _buffers.add(self)
+
+    @property
+    def max_size(self):
+        """ <name>_FLUSH_SIZE keys, max_size by default """
+        return getattr(settings, self.name + "_FLUSH_SIZE", self._max_size)
+
+    @property
+    def interval(self):
+        """ <name>_FLUSH_INTERVAL seconds, interval by default """
+        return getattr(settings, self.name + "_FLUSH_INTERVAL", self._interval)
+
+    @property
+    def retries(self):
+        """ <name>_FLUSH_RETRIES consecutive failed flushes before their values are dropped, 3 by default """
+        return getattr(settings, self.name + "_FLUSH_RETRIES", 3)
+
+    def put(self, key, value):
+        """
+        Queues value to be written for key, replacing the value pending for it
+
+        Inputs
+            :param key: <hashable> the value is written for
+            :param value: <object> to write
+        """
+        if not self.interval:
+            self._flush({key : value})
+            return
+
+        with self._lock:
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = "user-%s" % self.name.lower(), daemon = True)
+                self._thread.start()
+            if len(self._pending) >= self.max_size:
+                self._lock.notify()
+
+    def pending(self, key, default = None):
+        """ Returns the value waiting to be written for key, default if there is none """
+        with self._lock:
+            return self._pending.get(key, default)
+
+    def flush(self):
+        """ Writes every pending value now, in the calling thread """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._flush(pending)
+
+    def _flush(self, pending):
+        """ Writes pending, putting the values back if the write fails """
+        try:
+            self._write(pending)
+            self._failures = 0
+        except Exception:
+            if not self.interval:
+                # write-through fails like the write it replaces
+                raise
+            self._failures += 1
+            if self._failures > self.retries:
+                logger.exception("%s: failed to write %d value(s), dropping them", self.name, len(pending))
+                self._failures = 0
+                return
+            logger.warning("%s: failed to write %d value(s), retrying on the next flush", self.name, len(pending), exc_info = True)
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+
+    def _run(self):
+        """ Flushes every interval seconds, or sooner when max_size keys are pending, until the buffer is write-through """
+        while True:
+            with self._lock:
+                if not self.interval:
+                    # put starts a new thread if the buffer stops being write-through
+                    self._thread = None
+                    break
+                self._lock.wait_for(lambda: len(self._pending) >= self.max_size, self.interval)
+            self.flush()
+            close_old_connections()
+        self.flush()
+
+##### Functions #####
+@atexit.register
+def _flush_buffers():
+    """ Writes what every buffer still holds before the process exits """
+    for buffer in list(_buffers):
+        buffer.flush()
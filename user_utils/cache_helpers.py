@@ -0,0 +1,153 @@
+"""
+cache helpers
+"""
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from .model_helpers import _normalize_email
+
+##### Classes #####
+class UserCache():
+    """
+    AF(cache, timeout) = users and their permissions cached by id, users by normalized email, in cache for timeout seconds
+
+    Definitions
+        token
+            random version of a user's cached entries
+
+            Invalidating a user replaces its token, so every entry cached under the previous token is never read again
+        generation
+            random version of every cached entry, part of every token
+
+            Invalidating every user replaces the generation, so no entry cached before is read again, in one cache write
+        cache
+            any django cache backend, i.e. an object implementing get, set, add and delete like BaseCache
+
+            LocMemCache keeps users per process, a shared backend (redis, memcached) across processes
+
+    Representation Invariant
+        - a user or permission entry is only read under the user's current token
+        - email entries map a normalized email to the id of the user that had it when it was cached
+
+    Representation Exposure
+        - cached users are copies: mutating them does not change the cache
+    """
+
+    ##### Representation #####
+    def __init__(self, cache = None, timeout = None, prefix = "user"):
+        self._cache   = cache
+        self._timeout = timeout
+        self.prefix   = prefix
+
+    @property
+    def cache(self):
+        """ USER_CACHE_ALIAS of settings.CACHES, or a local memory cache if it is not set """
+        if self._cache is None:
+            alias       = getattr(settings, "USER_CACHE_ALIAS", None)
+            self._cache = caches[alias] if alias is not None else LocMemCache(self.prefix, {"OPTIONS" : {"MAX_ENTRIES" : 100000}})
+        return self._cache
+
+    @property
+    def timeout(self):
+        """ USER_CACHE_TIMEOUT seconds, 300 by default """
+        if self._timeout is None:
+            self._timeout = getattr(settings, "USER_CACHE_TIMEOUT", 300)
+        return self._timeout
+
+    def token(self, user_id) -> str:
+        """
+        Returns the current token of the user with user_id, creating one if it was invalidated or evicted
+
+        Inputs
+            :param user_id: <UUID> of the user
+
+        Outputs
+            :returns: <str> the user's current token
+        """
+        key        = "%s:token:%s" % (self.prefix, user_id)
+        generation = "%s:generation" % self.prefix
+        tokens     = self.cache.get_many([key, generation])
+        for name in (key, generation):
+            if name not in tokens:
+                token = uuid.uuid4().hex
+                if not self.cache.add(name, token, None): 
+                    token = self.cache.get(name, token)
+                tokens[name] = token
+        return "%s.%s" % (tokens[generation], tokens[key])
+
+    def get(self, user_id, token = None):
+        """
+        Returns the cached user with user_id
+
+        Inputs
+            :param user_id: <UUID> of the user
+            :param token: optional <str> token read before the user was last loaded
+
+        Outputs
+            :returns: <CustomUser> cached under the user's current token, None if there is none
+        """
+        return self.cache.get("%s:id:%s:%s" % (self.prefix, user_id, token or self.token(user_id)))
+
+    def get_id(self, email):
+        """
+        Returns the id cached for email
+
+        Inputs
+            :param email: <str> email of the user, in any case
+
+        Outputs
+            :returns: <UUID> of the user that had the email when it was cached, None if there is none
+        """
+        return self.cache.get("%s:email:%s" % (self.prefix, _normalize_email(email)))
+
+    def set(self, user, token = None):
+        """
+        Caches user by id and email
+
+        Inputs
+            :param user: <CustomUser> as loaded from the database
+            :param token: optional <str> token read before the user was loaded, so a concurrent invalidation wins
+        """
+        self.cache.set("%s:id:%s:%s" % (self.prefix, user.pk, token or self.token(user.pk)), user, self.timeout)
+        self.cache.set("%s:email:%s" % (self.prefix, user.email_normalized), user.pk, self.timeout)
+
+    def get_permissions(self, user_id, token = None):
+        """
+        Returns the permissions cached for the user with user_id
+
+        Inputs
+            :param user_id: <UUID> of the user
+            :param token: optional <str> token read before the permissions were last loaded
+
+        Outputs
+            :returns: <frozenset> of "<app_label>.<codename>" cached under the user's current token, None if there is none
+        """
+        return self.cache.get("%s:perms:%s:%s" % (self.prefix, user_id, token or self.token(user_id)))
+
+    def set_permissions(self, user_id, permissions, token = None):
+        """
+        Caches the permissions of the user with user_id
+
+        Inputs
+            :param user_id: <UUID> of the user
+            :param permissions: <iterable> of "<app_label>.<codename>" the user has, directly or through its groups
+            :param token: optional <str> token read before the permissions were loaded, so a concurrent invalidation wins
+        """
+        self.cache.set("%s:perms:%s:%s" % (self.prefix, user_id, token or self.token(user_id)), frozenset(permissions), self.timeout)
+
+    def invalidate(self, user_id):
+        """
+        Invalidates every entry cached for the user with user_id
+
+        Inputs
+            :param user_id: <UUID> of the user
+        """
+        self.cache.delete("%s:token:%s" % (self.prefix, user_id))
+
+    def invalidate_all(self):
+        """ Invalidates every entry cached for every user """
+        self.cache.set("%s:generation" % self.prefix, uuid.uuid4().hex, None)
+
+##### Global Constants #####
+_user_cache = UserCache()
@@ -0,0 +1,110 @@
+"""
+metric helpers
+"""
+import time, bisect, threading, contextlib
+
+##### Global Constants #####
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+query_buckets   = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+histograms      = {"user_request_seconds"       : ("Latency of the user views in seconds", latency_buckets),
+                   "user_request_queries"       : ("Database queries run per request", query_buckets),
+                   "user_db_query_seconds"      : ("Database time spent per request in seconds", latency_buckets),
+                   "user_password_hash_seconds" : ("Time spent hashing or checking a password in seconds", latency_buckets),
+                   "user_email_send_seconds"    : ("Time spent sending an email message in seconds", latency_buckets)}
+
+_local          = threading.local()
+_shards         = []
+_shards_lock    = threading.Lock()
+
+##### Functions #####
+def _shard():
+    """
+    Returns the calling thread's metric shard, registering it on first use
+
+    Definitions
+        shard
+            <dict> mapping (metric, labels) to [bucket counts..., sum, count], only ever written by one thread
+
+            Observations never take a lock: shards are only merged when the metrics are rendered
+    """
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = {}
+        with _shards_lock: 
+            _shards.append(shard)
+    return shard
+
+def _observe(metric, value, **labels):
+    """
+    Records value in the histogram metric
+
+    Inputs
+        :param metric: <str> one of histograms
+        :param value: <float> observed value
+        :param labels: <str> label values of the observation, e.g. view = "user-signin"
+    """
+    buckets = histograms[metric][1]
+    key     = (metric, tuple(sorted(labels.items())))
+    shard   = _shard()
+    entry   = shard.get(key)
+    if entry is None:
+        entry = shard[key] = [0] * (len(buckets) + 3)
+
+    entry[bisect.bisect_left(buckets, value)] += 1
+    entry[-2]                                 += value
+    entry[-1]                                 += 1
+
+@contextlib.contextmanager
+def _timed(metric, **labels):
+    """
+    Records the time spent in the context in the histogram metric
+
+    Inputs
+        :param metric: <str> one of histograms
+        :param labels: <str> label values of the observation
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(metric, time.perf_counter() - start, **labels)
+
+def _render_metrics(counters = ()):
+    """
+    Renders the metrics of this process in the Prometheus text exposition format
+
+    Inputs
+        :param counters: <iterable> of (metric, description, label, <dict> of counts by label value) counters to render too
+
+    Outputs
+        :returns: <str> of every histogram and counter
+    """
+    with _shards_lock:
+        shards = list(_shards)
+
+    merged = {}
+    for shard in shards:
+        for key, entry in list(shard.items()):
+            total = merged.setdefault(key, [0] * len(entry))
+            for index, value in enumerate(entry): 
+                total[index] += value
+
+    lines = []
+    for metric, (description, buckets) in histograms.items():
+        lines += ["# HELP %s %s" % (metric, description), "# TYPE %s histogram" % metric]
+        for (name, labels), entry in sorted(merged.items()):
+            if name != metric: continue
+            label_text = "".join('%s="%s",' % label for label in labels)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], entry):
+                cumulative += count
+                lines.append('%s_bucket{%sle="%s"} %d' % (metric, label_text, bound, cumulative))
+            lines.append("%s_sum{%s} %r" % (metric, label_text.rstrip(","), entry[-2]))
+            lines.append("%s_count{%s} %d" % (metric, label_text.rstrip(","), entry[-1]))
+
+    for metric, description, label, counts in counters:
+        lines += ["# HELP %s %s" % (metric, description), "# TYPE %s counter" % metric]
+        for value, count in sorted(counts.items()):
+            lines.append('%s{%s="%s"} %d' % (metric, label, value, count))
+
+    return "\n".join(lines) + "\n"
@@ -1,12 +1,336 @@
 """
 model helpers
 """
-import smtplib, ssl
+import time, uuid, atexit, logging, smtplib, ssl, secrets, inspect, threading, contextlib
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from asgiref.sync import sync_to_async
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from django.apps import apps
+from django.conf import settings
+from django.utils.module_loading import import_string
 from django.core.exceptions import ValidationError
+from .metric_helpers import _timed
+
+##### Global Constants #####
+logger       = logging.getLogger(__name__)
+_disconnects = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+_pools       = {}
+_pools_lock  = threading.Lock()
+_background  = ThreadPoolExecutor(thread_name_prefix = "user-background")
+_uuid7_lock  = threading.Lock()
+_uuid7_last  = [0, 0]
+
+##### Classes #####
+class _SMTP_SSL(smtplib.SMTP_SSL):
+    """
+    AF(session) = SMTP_SSL connection resuming the TLS session if one is given
+
+    Representation Invariant
+        - inherits from smtplib.SMTP_SSL
+
+    Representation Exposure
+        - inherits from smtplib.SMTP_SSL
+    """
+
+    def __init__(self, *args, session = None, **kwargs):
+        self.session = session
+        super().__init__(*args, **kwargs)
+
+    def _get_socket(self, host, port, timeout):
+        """ Override smtplib.SMTP_SSL._get_socket() """
+        new_socket = smtplib.SMTP._get_socket(self, host, port, timeout)
+        return self.context.wrap_socket(new_socket, server_hostname = self._host, session = self.session)
+
+class SMTPConnectionPool():
+    """
+    AF(smtp_server, smtp_port, from_email, from_password, max_size, max_age, keepalive) = up to max_size 
+        persistent connections to smtp_server:smtp_port logged in as from_email, each recycled after max_age 
+        seconds and health checked when idle for more than keepalive seconds
+
+    Represnetation Invariant
+        - at most max_size connections are checked out at a time
+        - a connection is either idle or checked out by exactly one thread
+        - TLS connections share one ssl context and resume the last TLS session
+
+    Representation Exposure
+        - connections are only exposed within the connection() context
+    """
+
+    ##### Representation #####
+    def __init__(self, smtp_server, smtp_port, from_email, from_password, max_size = 4, max_age = 300, keepalive = 30):
+        self.smtp_server   = smtp_server
+        self.smtp_port     = smtp_port
+        self.from_email    = from_email
+        self.from_password = from_password
+        self.max_size      = max_size
+        self.max_age       = max_age
+        self.keepalive     = keepalive
+
+        self._idle         = []
+        self._lock         = threading.Lock()
+        self._slots        = threading.BoundedSemaphore(max_size)
+        self._context      = None if from_password is None else ssl.create_default_context()
+        self._tls_session  = None
+
+    def _connect(self):
+        """
+        Opens a new connection to the smtp server, logging in if the pool has a password
+
+        Outputs
+            :returns: <SMTP> connected to the smtp server
+        """
+        if self.from_password is None:
+            return smtplib.SMTP(self.smtp_server or "localhost", self.smtp_port or 0)
+
+        server = _SMTP_SSL(self.smtp_server, self.smtp_port, context = self._context, session = self._tls_session)
+        server.login(self.from_email, self.from_password)
+        self._tls_session = server.sock.session
+        return server
+
+    def _healthy(self, server, created_at, last_used) -> bool:
+        """
+        Checks that an idle connection is younger than max_age and, if idle for longer than keepalive, still answers
+
+        Inputs
+            :param server: <SMTP> idle connection
+            :param created_at: <float> monotonic time the connection was opened
+            :param last_used: <float> monotonic time the connection was last returned
+
+        Outputs
+            :returns: <bool> True if the connection can be reused, False otherwise
+        """
+        now = time.monotonic()
+        if now - created_at > self.max_age: 
+            return False
+        if now - last_used > self.keepalive:
+            try: 
+                return server.noop()[0] == 250
+            except OSError: 
+                return False
+        return True
+
+    @staticmethod
+    def _close(server):
+        """ Closes a connection, ignoring a server that already hung up """
+        try: 
+            server.quit()
+        except OSError: 
+            server.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Checks out a healthy connection for the duration of the context
+
+        Outputs
+            :returns: <SMTP> connected to the smtp server
+            :raises: <OSError> if a new connection can't be opened
+        """
+        self._slots.acquire()
+        try:
+            server = None
+            while server is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    server, created_at = self._connect(), time.monotonic()
+                elif self._healthy(*entry):
+                    server, created_at = entry[0], entry[1]
+                else:
+                    self._close(entry[0])
+
+            reusable = True
+            try:
+                yield server
+            except _disconnects:
+                reusable = False
+                raise
+            except Exception:
+                try: 
+                    server.rset()
+                except OSError: 
+                    reusable = False
+                raise
+            finally:
+                if reusable:
+                    with self._lock: self._idle.append((server, created_at, time.monotonic()))
+                else:
+                    self._close(server)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """ Closes all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle: 
+            self._close(server)
 
 ##### Functions #####
+def _normalize_email(email):
+    """
+    Normalizes an email so that emails differing only by case or surrounding whitespace are equal
+
+    Inputs
+        :param email: <str> email to normalize
+
+    Outputs
+        :returns: <str> normalized email
+    """
+    return email.strip().lower()
+
+def _uuid7(milliseconds = None, random_bits = None):
+    """
+    Returns a time-ordered UUID (version 7): 48 bits of unix time in milliseconds, a 12 bit counter and 62 random bits.
+    Consecutive keys land next to each other in a B-tree index instead of on random pages like uuid4 keys
+
+    Inputs
+        :param milliseconds: optional <int> unix time of the UUID, for generating keys of a given time (e.g. seeding)
+        :param random_bits: optional <int> 74 bits filling the counter and random bits, required with milliseconds
+
+    Outputs
+        :returns: <uuid.UUID> greater than every UUID this process returned before when milliseconds is None
+    """
+    if milliseconds is None:
+        with _uuid7_lock:
+            milliseconds = max(time.time_ns() // 1000000, _uuid7_last[0])
+            if milliseconds == _uuid7_last[0]:
+                counter = _uuid7_last[1] + 1
+                if counter > 0xfff:
+                    # counter overflow: borrow the next millisecond
+                    milliseconds, counter = milliseconds + 1, 0
+            else:
+                # start low in the millisecond, leaving room to count up
+                counter = secrets.randbits(10)
+            _uuid7_last[:] = [milliseconds, counter]
+        random_bits = counter << 62 | secrets.randbits(62)
+
+    return uuid.UUID(int = (milliseconds & (1 << 48) - 1) << 80 | 7 << 76 | (random_bits >> 62 & 0xfff) << 64 | 2 << 62 | random_bits & (1 << 62) - 1)
+
+def _run_in_background(function, *args):
+    """
+    Runs function(*args) on a background thread, releasing the thread's expired database connections afterwards
+
+    Inputs
+        :param function: <callable> to run
+        :param args: arguments to call function with
+
+    Outputs
+        :returns: <Future> of the call
+    """
+    def run():
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+
+    return _background.submit(run)
+
+def _get_pool(from_email, from_password, smtp_server, smtp_port):
+    """
+    Returns the connection pool shared by every message sent from from_email through smtp_server:smtp_port
+
+    Inputs
+        :param from_email: <str> of sender's email
+        :param from_password: <str> of sender's password
+        :param smtp_server: <str> of email host's smtp server
+        :param smtp_port: <str>  port to connect to
+
+    Outputs
+        :returns: <SMTPConnectionPool> for the sender and server
+    """
+    key = (from_email, from_password, smtp_server, smtp_port)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SMTPConnectionPool(smtp_server, smtp_port, from_email, from_password,
+                                             max_size  = getattr(settings, "USER_SMTP_POOL_SIZE", 4),
+                                             max_age   = getattr(settings, "USER_SMTP_MAX_AGE", 300),
+                                             keepalive = getattr(settings, "USER_SMTP_KEEPALIVE", 30))
+        return _pools[key]
+
+@atexit.register
+def _close_pools():
+    """ Closes the idle connections of every pool """
+    with _pools_lock:
+        for pool in _pools.values(): pool.close()
+
+def _build_message(from_email, subject, text_content, html_content):
+    """
+    Builds the message sent from from_email, leaving the reciever to be set per recipient
+
+    Inputs
+        :param from_email: <str> of sender's email
+        :param subject: <str> describing the message to be sent
+        :param text_content: <str> detailing the message's text content to send 
+        :param html_content: <str> detailing the message's html content to send 
+
+    Outputs
+        :returns: <MIMEMultipart> message without a "To" header
+    """
+    message            = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"]    = from_email
+    message.attach(MIMEText(text_content, "plain"))
+    if html_content: 
+        message.attach(MIMEText(html_content, "html"))
+    return message
+
+def _send_emails(from_email, from_password, smtp_server, smtp_port, messages):
+    """
+    Sends a batch of email messages from the sender's email over one pooled connection
+
+    Inputs
+        :param from_email: <str> of sender's email
+        :param from_password: <str> of sender's password
+        :param smtp_server: <str> of email host's smtp server
+        :param smtp_port: <str>  port to connect to (usually 993)
+        :param messages: <list> of (receiver_email, subject, text_content, html_content) tuples
+
+    Outputs
+        :returns: <list> with None for every message sent and the raised <Exception> for every message that was not
+    """
+    pool      = _get_pool(from_email, from_password, smtp_server, smtp_port)
+    errors    = [None] * len(messages)
+    templates = {}
+    index     = 0
+    retried   = False
+
+    while index < len(messages):
+        try:
+            with pool.connection() as server:
+                while index < len(messages):
+                    receiver_email, subject, text_content, html_content = messages[index]
+                    content = (subject, text_content, html_content)
+                    if content not in templates: 
+                        templates[content] = _build_message(from_email, *content)
+                    message = templates[content]
+                    del message["To"]
+                    message["To"] = receiver_email
+
+                    try:
+                        with _timed("user_email_send_seconds"):
+                            server.sendmail(from_email, receiver_email, message.as_string())
+                    except _disconnects:
+                        raise
+                    except Exception as error:
+                        # only this message failed, e.g. a recipient smtplib can't encode: the rest of the batch is still sent
+                        errors[index] = error
+                        if not isinstance(error, smtplib.SMTPRecipientsRefused):
+                            # sendmail resets the session on refused recipients only, end the transaction this message left open
+                            server.rset()
+                    index += 1
+
+        except (OSError, smtplib.SMTPException) as error:
+            # the connection died or could not be opened: retry the rest of the batch once on a fresh one
+            if retried or not isinstance(error, _disconnects):
+                errors[index:] = [error] * (len(messages) - index)
+                break
+            retried = True
+
+    return errors
+
 def _send_email(from_email, from_password, reciepient_emails, smtp_server, smtp_port, subject, text_content, html_content):
     """
     Sends an email message from the sender's email to the reciever's email 
@@ -20,28 +344,49 @@ def _send_email(from_email, from_password, reciepient_emails, smtp_server, smtp_
         :param subject: <str> describing the message to be sent
         :param text_content: <str> detailing the message's text content to send 
         :param html_content: <str> detailing the message's html content to send 
+
+    Outputs
+        :raises: <Exception> raised by the smtp server if the message(s) could not be sent
+    """
+    messages = [(receiver_email, subject, text_content, html_content) for receiver_email in reciepient_emails]
+    for error in _send_emails(from_email, from_password, smtp_server, smtp_port, messages):
+        if error is not None:
+            logger.error("Error: %s", error)
+            raise error
+
+def _enqueue_email(from_email, reciepient_emails, subject, text_content, html_content):
+    """
+    Queues an email message to be sent by the outbox worker instead of sending it inline 
+
+    Inputs
+        :param from_email: <str> of sender's email
+        :param reciepient_emails: <list> of reciever emails
+        :param subject: <str> describing the message to be sent
+        :param text_content: <str> detailing the message's text content to send 
+        :param html_content: <str> detailing the message's html content to send 
+
+    Outputs
+        :returns: <list> of queued message(s), one per reciever
     """
-    try:
-        server = smtplib.SMTP("localhost")
-        if from_password is not None:
-            server = smtplib.SMTP_SSL(smtp_server, smtp_port, context = ssl.create_default_context())
-            server.login(from_email, from_password)
-            print("Successfully logged in ...")
-
-        for receiver_email in reciepient_emails:
-            print("Sending to %s" % receiver_email)
-            message            = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"]    = from_email
-            message["To"]      = receiver_email
-            part_1             = MIMEText(text_content, "plain")
-            part_2             = MIMEText(html_content, "html")
-
-            message.attach(part_1)
-            server.sendmail(from_email, receiver_email, message.as_string())
-
-    except Exception as error:
-        print("Error: %s" % error)
-        
-    finally:
-        server.quit() 
\ No newline at end of file
+    queue = getattr(settings, "USER_EMAIL_QUEUE", None)
+    if queue is None:
+        queue = apps.get_model("user", "EmailOutbox").objects.enqueue
+    else:
+        queue = import_string(queue)
+
+    return queue(from_email, reciepient_emails, subject, text_content, html_content)
+
+async def _aenqueue_email(from_email, reciepient_emails, subject, text_content, html_content):
+    """
+    Asynchronous _enqueue_email(): a USER_EMAIL_QUEUE coroutine function is awaited, a regular callable runs in a thread
+    """
+    queue = getattr(settings, "USER_EMAIL_QUEUE", None)
+    if queue is None:
+        queue = apps.get_model("user", "EmailOutbox").objects.aenqueue
+    else:
+        queue = import_string(queue)
+        if not inspect.iscoroutinefunction(queue): 
+            queue = sync_to_async(queue)
+
+    return await queue(from_email, reciepient_emails, subject, text_content, html_content)
+
@@ -1,7 +1,7 @@
 """
 test helpers
 """
-import time, email, imaplib, smtpd, traceback
+import re, email, logging, email.parser, imaplib, threading, socketserver
 from django.core.exceptions import ValidationError
 
 ##### Classes #####
@@ -15,6 +15,8 @@ class Message():
     Representation Exposure
         - all fields are exposed and immutable
     """
+    # no per instance __dict__, auditing thousands of messages keeps memory flat
+    __slots__ = ("subject", "receiver", "sender", "date", "content")
 
     ##### Representation #####
     def __init__(self, subject, receiver, sender, date, content):
@@ -37,8 +39,258 @@ class Message():
                %s
                """ % (self.receiver, self.sender, self.date, self.subject, self.content)
 
+class _CaptureServer(socketserver.ThreadingTCPServer):
+    """
+    AF(host, port) = local server listening on host:port, on a free port when port is 0, served from a daemon thread
+
+    Represnetation Invariant
+        - inherits from socketserver.ThreadingTCPServer
+
+    Representation Exposure
+        - inherits from socketserver.ThreadingTCPServer
+    """
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    ##### Representation #####
+    def __init__(self, handler, host = "127.0.0.1", port = 0):
+        super().__init__((host, port), handler)
+        self.host, self.port = self.server_address[:2]
+
+    def start(self):
+        """ Serves on a daemon thread """
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+    def stop(self):
+        """ Stops serving and closes the socket """
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class MailCaptureServer(_CaptureServer):
+    """
+    AF(host, port, messages) = local SMTP stand-in listening on host:port that captures every message sent to it in messages
+
+    Represnetation Invariant
+        - inherits from _CaptureServer
+        - messages are (sender, receivers, <email.message.Message>) in the order they were received
+        - received is notified every time a message is captured
+
+    Representation Exposure
+        - messages is exposed, and only appended to while the server runs
+    """
+
+    ##### Representation #####
+    def __init__(self, host = "127.0.0.1", port = 0):
+        super().__init__(_SMTPHandler, host, port)
+        self.messages = []
+        self.lock     = threading.Lock()
+        self.received = threading.Condition(self.lock)
+
+    def capture(self, sender, receivers, data):
+        """ Records a received message """
+        with self.received:
+            self.messages.append((sender, receivers, email.message_from_bytes(data)))
+            self.received.notify_all()
+
+    def mailbox(self, receiver):
+        """ Returns the messages sent to receiver, oldest first """
+        with self.lock:
+            return [message for _, receivers, message in self.messages if receiver in receivers]
+
+    def wait(self, receiver = None, count = 1, timeout = 5):
+        """
+        Blocks until count messages were sent to receiver, or to anyone when receiver is None
+
+        Inputs
+            :param receiver: optional <str> email the messages were sent to
+            :param count: <int> number of messages to wait for
+            :param timeout: <float> most seconds to wait
+
+        Outputs
+            :returns: <list> of the <email.message.Message> sent to receiver, fewer than count if timeout passed
+        """
+        def received():
+            return [message for _, receivers, message in self.messages if receiver is None or receiver in receivers]
+
+        with self.received:
+            self.received.wait_for(lambda: len(received()) >= count, timeout)
+            return received()
+
+class IMAPCaptureServer(_CaptureServer):
+    """
+    AF(mail, accounts) = local IMAP stand-in serving the messages captured by mail to the accounts signing in with their password
+
+    Definitions
+        mailbox
+            every message mail captured for the signed in account, whatever mailbox is selected
+
+            After logging in as jdoe@ployem.com, SELECT "[Gmail]/Spam" selects the messages sent to jdoe@ployem.com
+
+    Represnetation Invariant
+        - inherits from _CaptureServer
+        - accounts maps each email to its password
+
+    Representation Exposure
+        - accounts is exposed, accounts added while the server runs can sign in
+    """
+
+    ##### Representation #####
+    def __init__(self, mail, accounts = None, host = "127.0.0.1", port = 0):
+        super().__init__(_IMAPHandler, host, port)
+        self.mail     = mail
+        self.accounts = dict(accounts or {})
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    AF(server) = SMTP session with a client of the MailCaptureServer server, accepting every message
+
+    Representation Invariant
+        - inherits from socketserver.StreamRequestHandler
+
+    Representation Exposure
+        - inherits from socketserver.StreamRequestHandler
+    """
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        """ Override StreamRequestHandler.handle() """
+        sender, receivers = None, []
+        self._reply("220 localhost ready")
+        for line in self.rfile:
+            command = line.decode(errors = "replace").strip()
+            verb    = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self._reply("250 localhost")
+            elif verb == "MAIL":
+                sender, receivers = command.split(":", 1)[1].strip(" <>"), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                receivers.append(command.split(":", 1)[1].strip(" <>"))
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"): break
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.capture(sender, receivers, b"".join(data))
+                self._reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                sender, receivers = (None, []) if verb == "RSET" else (sender, receivers)
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    """
+    AF(server) = IMAP session with a client of the IMAPCaptureServer server, supporting what _read_email uses
+
+    Definitions
+        uid
+            the stand-in's mailboxes are only appended to, so a message's UID is its sequence number
+
+    Representation Invariant
+        - inherits from socketserver.StreamRequestHandler
+        - the selected messages are only read after a successful LOGIN and SELECT
+
+    Representation Exposure
+        - inherits from socketserver.StreamRequestHandler
+    """
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def _search(self, criteria):
+        """ Returns the sequence numbers of the selected messages matching SUBJECT / FROM / TO criteria, all for ALL """
+        filters = [(header, value.strip(")")) for header, value in 
+                   zip(*[iter(_arguments(criteria.strip("()")))]*2) if header.upper() in ("SUBJECT", "FROM", "TO")]
+        return [number for number, message in enumerate(self.selected, 1)
+                if all(value.lower() in str(message[header] or "").lower() for header, value in filters)]
+
+    def _fetch(self, sequence_set, items, uid):
+        """ Writes the FETCH responses of the selected messages in sequence_set, whole or only the header fields items asks for """
+        fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", items, re.IGNORECASE)
+        name   = ("BODY[HEADER.FIELDS (%s)]" % fields.group(1).upper() if fields else 
+                  "BODY[]" if "BODY" in items.upper() else "RFC822")
+        for number in _sequence(sequence_set, len(self.selected)):
+            message = self.selected[number - 1]
+            data    = (("".join("%s: %s\r\n" % (field, message[field]) for field in fields.group(1).split() if message[field]) + "\r\n").encode()
+                       if fields else message.as_bytes())
+            self.wfile.write(b"* %d FETCH (%s%s {%d}\r\n" % (number, b"UID %d " % number if uid else b"", name.encode(), len(data)) + data + b")\r\n")
+
+    def handle(self):
+        """ Override StreamRequestHandler.handle() """
+        account, self.selected = None, None
+        self._reply("* OK IMAP4rev1 localhost ready")
+        for line in self.rfile:
+            tag, _, command = line.decode(errors = "replace").strip().partition(" ")
+            verb, _, arguments = command.partition(" ")
+            verb = verb.upper()
+            uid  = verb == "UID"
+            if uid:
+                verb, _, arguments = arguments.partition(" ")
+                verb               = verb.upper()
+            if verb == "CAPABILITY":
+                self._reply("* CAPABILITY IMAP4rev1 AUTH=PLAIN")
+                self._reply("%s OK CAPABILITY completed" % tag)
+            elif verb == "LOGIN":
+                user, password = (_arguments(arguments) + [None, None])[:2]
+                if user in self.server.accounts and self.server.accounts[user] == password:
+                    account = user
+                    self._reply("%s OK LOGIN completed" % tag)
+                else:
+                    self._reply("%s NO [AUTHENTICATIONFAILED] Invalid credentials" % tag)
+            elif verb in ("SELECT", "EXAMINE") and account:
+                self.selected = self.server.mail.mailbox(account)
+                self._reply("* %d EXISTS" % len(self.selected))
+                self._reply("* 0 RECENT")
+                self._reply("%s OK [READ-WRITE] %s completed" % (tag, verb))
+            elif verb == "SEARCH" and self.selected is not None:
+                self._reply(" ".join(["* SEARCH"] + [str(number) for number in self._search(arguments)]))
+                self._reply("%s OK %sSEARCH completed" % (tag, "UID " if uid else ""))
+            elif verb == "FETCH" and self.selected is not None:
+                self._fetch(*arguments.split(" ", 1), uid)
+                self._reply("%s OK %sFETCH completed" % (tag, "UID " if uid else ""))
+            elif verb in ("CLOSE", "NOOP"):
+                self._reply("%s OK %s completed" % (tag, verb))
+            elif verb == "LOGOUT":
+                self._reply("* BYE logging out")
+                self._reply("%s OK LOGOUT completed" % tag)
+                return
+            else:
+                self._reply("%s BAD %s not supported in this state" % (tag, verb))
+
 ##### Functions #####
-def _read_email(from_email, from_password, smtp_server, smtp_port, mail_box, criteria = ''):
+def _sequence(sequence_set, count):
+    """ Returns the message numbers of an IMAP sequence set up to count: '1,3:4,6:*' with count 7 => [1, 3, 4, 6, 7] """
+    numbers = []
+    for part in sequence_set.split(","):
+        first, _, last = part.partition(":")
+        first, last    = [count if bound == "*" else int(bound) for bound in (first, last or first)]
+        numbers.extend(range(min(first, last), min(max(first, last), count) + 1))
+    return numbers
+
+def _arguments(text):
+    """ Splits IMAP command arguments, unquoting quoted strings: 'a "b c" \'d e\'' => ['a', 'b c', 'd e'] """
+    arguments = []
+    for match in re.finditer(r'"((?:[^"\\]|\\.)*)"|\'([^\']*)\'|(\S+)', text):
+        double, single, bare = match.groups()
+        arguments.append(re.sub(r"\\(.)", r"\1", double) if double is not None else single if single is not None else bare)
+    return arguments
+
+def _read_email(from_email, from_password, smtp_server, smtp_port, mail_box, criteria = '', ssl = True):
     """
     Returns email(s) with given subject from the given email
 
@@ -49,42 +301,65 @@ def _read_email(from_email, from_password, smtp_server, smtp_port, mail_box, cri
         :param smtp_port: <str>  port to connect to (usually 993)
         :param mail_box: <str> one of {'inbox', 'spam', 'trash', 'archive'}
         :param criteria: optional <str> specifying which message(s) to look for
+        :param ssl: optional <bool> False to connect without TLS, e.g. to an IMAPCaptureServer
     
     Outputs
         :returns: <list> of found message(s) matching criteria as Message Objects
         :raises: <ValidationError> if the email can't be accessed or read
     """
+    return list(_iter_email(from_email, from_password, smtp_server, smtp_port, mail_box, criteria, ssl))
+
+def _iter_email(from_email, from_password, smtp_server, smtp_port, mail_box, criteria = '', ssl = True, batch_size = 100, 
+                headers_only = False):
+    """
+    Yields email(s) with given subject from the given email as they are fetched, batch_size at a time by UID
+
+    Inputs
+        :param from_email: <str> of sender's email
+        :param from_password: <str> of sender's password
+        :param smtp_server: <str> of email host's smtp server
+        :param smtp_port: <str>  port to connect to (usually 993)
+        :param mail_box: <str> one of {'inbox', 'spam', 'trash', 'archive'}
+        :param criteria: optional <str> specifying which message(s) to look for
+        :param ssl: optional <bool> False to connect without TLS, e.g. to an IMAPCaptureServer
+        :param batch_size: optional <int> messages fetched per round trip
+        :param headers_only: optional <bool> True to only fetch the headers, yielding messages with empty content
+    
+    Outputs
+        :returns: <generator> of found message(s) matching criteria as Message Objects, without marking them seen
+        :raises: <ValidationError> if the email can't be accessed or read
+    """
+    parser = email.parser.BytesHeaderParser() if headers_only else email.parser.BytesParser()
+    items  = "(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM TO DATE)])" if headers_only else "(BODY.PEEK[])"
+    try:
+        mail = (imaplib.IMAP4_SSL if ssl else imaplib.IMAP4)(smtp_server, smtp_port)
+    except OSError as error:
+        raise ValidationError("Invalid Email") from error
+
     try:
-        mail = imaplib.IMAP4_SSL(smtp_server)
         mail.login(from_email, from_password)
-        mail.select(mail_box)
-
-        selected_mail = mail.search(None, criteria)[1][0].split()
-        messages      = []
-        print("There are %d message(s) with criteria: %s" % (len(selected_mail), criteria))
-
-        for mail_id in selected_mail:
-            data          = mail.fetch(mail_id, '(RFC822)')
-            bytes_data    = data[1][0][1]
-            email_message = email.message_from_bytes(bytes_data)
-
-            receiver      = email_message['to']
-            sender        = email_message['from']
-            date          = email_message['date']
-            subject       = email_message['subject']
-            content       = ""
-
-            for part in email_message.walk():
-                part_type = part.get_content_type()
-                if part_type in {"text/plain", "text/html"}:
-                    part     = part.get_payload(decode = True)
-                    content += part.decode() + "\n"
-            
-            message = Message(subject, receiver, sender, date, content)
-            messages.append(message)
-
-        return messages
+        mail.select(mail_box, readonly = True)
+
+        uids = mail.uid("SEARCH", None, criteria or "ALL")[1][0].split()
+        logger.debug("There are %d message(s) with criteria: %s", len(uids), criteria)
+
+        for start in range(0, len(uids), batch_size):
+            response = mail.uid("FETCH", b",".join(uids[start:start + batch_size]).decode(), items)[1]
+            # literals come back as (envelope, bytes) tuples, separated by the b")" closing each message
+            for _, bytes_data in (part for part in response if isinstance(part, tuple)):
+                email_message = parser.parsebytes(bytes_data)
+                content       = [] if headers_only else [part.get_payload(decode = True).decode(part.get_content_charset() or "utf-8") + "\n" 
+                                                        for part in email_message.walk() if part.get_content_type() in {"text/plain", "text/html"}]
+                yield Message(email_message['subject'], email_message['to'], email_message['from'], email_message['date'], "".join(content))
+
+        mail.logout()
     except imaplib.IMAP4.error as error:
-        print("Error: %s" % error)
+        logger.error("Error: %s", error)
         raise ValidationError("Invalid Email")
-    
\ No newline at end of file
+    finally:
+        # a caller that stops iterating early leaves the session open
+        if mail.state != "LOGOUT": 
+            mail.shutdown()
+
+##### Global Constants #####
+logger = logging.getLogger(__name__)
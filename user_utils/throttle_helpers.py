@@ -0,0 +1,185 @@
+"""
+throttle helpers
+"""
+import time, hashlib, ipaddress, threading
+from rest_framework import status
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from django.core.cache.backends.locmem import LocMemCache
+from .model_helpers import _normalize_email
+
+##### Global Constants #####
+default_rates    = {"ip"       : (30, 60),     # sign in attempts per client ip per minute
+                    "email"    : (10, 60),     # sign in attempts per email per minute
+                    "failures" : (5, 15*60)}   # failed sign ins per email per 15 minutes
+_metrics         = {"allowed" : 0, "rejected_ip" : 0, "rejected_email" : 0, "rejected_failures" : 0, "failures" : 0}
+_metrics_lock    = threading.Lock()
+_throttle_cache  = None
+
+##### Classes #####
+class SlidingWindowLimiter():
+    """
+    AF(cache, name, limit, window) = limiter allowing at most limit hits per key within any window seconds, 
+        counted in cache under name
+
+    Definitions
+        sliding window count
+            hits of the current fixed window plus the hits of the previous fixed window weighted by 
+            how much of it still overlaps the sliding window
+
+            With window = 60, 10 hits in [0, 60) and 4 hits in [60, 75) count 10 * 0.75 + 4 = 11.5 hits at t = 75
+
+    Representation Invariant
+        - limit > 0 and window > 0
+        - a key costs two counters in cache, each expiring after 2 windows
+
+    Representation Exposure
+        - counters are only changed through hit() and reset()
+    """
+
+    ##### Representation #####
+    def __init__(self, cache, name, limit, window):
+        self.cache  = cache
+        self.name   = name
+        self.limit  = limit
+        self.window = window
+
+    def _keys(self, key, now):
+        """ Returns the cache keys of the current and previous fixed windows of key """
+        digest = hashlib.md5(key.encode()).hexdigest()
+        index  = int(now // self.window)
+        return "throttle:%s:%s:%d" % (self.name, digest, index), "throttle:%s:%s:%d" % (self.name, digest, index - 1)
+
+    def count(self, key) -> float:
+        """
+        Returns the sliding window count of key's hits
+        """
+        now               = time.time()
+        current, previous = self._keys(key, now)
+        counts            = self.cache.get_many([current, previous])
+        overlap           = 1 - (now % self.window) / self.window
+        return counts.get(previous, 0) * overlap + counts.get(current, 0)
+
+    def allowed(self, key) -> bool:
+        """
+        Returns True if key is under the limit, False otherwise
+        """
+        return self.count(key) < self.limit
+
+    def hit(self, key):
+        """
+        Records a hit for key
+        """
+        current, _ = self._keys(key, time.time())
+        if not self.cache.add(current, 1, 2*self.window):
+            try:
+                self.cache.incr(current)
+            except ValueError:
+                # the counter expired between add and incr
+                self.cache.set(current, 1, 2*self.window)
+
+    def reset(self, key):
+        """
+        Forgets the hits recorded for key
+        """
+        self.cache.delete_many(self._keys(key, time.time()))
+
+##### Functions #####
+def _get_limiter(name):
+    """
+    Returns the sign in limiter name, configured by USER_SIGNIN_RATES and counting in the USER_THROTTLE_CACHE_ALIAS cache
+
+    Inputs
+        :param name: <str> one of {'ip', 'email', 'failures'}
+
+    Outputs
+        :returns: <SlidingWindowLimiter> for name
+    """
+    global _throttle_cache
+    if _throttle_cache is None:
+        alias           = getattr(settings, "USER_THROTTLE_CACHE_ALIAS", None)
+        _throttle_cache = caches[alias] if alias is not None else LocMemCache("user-throttle", {"OPTIONS" : {"MAX_ENTRIES" : 100000}})
+
+    limit, window = {**default_rates, **getattr(settings, "USER_SIGNIN_RATES", {})}[name]
+    return SlidingWindowLimiter(_throttle_cache, name, limit, window)
+
+def _count(metric):
+    """ Increments metric """
+    with _metrics_lock:
+        _metrics[metric] += 1
+
+def _client_ip(request):
+    """
+    Returns the ip of the client that made request: REMOTE_ADDR, or the address the NUM_PROXIES trusted proxies 
+    in front of the server put in X-Forwarded-For when REST_FRAMEWORK sets NUM_PROXIES. A client can send any 
+    X-Forwarded-For, so it is never read otherwise
+
+    Inputs
+        :param request: <HttpRequest> made by the client
+
+    Outputs
+        :returns: <str> the client's ip, None if it is not a valid ip address
+    """
+    address   = request.META.get("REMOTE_ADDR")
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if api_settings.NUM_PROXIES and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        address   = addresses[-min(api_settings.NUM_PROXIES, len(addresses))]
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return None
+
+def _throttle_sign_in(request, email):
+    """
+    Checks a sign in attempt against the client ip, email and failed sign in limits before any password is hashed,
+    recording the attempt if it is allowed
+
+    Inputs
+        :param request: <HttpRequest> signing in
+        :param email: <str> email signing in
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK if the attempt is allowed
+                         ... HTTP_429_TOO_MANY_REQUESTS if the client ip or email is over its limit
+    """
+    ip       = _client_ip(request) or "unknown"
+    email    = _normalize_email(email)
+    limiters = [("ip", ip), ("email", email), ("failures", email)]
+
+    for name, key in limiters:
+        if not _get_limiter(name).allowed(key):
+            _count("rejected_%s" % name)
+            return status.HTTP_429_TOO_MANY_REQUESTS
+
+    _get_limiter("ip").hit(ip)
+    _get_limiter("email").hit(email)
+    _count("allowed")
+    return status.HTTP_200_OK
+
+def _record_sign_in(request, email, succeeded):
+    """
+    Feeds the outcome of an allowed sign in attempt to the failed sign in limit
+
+    Inputs
+        :param request: <HttpRequest> signing in
+        :param email: <str> email signing in
+        :param succeeded: <bool> True if the user was authenticated, False otherwise
+    """
+    if succeeded:
+        _get_limiter("failures").reset(_normalize_email(email))
+    else:
+        _get_limiter("failures").hit(_normalize_email(email))
+        _count("failures")
+
+def _throttle_metrics():
+    """
+    Returns the sign in throttle counters of this process
+
+    Outputs
+        :returns: <dict> counting allowed attempts, attempts rejected by each limit and failed sign ins
+    """
+    with _metrics_lock:
+        return dict(_metrics)
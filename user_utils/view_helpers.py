@@ -1,19 +1,96 @@
 """
 view helpers 
 """
+import re, json, datetime
 from rest_framework import status
-from django.core.validators import RegexValidator 
+from django.core.validators import RegexValidator, validate_email
 from django.core.exceptions import ValidationError
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 ##### Global Constants #####
 months             = {1 : "JAN", 2 : "FEB", 3 : "MAR", 4 : "APR", 
                       5 : "MAY", 6 : "JUN", 7 : "JUL", 8 : "AUG", 
                       9 : "SEP", 10 : "OCT", 11 : "NOV", 12 : "DEC"}
-date_regex         = "^(19\d\d|20[01][01])[-](0[1-9]|1[012])[-](0[1-9]|[12][0-9]|3[01])$"
-password_regex     = "^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$"
+date_regex         = r"^(19\d\d|20(?:0\d|1[01]))[-](0[1-9]|1[012])[-](0[1-9]|[12][0-9]|3[01])$"
+password_regex     = r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$"
+code_regex         = r"^P-[0-9a-f]{8}$"
 
+_date_pattern      = re.compile(date_regex)
+_code_pattern      = re.compile(code_regex)
 _validate_password = RegexValidator(password_regex)
-_leap_year         = lambda year : year % 4 == 0
+_earliest_date     = datetime.date(1900, 1, 1)
+_latest_date       = datetime.date(2011, 12, 31)
+
+##### Classes #####
+class PayloadSchema():
+    """
+    AF(fields) = validator of request payloads holding every field in fields, each parsed once by its parser
+
+    Definitions
+        parser
+            callable taking a raw field value and returning the cleaned value or raising ValidationError
+
+            _validate_date parses "2001-11-22" into date(2001, 11, 22)
+
+    Representation Invariant
+        - fields maps each payload field to the (name, parser) of its cleaned value
+
+    Representation Exposure
+        - fields is immutable
+    """
+
+    ##### Representation #####
+    def __init__(self, **fields):
+        self.fields = tuple((field, name, parser) for field, (name, parser) in fields.items())
+
+    def validate(self, payload):
+        """
+        Parses every field of payload, collecting all errors instead of stopping at the first
+
+        Inputs
+            :param payload: <dict> of request fields
+
+        Outputs
+            :returns: <dict> of cleaned values by name, <dict> of error messages by payload field and 
+                      Status ...
+                             ... HTTP_200_OK if every field is present and valid
+                             ... HTTP_400_BAD_REQUEST if payload is not an object or fields are missing
+                             ... HTTP_412_PRECONDITION_FAILED if one ore more of the fields don't meet their precondition(s)  
+        """
+        if not isinstance(payload, dict):
+            return {}, {"payload" : ["Expected an object."]}, status.HTTP_400_BAD_REQUEST
+
+        cleaned, errors, missing = {}, {}, False
+        for field, name, parser in self.fields:
+            if field not in payload:
+                errors[field] = ["This field is required."]
+                missing       = True
+                continue
+            try:
+                cleaned[name] = parser(payload[field])
+            except ValidationError as error:
+                errors[field] = error.messages
+
+        if missing: 
+            return cleaned, errors, status.HTTP_400_BAD_REQUEST
+        return cleaned, errors, status.HTTP_412_PRECONDITION_FAILED if errors else status.HTTP_200_OK
+
+    def validate_many(self, payloads):
+        """
+        Validates a batch of payloads
+
+        Inputs
+            :param payloads: <list> of request payloads
+
+        Outputs
+            :returns: <list> of the (cleaned, errors, status) validate() returns for each payload, in order
+        """
+        validate = self.validate
+        return [validate(payload) for payload in payloads]
 
 ##### Functions #####
 def _validate_date(date):
@@ -21,24 +98,80 @@ def _validate_date(date):
     Validates that a date is within 1900-01-01 through 2011-12-31 
 
     Inputs
-        :param date: <str> formatted as YYYY-MM-DD
+        :param date: <str> formatted as YYYY-MM-DD or <date>
     
     Outputs
+        :returns: <date> parsed date
         :raises: <ValidationError> if the date is formatted incorrectly or the date does not exist 
     """
-    RegexValidator(date_regex)(date)
+    if isinstance(date, datetime.date):
+        if not _earliest_date <= date <= _latest_date:
+            raise ValidationError("%s is not within 1900-01-01 through 2011-12-31" % date)
+        return date
 
-    day   = date.day
-    year  = date.year
-    month = months[date.month + 1]
+    match = _date_pattern.match(date) if isinstance(date, str) else None
+    if match is None:
+        raise ValidationError("Date must be formatted as YYYY-MM-DD within 1900-01-01 through 2011-12-31")
 
-    if month == "FEB":
-        if day > 29 or (not _leap_year(year) and day == 29): 
-            raise ValidationError("FEB %d is not a valid day in %d" % (day, year))
+    year, month, day = map(int, match.groups())
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        raise ValidationError("%s %d is not a valid day in %d" % (months[month], day, year))
 
-    elif month in ["APR", "JUN", "SEP", "NOV"]:
-        if day == 31: 
-            raise ValidationError("%s 31st is not a valid day" % month)
+def _validate_text(max_length):
+    """
+    Returns a parser of non-empty strings of at most max_length characters
+
+    Inputs
+        :param max_length: <int> maximum length of the string
+
+    Outputs
+        :returns: <function> parsing a value into a stripped <str>
+    """
+    def parser(value):
+        if not isinstance(value, str) or not value.strip():
+            raise ValidationError("Expected a non-empty string.")
+        if len(value) > max_length:
+            raise ValidationError("Ensure this value has at most %d characters." % max_length)
+        return value.strip()
+
+    return parser
+
+def _validate_string(value):
+    """ Parses any string, e.g. a password to check rather than to set """
+    if not isinstance(value, str):
+        raise ValidationError("Expected a string.")
+    return value
+
+def _validate_new_password(value):
+    """ Parses a password meeting the password precondition """
+    _validate_password(_validate_string(value))
+    return value
+
+def _validate_email(value):
+    """ Parses a well formed email """
+    validate_email(_validate_string(value))
+    return value
+
+def _validate_code(value):
+    """ Parses a verification code formatted as P-xxxxxxxx """
+    if not isinstance(value, str) or not _code_pattern.match(value):
+        raise ValidationError("Verification code must be formatted as P-xxxxxxxx.")
+    return value
+
+##### Schemas #####
+signup_schema      = PayloadSchema(firstName   = ("first_name", _validate_text(26)),
+                                   lastName    = ("last_name", _validate_text(52)),
+                                   dateOfBirth = ("date_of_birth", _validate_date),
+                                   email       = ("email", _validate_email),
+                                   password    = ("password", _validate_new_password))
+signin_schema      = PayloadSchema(email       = ("email", _validate_string),
+                                   password    = ("password", _validate_string))
+verify_schema      = PayloadSchema(email       = ("email", _validate_string))
+available_schema   = PayloadSchema(email       = ("email", _validate_email))
+confirm_schema     = PayloadSchema(email       = ("email", _validate_string),
+                                   verificationCode = ("verification_code", _validate_code))
 
 def _is_subset(required_fields, request_fields):
     """
@@ -62,4 +195,24 @@ def _is_subset(required_fields, request_fields):
     for field in required_fields:
         if field not in request_fields: 
             return status.HTTP_400_BAD_REQUEST
-    return status.HTTP_200_OK
\ No newline at end of file
+    return status.HTTP_200_OK
+
+def _read_data(request):
+    """
+    Reads the fields of a request that was not parsed by REST framework (i.e. sent to an async view)
+
+    Inputs
+        :param request: <HttpRequest> with a JSON or form encoded body
+
+    Outputs
+        :returns: <dict> of the request fields, empty if the body can't be parsed
+    """
+    if request.content_type == "application/json":
+        try:
+            data = (orjson or json).loads(request.body or b"{}")
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    return request.POST.dict()
+
@@ -1,19 +1,36 @@
 """
 user views
 """
-import json
-from .models import CustomUser
+import json, logging
+from .models import CustomUser, VerificationCode, SignInEvent
 from rest_framework import status
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from .user_utils.view_helpers import _is_subset
+from rest_framework.permissions import IsAdminUser
+from .parsers import _parser_classes
+from .renderers import _renderer_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes, renderer_classes
+from .user_utils.view_helpers import _is_subset, signup_schema, signin_schema, verify_schema, confirm_schema, available_schema
+from .user_utils.bloom_helpers import _email_filter
+from .user_utils.model_helpers import _normalize_email
+from .user_utils.metric_helpers import _render_metrics
+from .user_utils.audit_helpers import _audit_sign_in
+from .user_utils.throttle_helpers import _throttle_sign_in, _record_sign_in, _throttle_metrics
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 
+##### Global Constants #####
+logger    = logging.getLogger(__name__)
+parsers   = _parser_classes()
+renderers = _renderer_classes()
+
 @api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
 def sign_up(request, *args, **kwargs) -> Response:
     """
     Signs a user up
@@ -26,26 +43,94 @@ def sign_up(request, *args, **kwargs) -> Response:
                          ... HTTP_201_CREATED if the user is signed up successfully
                          ... HTTP_403_FORBIDDEN if email is unreachable 
                          ... HTTP_412_PRECONDITION_FAILED if one ore more of the request fields don't meet their precondition(s)  
+                  with the errors of every invalid field
     """
-    signup_fields = ["firstName", "lastName", "dateOfBirth", "email", "password"]
-    print(request.data)
-    user_status   = _is_subset(signup_fields, request.data.keys())
+    cleaned, errors, user_status = signup_schema.validate(request.data)
 
     if user_status == status.HTTP_200_OK:
-        email         = request.data['email']
-        password      = request.data['password']
-        last_name     = request.data['lastName']
-        first_name    = request.data['firstName']
-        date_of_birth = request.data['dateOfBirth']
-        print(f"Signing up user {first_name} {last_name} born on {date_of_birth}")
-        user, user_status  = CustomUser.objects.create(first_name, last_name, date_of_birth, email, password)
+        logger.debug("Signing up user %s %s born on %s", cleaned['first_name'], cleaned['last_name'], cleaned['date_of_birth'])
+        user, user_status = CustomUser.objects.create(**cleaned)
 
-    return Response(status = user_status)
+    return Response(errors or None, status = user_status)
+
+@api_view(['GET'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
+def email_available(request, *args, **kwargs) -> Response:
+    """
+    Checks if an email can still be signed up with, e.g. while it is typed in the signup form
+
+    Definitions
+        filter
+            in-memory Bloom filter of the normalized emails of every user
+
+            An email the filter has never seen is available without a query, one it may have seen is looked up
+
+    Inputs    
+        :param request: <HttpRequest> with an email query parameter
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK with available True if no user has the email, False otherwise
+                         ... HTTP_400_BAD_REQUEST if the email is missing
+                         ... HTTP_412_PRECONDITION_FAILED if the email is not well formed
+    """
+    cleaned, errors, user_status = available_schema.validate(request.query_params.dict())
+
+    if user_status != status.HTTP_200_OK:
+        return Response(errors, status = user_status)
+
+    email     = cleaned['email']
+    available = (not _email_filter.might_contain(email) or 
+                 not CustomUser.objects.filter(email_normalized = _normalize_email(email)).exists())
+    return Response({"available" : available}, status = status.HTTP_200_OK)
+
+@api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
+@permission_classes([IsAdminUser])
+def sign_up_bulk(request, *args, **kwargs) -> Response:
+    """
+    Signs a batch of users up, e.g. the members of a partner organisation
+
+    Inputs    
+        :param request: <HttpRequest> from a staff user containing users, a list of up to USER_BULK_SIGNUP_LIMIT 
+                        firstName, lastName, dateOfBirth (YYYY-MM-DD), email and password objects
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK with the results, the email, sign up status and any errors of every user in order
+                         ... HTTP_400_BAD_REQUEST if the body is not an object, or users is missing, not a list or longer 
+                                                     than USER_BULK_SIGNUP_LIMIT
+                         ... HTTP_403_FORBIDDEN if the request is not from a staff user
+    """
+    users         = request.data.get("users") if isinstance(request.data, dict) else None
+    limit         = getattr(settings, "USER_BULK_SIGNUP_LIMIT", 10000)
+
+    if not isinstance(users, list) or len(users) > limit:
+        return Response(status = status.HTTP_400_BAD_REQUEST)
+
+    validated     = signup_schema.validate_many(users)
+    rows          = [(cleaned["first_name"], cleaned["last_name"], cleaned["date_of_birth"], cleaned["email"], cleaned["password"])
+                     for cleaned, _, user_status in validated if user_status == status.HTTP_200_OK]
+    created       = iter(CustomUser.objects.bulk_create_users(rows))
+    results       = []
+    for user, (_, errors, user_status) in zip(users, validated):
+        result = {"email" : user.get("email") if isinstance(user, dict) else None}
+        if user_status == status.HTTP_200_OK:
+            result["status"] = next(created)[1]
+        else:
+            result["status"], result["errors"] = user_status, errors
+        results.append(result)
+
+    return Response({"results" : results}, status = status.HTTP_200_OK)
 
 @api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
 def send_verify(request, *args, **kwargs) -> HttpResponse:
     """
-    Sends a verification code to email
+    Queues a verification code to be sent to email
 
     Inputs    
         :param request: <HttpRequest> with email of user to send the verification to
@@ -54,13 +139,11 @@ def send_verify(request, *args, **kwargs) -> HttpResponse:
         :returns: Status ... HTTP_200_OK if the user exists 
                          ... HTTP_404_NOT_FOUND if the user does not exists 
     """
-    verify_fields         = ["email"]
-    user_status           = _is_subset(verify_fields, request.data.keys())
+    cleaned, _, user_status = verify_schema.validate(request.data)
 
     if user_status == status.HTTP_200_OK:
-        email = request["request"]
         try: 
-            user  = CustomUser.objects.get(email = email)
+            user  = CustomUser.objects.get_by_natural_key(cleaned["email"])
             user.send_verification_code()  
         except ObjectDoesNotExist:
             user_status = status.HTTP_404_NOT_FOUND
@@ -68,6 +151,8 @@ def send_verify(request, *args, **kwargs) -> HttpResponse:
     return Response(status = user_status)
 
 @api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
 def confirm_verify(request, *args, **kwargs) -> HttpResponse:
     """
     Verifies a user by checking the verification code they provided against the code sent 
@@ -87,24 +172,19 @@ def confirm_verify(request, *args, **kwargs) -> HttpResponse:
                          ... HTTP_202_ACCEPTED if the user is verfied
                          ... HTTP_403_FORBIDDEN if the user is not verified 
     """
-    verify_fields         = ["email", "verificationCode"]
-    user_status           = _is_subset(verify_fields, request.data.keys())
+    cleaned, _, user_status = confirm_schema.validate(request.data)
+    if user_status == status.HTTP_412_PRECONDITION_FAILED:
+        # a malformed code is just a wrong code
+        user_status       = status.HTTP_403_FORBIDDEN
 
     if user_status == status.HTTP_200_OK:
-        email             = request.data['email']
-        verification_code = request.data['verificationCode']
-        user              = CustomUser.objects.get(email = email)
-    
-        if verification_code != "P-" + str(user.verification_code)[:8]:
-            user_status   = status.HTTP_403_FORBIDDEN
-        else:
-            user.verified = True
-            user.save()
-            user_status   = status.HTTP_202_ACCEPTED
+        user_status = VerificationCode.objects.confirm(cleaned['email'], cleaned['verification_code'])
     
     return Response(status = user_status)
 
 @api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
 def sign_in(request, *args, **kwargs) -> HttpResponse:
     """
     Signs a user in
@@ -122,29 +202,81 @@ def sign_in(request, *args, **kwargs) -> HttpResponse:
         :returns: Status ...
                          ... HTTP_200_OK if the user is authenticated
                          ... HTTP_403_FORBIDDEN if the user is unauthenticated 
+                         ... HTTP_429_TOO_MANY_REQUESTS if the client or email made too many (failed) attempts
     """
-    verify_fields         = ["email", "password"]
-    user_status           = _is_subset(verify_fields, request.data.keys())
+    cleaned, _, user_status = signin_schema.validate(request.data)
+
+    if user_status == status.HTTP_200_OK:
+        email       = cleaned['email']
+        password    = cleaned['password']
+        user_status = _throttle_sign_in(request, email)
+        if user_status == status.HTTP_429_TOO_MANY_REQUESTS:
+            _audit_sign_in(request, email, SignInEvent.THROTTLED)
 
     if user_status == status.HTTP_200_OK:
-        email    = request.data['email']
-        password = request.data['password']
         user     = authenticate(username = email, password = password)
+        _record_sign_in(request, email, user is not None)
     
         if user is None:
-            print("User not found")
+            logger.debug("User not found")
+            _audit_sign_in(request, email, SignInEvent.FAILED)
             user_status = status.HTTP_403_FORBIDDEN
         elif not user.verified:
-            print("User not verified")
+            logger.debug("User not verified")
+            _audit_sign_in(request, email, SignInEvent.UNVERIFIED, user)
             user_status = status.HTTP_403_FORBIDDEN
         else:
             login(request, user)
+            _audit_sign_in(request, email, SignInEvent.SUCCEEDED, user)
             user_status = status.HTTP_200_OK
     
     return Response(status = user_status)
 
+@api_view(['GET'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
+@permission_classes([IsAdminUser])
+def throttle_metrics(request, *args, **kwargs) -> Response:
+    """
+    Reports the sign in throttle counters of the process serving the request
+
+    Inputs    
+        :param request: <HttpRequest> from a staff user
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK with the counts of allowed attempts, attempts rejected by each limit and failed sign ins
+                         ... HTTP_403_FORBIDDEN if the request is not from a staff user
+    """
+    return Response(_throttle_metrics(), status = status.HTTP_200_OK)
+
+def metrics(request, *args, **kwargs) -> HttpResponse:
+    """
+    Exposes the latency, query, password hashing, email and sign in throttle metrics of the process serving the request 
+    to Prometheus
+
+    Inputs    
+        :param request: <HttpRequest> from the Prometheus scraper, with an Authorization: Bearer USER_METRICS_TOKEN header,
+                        or from a staff user
+
+    Outputs
+        :returns: Status ...
+                         ... HTTP_200_OK with the metrics in the Prometheus text exposition format
+                         ... HTTP_403_FORBIDDEN if the request has neither the token nor a staff user
+    """
+    token = getattr(settings, "USER_METRICS_TOKEN", None)
+    if not (token and constant_time_compare(request.headers.get("Authorization", ""), "Bearer " + token)):
+        user = getattr(request, "user", None)
+        if user is None or not user.is_staff:
+            return HttpResponse(status = status.HTTP_403_FORBIDDEN)
+
+    counters = [("user_signin_throttle_total", "Sign in attempts by throttle outcome", "outcome", _throttle_metrics())]
+    return HttpResponse(_render_metrics(counters), content_type = "text/plain; version=0.0.4; charset=utf-8")
+
 @login_required   
 @api_view(['POST'])
+@parser_classes(parsers)
+@renderer_classes(renderers)
 def sign_out(request, *args, **kwargs) -> HttpResponse: 
     """
     Signs a user in